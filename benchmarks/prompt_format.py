@@ -0,0 +1,38 @@
+"""
+Microbenchmark of ChatPromptTemplate formatting : per-message MessageTemplate.format
+(the previous ChatPromptTemplate.format path) against the compiled renderer.
+
+    python -m benchmarks.prompt_format
+"""
+import timeit
+
+from cadenai.prompt_manager.template import ChatPromptTemplate
+from cadenai.prompt_manager.prompt_list import RETRIEVAL_PROMPT
+
+KWARGS = {
+    "identity" : "Nice bot created by Cadenai",
+    "language" : "English",
+    "knowledge" : "Paris is the capital of France.\n" * 20,
+    "user_input" : "What is the capital of France ?",
+}
+
+def main(number : int = 20000) :
+    prompt_template = ChatPromptTemplate.from_messages(
+        input_variables=list(KWARGS),
+        messages=[
+            ("system", RETRIEVAL_PROMPT),
+            ("human", "{user_input}"),
+        ]
+    )
+
+    print(f"{'syntax':<10}{'per message (us)':>20}{'compiled (us)':>20}{'speedup':>10}")
+    for syntax in ["openai", "mistral", "cadenai"] :
+        per_message = timeit.timeit(
+            lambda : [message_template.format(syntax=syntax, **KWARGS) for message_template in prompt_template.messages_template],
+            number=number
+        )
+        compiled = timeit.timeit(lambda : prompt_template.format(syntax=syntax, **KWARGS), number=number)
+        print(f"{syntax:<10}{per_message / number * 1e6:>20.2f}{compiled / number * 1e6:>20.2f}{per_message / compiled:>9.1f}x")
+
+if __name__ == "__main__" :
+    main()
@@ -0,0 +1,75 @@
+"""
+Memory footprint, query latency and recall@k of each NumpyVectorDB index mode, on random clustered vectors.
+
+    python -m benchmarks.vector_index --size 100000 --dimension 1536
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from cadenai.schema import DocumentHandler, Embeddings
+from cadenai.vectorization.vector_db import NumpyVectorDB
+
+class ArrayEmbeddings(Embeddings) :
+    """Fake embedder : the text of a document is the row of its vector"""
+
+    def __init__(self, vectors : np.ndarray) :
+        self.vectors = vectors
+        self.dimension = vectors.shape[1]
+
+    def embed_query(self, text : str) :
+        return self.vectors[int(text)]
+
+    def embed_documents(self, documents, loading_bar : bool = False) :
+        return self.vectors[[int(document.page_content) for document in documents]]
+
+def random_vectors(size : int, dimension : int, seed : int = 0) -> np.ndarray :
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, size // 1000), dimension))
+    return (centers[rng.integers(0, len(centers), size=size)] + 0.5 * rng.normal(size=(size, dimension))).astype(np.float32)
+
+def main() :
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    vectors = random_vectors(args.size, args.dimension)
+    embedder = ArrayEmbeddings(vectors)
+    queries = [str(query) for query in np.random.default_rng(1).choice(args.size, args.queries, replace=False)]
+
+    with tempfile.TemporaryDirectory() as path :
+        NumpyVectorDB(embedder=embedder, path=path).add_documents(
+            (DocumentHandler(page_content=str(i)) for i in range(args.size)), batch_size=10000
+        )
+
+        exact_results = None
+        print(f"{'index':<8}{'index MB':>10}{'vectors MB':>12}{'build s':>9}{'p50 ms':>9}{'p95 ms':>9}{'recall@' + str(args.limit):>11}")
+        for index in ["exact", "int8", "binary", "ivf"] :
+            vector_db = NumpyVectorDB(embedder=embedder, path=path, index=index)
+
+            build_start = time.perf_counter()
+            vector_db.similarity_search(queries[0], limit=args.limit)
+            build_time = time.perf_counter() - build_start
+
+            latencies = []
+            results = []
+            for query in queries :
+                start = time.perf_counter()
+                results.append(set(vector_db.similarity_search(query, limit=args.limit)))
+                latencies.append(time.perf_counter() - start)
+
+            if exact_results is None :
+                exact_results = results
+            recall = np.mean([len(result & expected) / args.limit for result, expected in zip(results, exact_results)])
+
+            stats = vector_db.index_stats()
+            print(f"{index:<8}{stats['index_bytes'] / 1e6:>10.1f}{stats['vectors_bytes'] / 1e6:>12.1f}{build_time:>9.2f}"
+                  f"{np.percentile(latencies, 50) * 1e3:>9.2f}{np.percentile(latencies, 95) * 1e3:>9.2f}{recall:>11.3f}")
+
+if __name__ == "__main__" :
+    main()
@@ -1,2 +1,3 @@
 from .llm_chain import LLMChain
+from .semantic_cache import SemanticCache
 from .retrieval_chain import RetrievalChain
\ No newline at end of file
@@ -1,27 +1,105 @@
 from ..schema import BasePromptTemplate, LLM
+from .. import tracing
 
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import time
+from tqdm import tqdm
 
 class LLMChain():
 
-    def __init__(self, 
-                 llm : LLM, 
+    def __init__(self,
+                 llm : LLM,
                  prompt_template : BasePromptTemplate,
                  max_tokens : int = 256,
                  ) -> None:
-        
+
         self.llm = llm
         self.prompt_template = prompt_template
         self.max_tokens = max_tokens
+        self.last_runs_stats = None
+
+    def run(self, stream : bool = False, **kwargs) :
+        # With stream=True the span ends when the stream is returned, the streaming itself is in the llm.completion span
+        with tracing.span("chain.run", chain=type(self).__name__, stream=stream) :
+            prompt = self.prompt_template.format(syntax=self.llm._prompt_syntax,**kwargs)
+            return self.llm.get_completion(prompt=prompt, max_tokens=self.max_tokens, stream=stream)
+
+    def multiple_runs(self,
+                      input_list : List,
+                      stream : bool = False,
+                      max_workers : int = 1,
+                      raise_on_error : bool = False,
+                      loading_bar : bool = False
+                      ) :
+        '''Run the chain for each input, with up to max_workers runs at the same time.
+        The outputs keep the input order. A failed run returns its exception instead of aborting the batch, unless raise_on_error.'''
+
+        start = time.perf_counter()
+        run = functools.partial(self._safe_run, stream=stream, raise_on_error=raise_on_error)
+
+        if max_workers > 1 :
+            with ThreadPoolExecutor(max_workers=max_workers) as executor :
+                outputs = executor.map(run, input_list)
+                if loading_bar :
+                    outputs = tqdm(outputs, total=len(input_list), desc="Running chain")
+                output_list = list(outputs)
+        else :
+            inputs = tqdm(input_list, desc="Running chain") if loading_bar else input_list
+            output_list = [run(input_variables) for input_variables in inputs]
+
+        self._save_runs_stats(output_list, time.perf_counter() - start)
+        return output_list
+
+    async def arun(self, stream : bool = False, **kwargs) :
+        '''Async version of run, the blocking LLM call is made in a worker thread'''
+        return await asyncio.to_thread(functools.partial(self.run, stream=stream, **kwargs))
+
+    async def amultiple_runs(self,
+                             input_list : List,
+                             stream : bool = False,
+                             max_concurrency : int = 8,
+                             raise_on_error : bool = False,
+                             loading_bar : bool = False
+                             ) :
+        '''Async version of multiple_runs, with at most max_concurrency runs in flight'''
+
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        progress_bar = tqdm(total=len(input_list), desc="Running chain") if loading_bar else None
+
+        async def run_one(input_variables) :
+            async with semaphore :
+                try :
+                    return await self.arun(stream=stream, **input_variables)
+                finally :
+                    if progress_bar is not None :
+                        progress_bar.update(1)
 
-    def run(self, stream : bool = False, **kwargs) : 
-        prompt = self.prompt_template.format(syntax=self.llm._prompt_syntax,**kwargs)
-        return self.llm.get_completion(prompt=prompt, max_tokens=self.max_tokens, stream=stream)
+        try :
+            output_list = await asyncio.gather(*(run_one(input_variables) for input_variables in input_list), return_exceptions=not raise_on_error)
+        finally :
+            if progress_bar is not None :
+                progress_bar.close()
 
-    def multiple_runs(self, input_list : List, stream : bool = False) : 
-        output_list = []
-        for input_variables in input_list : 
-            output_list.append(self.run(**input_variables, stream=stream))
+        self._save_runs_stats(output_list, time.perf_counter() - start)
         return output_list
 
+    def _safe_run(self, input_variables : dict, stream : bool = False, raise_on_error : bool = False) :
+        try :
+            return self.run(**input_variables, stream=stream)
+        except Exception as error :
+            if raise_on_error :
+                raise
+            return error
 
+    def _save_runs_stats(self, output_list : List, duration : float) :
+        errors = sum(1 for output in output_list if isinstance(output, Exception))
+        self.last_runs_stats = {
+            "runs" : len(output_list),
+            "errors" : errors,
+            "duration" : duration,
+            "runs_per_second" : len(output_list) / duration if duration > 0 else 0.0
+        }
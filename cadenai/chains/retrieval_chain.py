@@ -1,18 +1,32 @@
 import json
+import inspect
+from typing import Any, List, Optional, Set, TYPE_CHECKING
 from . import LLMChain
-from ..llm.openai import ChatOpenAI
+from .semantic_cache import SemanticCache
+from ..encoder import OpenAIEncoder, LazyEncoder
+from ..schema import VectorDB
+from .. import tracing
 from ..prompt_manager.template import ChatPromptTemplate
 from ..prompt_manager.prompt_list import RETRIEVAL_PROMPT, RETRIEVAL_PROMPT_WITH_METADATA
-from ..vectorization.vector_db import VectorDB
+
+if TYPE_CHECKING :
+    from ..llm.openai import ChatOpenAI
 
 class RetrievalChain(LLMChain) : 
 
+    encoder = LazyEncoder()
+
     def __init__(self,
-                 llm : ChatOpenAI,
+                 llm : "ChatOpenAI",
                  vector_db : VectorDB,
                  identity : str = "Nice bot created by Cadenai",
                  language : str = "English",
-                 include_metadata : bool = False
+                 include_metadata : bool = False,
+                 answer_cache : Optional[SemanticCache] = None,
+                 context_token_budget : Optional[int] = None,
+                 fetch_limit : int = 20,
+                 duplicate_threshold : float = 0.8,
+                 encoder : Optional[OpenAIEncoder] = None
                  ) -> None :
 
         self.identity = identity
@@ -20,6 +34,12 @@ class RetrievalChain(LLMChain) :
         self.vector_db = vector_db
         self.llm = llm
         self.include_metadata = include_metadata
+        self.answer_cache = answer_cache #Cached answers are returned without retrieval nor LLM call
+        self.context_token_budget = context_token_budget #With a budget, the knowledge is packed, see _pack_knowledge
+        self.fetch_limit = fetch_limit
+        self.duplicate_threshold = duplicate_threshold
+        self._encoder = encoder
+        self.last_context_tokens = None
         
         self.llm.temperature = 0
         if not self.llm._prompt_syntax == "openai" : 
@@ -40,19 +60,103 @@ class RetrievalChain(LLMChain) :
 
     def run(self, user_input : str, stream : bool = False) : 
 
-        knowledge = self._retrieve_knowledge_from_vector_db(user_input)
+        with tracing.span("retrieval_chain.run", stream=stream) as span :
+            if self.answer_cache is None :
+                knowledge = self._traced_retrieval(user_input)
+                return super().run(identity=self.identity, language=self.language, knowledge=knowledge, user_input=user_input, stream=stream)
+
+            answer, query_vector = self.answer_cache.lookup(user_input)
+            span.set(cache_hits=int(answer is not None))
+            if answer is not None :
+                return self.answer_cache.replay(answer) if stream else answer
 
-        return super().run(identity=self.identity, language=self.language, knowledge=knowledge, user_input=user_input, stream=stream)
+            # The cache's query embedding replaces the search one, only if it comes from the same embedder
+            reusable_vector = query_vector if self._can_reuse_query_vector() else None
+            knowledge = self._traced_retrieval(user_input, query_vector=reusable_vector)
+            completion = super().run(identity=self.identity, language=self.language, knowledge=knowledge, user_input=user_input, stream=stream)
+
+            if stream :
+                return self.answer_cache.record_stream(user_input, completion, query_vector)
+            self.answer_cache.set(user_input, completion, query_vector)
+            return completion
     
-    def _retrieve_knowledge_from_vector_db(self, user_input : str, use_metadata : bool = False) : 
+
+    def _can_reuse_query_vector(self) -> bool :
+        cache_embedder = self.answer_cache.embedder
+        if cache_embedder is None or not same_embedder(cache_embedder, getattr(self.vector_db, "embedder", None)) :
+            return False
+        parameters = inspect.signature(self.vector_db.similarity_search).parameters.values()
+        return any(parameter.name == "query_vector" or parameter.kind is parameter.VAR_KEYWORD for parameter in parameters)
+
+    def _traced_retrieval(self, user_input : str, query_vector : Optional[List[float]] = None) -> str :
+        with tracing.span("retrieval_chain.retrieve", reused_query_vector=query_vector is not None) as span :
+            knowledge = self._retrieve_knowledge_from_vector_db(user_input, query_vector=query_vector)
+            if span.recording and self.context_token_budget is not None :
+                span.set(context_tokens=self.last_context_tokens)
+            return knowledge
+
+    def _retrieve_knowledge_from_vector_db(self, user_input : str, use_metadata : bool = False, query_vector : Optional[List[float]] = None) : 
+
+        # The query embedding computed by the answer cache is reused by the vector search
+        search_kwargs = {} if query_vector is None else {"query_vector" : query_vector}
+
+        if self.context_token_budget is not None :
+            candidates = self.vector_db.similarity_search(query=user_input, limit=self.fetch_limit, show_metadata=self.include_metadata, **search_kwargs)
+            return self._pack_knowledge(candidates)
 
         if self.include_metadata :
-            brut_knowledge = self.vector_db.similarity_search(query=user_input, limit=5, show_metadata=True)
-            knowledge = ""
-            for line in brut_knowledge:
-                knowledge += json.dumps(line, indent=4) + "\n"
+            brut_knowledge = self.vector_db.similarity_search(query=user_input, limit=5, show_metadata=True, **search_kwargs)
+            knowledge = "".join(json.dumps(line, indent=4) + "\n" for line in brut_knowledge)
 
         else : 
-            knowledge = "\n".join(self.vector_db.similarity_search(query=user_input, limit=5, show_metadata=False))
+            knowledge = "\n".join(self.vector_db.similarity_search(query=user_input, limit=5, show_metadata=False, **search_kwargs))
         
         return knowledge
+
+    def _pack_knowledge(self, candidates : List) -> str :
+        """Fill the token budget with the candidates, best ranked first.
+        Near-duplicates of an already packed chunk (e.g. overlapping chunks) are dropped,
+        payloads are serialized without whitespace. The tokens used are saved in last_context_tokens."""
+
+        pieces = [json.dumps(candidate, ensure_ascii=False, separators=(",", ":")) if self.include_metadata else candidate for candidate in candidates]
+        texts = [candidate["text"] if self.include_metadata else candidate for candidate in candidates]
+        token_counts = self.encoder.count_tokens_batch(pieces) if pieces else []
+
+        packed = []
+        packed_shingles = []
+        used_tokens = 0
+        for piece, text, num_tokens in zip(pieces, texts, token_counts) :
+            # +1 for the newline separating the pieces
+            cost = num_tokens + (1 if packed else 0)
+            if used_tokens + cost > self.context_token_budget :
+                continue
+            text_shingles = shingles(text)
+            if any(containment(text_shingles, kept) >= self.duplicate_threshold for kept in packed_shingles) :
+                continue
+            packed.append(piece)
+            packed_shingles.append(text_shingles)
+            used_tokens += cost
+
+        self.last_context_tokens = used_tokens
+        return "\n".join(packed)
+
+
+def shingles(text : str, size : int = 3) -> Set[tuple] :
+    """Word n-grams of a text"""
+    words = text.lower().split()
+    if len(words) < size :
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i+size]) for i in range(len(words) - size + 1)}
+
+def containment(candidate : Set[tuple], kept : Set[tuple]) -> float :
+    """Share of the candidate n-grams already present in a kept chunk"""
+    if not candidate :
+        return 1.0
+    return len(candidate & kept) / len(candidate)
+
+def same_embedder(embedder : Any, other : Any) -> bool :
+    """Same instance, or same class and model : their vectors are interchangeable"""
+    if embedder is other :
+        return True
+    model = getattr(embedder, "model", None)
+    return type(embedder) is type(other) and isinstance(model, str) and model == getattr(other, "model", None)
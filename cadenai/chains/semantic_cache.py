@@ -0,0 +1,160 @@
+from typing import Callable, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+import threading
+import time
+
+from ..schema import Embeddings
+from ..streaming import record_stream, replay
+
+
+class SemanticCache() :
+    """
+    Answer cache for a RetrievalChain.
+    A question is first looked up by its normalized text (exact match), then, with an embedder,
+    by the cosine similarity of its embedding with the cached questions (semantic match above similarity_threshold).
+    Entries expire after ttl seconds, max_entries bounds the cache with LRU eviction.
+    """
+
+    def __init__(self,
+                 embedder : Optional[Embeddings] = None,
+                 similarity_threshold : float = 0.95,
+                 max_entries : int = 1000,
+                 ttl : Optional[float] = None,
+                 clock : Callable[[], float] = time.monotonic
+                 ) :
+
+        self.embedder = embedder
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() #normalized question -> (answer, normalized vector or None, creation time)
+        self._matrix = None #(keys, vectors) of the entries with a vector, rebuilt after a change
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def hits(self) -> int :
+        return self.exact_hits + self.semantic_hits
+
+    @property
+    def hit_rate(self) -> float :
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self) -> int :
+        return len(self._entries)
+
+    def lookup(self, user_input : str) -> Tuple[Optional[str], Optional[List[float]]] :
+        """Return (answer, query_vector). answer is None on a miss.
+        query_vector is the embedding computed for the semantic match (None if not needed), reuse it for the vector search."""
+
+        key = normalize_question(user_input)
+        with self._lock :
+            answer = self._get_exact(key)
+            if answer is not None :
+                self.exact_hits += 1
+                return answer, None
+
+        if self.embedder is None :
+            with self._lock :
+                self.misses += 1
+            return None, None
+
+        query_vector = self.embedder.embed_query(user_input)
+        with self._lock :
+            answer = self._get_similar(query_vector)
+            if answer is not None :
+                self.semantic_hits += 1
+            else :
+                self.misses += 1
+        return answer, query_vector
+
+    def set(self, user_input : str, answer : str, query_vector : Optional[List[float]] = None) -> None :
+
+        key = normalize_question(user_input)
+        vector = None
+        if query_vector is not None :
+            import numpy as np #Imported on first use, like the SDKs, importing cadenai.chains stays fast
+            vector = np.asarray(query_vector, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm else vector
+
+        with self._lock :
+            self._entries[key] = (answer, vector, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries :
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def record_stream(self, user_input : str, chunks : Iterator[str], query_vector : Optional[List[float]] = None) -> Iterator[str] :
+        """Yield the chunks of a streamed answer, the full answer is cached once the stream is complete"""
+
+        return record_stream(chunks, lambda answer : self.set(user_input, answer, query_vector))
+
+    @staticmethod
+    def replay(answer : str) -> Iterator[str] :
+        return replay(answer)
+
+    def clear(self) -> None :
+        with self._lock :
+            self._entries.clear()
+            self._matrix = None
+
+    def cache_info(self) -> dict :
+        return {
+            "exact_hits" : self.exact_hits,
+            "semantic_hits" : self.semantic_hits,
+            "misses" : self.misses,
+            "hit_rate" : self.hit_rate,
+            "size" : len(self._entries)
+        }
+
+    def _is_expired(self, created_at : float) -> bool :
+        return self.ttl is not None and self._clock() - created_at > self.ttl
+
+    def _get_exact(self, key : str) -> Optional[str] :
+        entry = self._entries.get(key)
+        if entry is None :
+            return None
+        if self._is_expired(entry[2]) :
+            del self._entries[key]
+            self._matrix = None
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _get_similar(self, query_vector : List[float]) -> Optional[str] :
+        import numpy as np
+
+        if self._matrix is None :
+            keys = [key for key, (_, vector, _) in self._entries.items() if vector is not None]
+            vectors = np.stack([self._entries[key][1] for key in keys]) if keys else None
+            self._matrix = (keys, vectors)
+
+        keys, vectors = self._matrix
+        if not keys :
+            return None
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = vectors @ (query / norm if norm else query)
+
+        # Best candidates first, an expired entry is dropped and the next one is tried
+        for row in np.argsort(-scores) :
+            if scores[row] < self.similarity_threshold :
+                return None
+            answer = self._get_exact(keys[row])
+            if answer is not None :
+                return answer
+        return None
+
+
+# Only sentence punctuation is stripped : "C++?" and "C?" are different questions
+SENTENCE_PUNCTUATION = "?!.…"
+
+def normalize_question(text : str) -> str :
+    """Case, spacing and trailing punctuation do not change the question"""
+    return " ".join(text.casefold().split()).rstrip(SENTENCE_PUNCTUATION + " ")
@@ -1,26 +1,80 @@
-from pypdf import PdfReader
-from typing import List, Any, Iterator
+from typing import List, Any, Iterator, Optional
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 
 from ..schema import DocumentHandler, Loader
 
+_worker_reader = None #Reader of the current worker process, opened once by open_worker_reader
+
+def open_pdf(file_path : str) :
+    """pypdf's PdfReader on the file, pypdf is only imported when a PDF is opened"""
+    from pypdf import PdfReader
+    return PdfReader(file_path)
+
+def open_worker_reader(file_path : str) -> None :
+    """Initializer of the parallel mode : each worker process parses the PDF once"""
+    global _worker_reader
+    _worker_reader = open_pdf(file_path)
+
+def extract_pages_text(start : int, end : int) -> List[str]:
+    """Worker of the parallel mode : extract the pages [start, end) with the reader of the process"""
+    return [_worker_reader.pages[page_number].extract_text() for page_number in range(start, end)]
+
 class PDFHandler(Loader):
-    
+
     file_path: str
     _reader: Any
     pages : List
 
-    def __init__(self, file_path: str):
+    def __init__(self,
+                 file_path: str,
+                 num_workers : int = 1,
+                 pages_per_task : int = 8,
+                 prefetch : Optional[int] = None
+                 ):
         self.file_path = file_path
-        self._reader = PdfReader(self.file_path)
+        self._reader = open_pdf(self.file_path)
         self.pages = self._reader.pages
+        self.num_workers = num_workers #With more than 1 worker, the text is extracted in a process pool
+        self.pages_per_task = pages_per_task
+        self.prefetch = prefetch if prefetch else 2 * num_workers #Max number of page ranges extracted ahead of the consumer
 
     def load_a_page(self, page_number: int) -> str:
         page_loaded = DocumentHandler(page_content=self.pages[page_number].extract_text())
         return page_loaded
-    
+
     def lazy_load(self) -> Iterator[DocumentHandler]:
-        for page in self.pages : 
+        if self.num_workers > 1 :
+            yield from self._parallel_lazy_load()
+            return
+
+        for page in self.pages :
             yield DocumentHandler(page_content=page.extract_text())
 
+    def _parallel_lazy_load(self) -> Iterator[DocumentHandler]:
+        """Shard the pages across a process pool and yield them in page order.
+        At most prefetch page ranges are in flight or waiting to be consumed, so memory stays capped."""
+
+        num_pages = len(self.pages)
+        page_ranges = ((start, min(start + self.pages_per_task, num_pages)) for start in range(0, num_pages, self.pages_per_task))
+
+        executor = ProcessPoolExecutor(max_workers=self.num_workers, initializer=open_worker_reader, initargs=(self.file_path,))
+        try :
+            pending = deque()
+            for start, end in page_ranges :
+                pending.append(executor.submit(extract_pages_text, start, end))
+                if len(pending) >= self.prefetch :
+                    break
+
+            while pending :
+                texts = pending.popleft().result()
+                next_range = next(page_ranges, None)
+                if next_range is not None :
+                    pending.append(executor.submit(extract_pages_text, *next_range))
+                for text in texts :
+                    yield DocumentHandler(page_content=text)
+        finally :
+            executor.shutdown(wait=True, cancel_futures=True)
+
     def __len__(self) -> int:
-        return len(self.pages)
\ No newline at end of file
+        return len(self.pages)
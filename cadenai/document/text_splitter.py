@@ -1,11 +1,16 @@
 from enum import Enum
-from typing import List, Union, Pattern
-import tiktoken
+from typing import List, Union, Pattern, Optional, Iterable, Iterator, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from tqdm import tqdm
 import re #to use regex
 import json
+import hashlib
 
-from ..schema import DocumentHandler, TextSplitter
-from ..llm import openai as llm
+from ..schema import DocumentHandler, TextSplitter, Loader
+from ..encoder import get_encoding, OpenAIEncoder, LazyEncoder
+from ..storage import SQLiteStore
+from ..llm.openai import ChatOpenAI
 from ..prompt_manager.template import ChatPromptTemplate
 from ..prompt_manager.prompt_list import LLMSPLITTER_PROMPT
 from ..chains import LLMChain
@@ -23,16 +28,22 @@ class ChunkType(Enum):
         raise ValueError(f"'{label}' is not a valid ChunkType")
 
 class SizeSplitter(TextSplitter):
+
+    SETTINGS = ("chunk_type", "chunk_size", "chunk_overlap")
     
     def __init__(self,
                 chunk_type : str = "characters",
                 chunk_size: int = 1000, 
-                chunk_overlap: int = 100
+                chunk_overlap: int = 100,
+                encode_batch_size : int = 256,
+                num_threads : int = 8
                 ):
     
         self.chunk_type = ChunkType.from_str(chunk_type)
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.encode_batch_size = encode_batch_size #Texts encoded together when splitting lists by tokens
+        self.num_threads = num_threads
 
 
     def _split_text_str(self, input_data : str) -> List[DocumentHandler]:
@@ -45,7 +56,7 @@ class SizeSplitter(TextSplitter):
                 splitted_text = self._split_a_chunk(text)
 
             case ChunkType.TOKEN :
-                encoding = tiktoken.get_encoding(model_name)
+                encoding = get_encoding(model_name)
                 encoded_text = encoding.encode(text)
                 splitted_encoded_text = self._split_a_chunk(encoded_text)
                 splitted_text = [encoding.decode(chunk) for chunk in splitted_encoded_text]
@@ -57,6 +68,42 @@ class SizeSplitter(TextSplitter):
 
         return [DocumentHandler(page_content=text) for text in splitted_text]
 
+    def _split_text_str_list(self, input_data : List[str], loading_bar : bool = True) :
+        if self.chunk_type != ChunkType.TOKEN :
+            return super()._split_text_str_list(input_data=input_data, loading_bar=loading_bar)
+
+        splitted_text = []
+        for documents in self._split_by_tokens_batch(texts=input_data, loading_bar=loading_bar, desc="Splitting Texts") :
+            splitted_text.extend(documents)
+        return splitted_text
+
+    def _split_text_DocumentHandler_list(self, input_data : List[DocumentHandler], loading_bar : bool = True) :
+        if self.chunk_type != ChunkType.TOKEN :
+            return super()._split_text_DocumentHandler_list(input_data=input_data, loading_bar=loading_bar)
+
+        splitted_text = []
+        texts = [document.page_content for document in input_data]
+        for source, documents in zip(input_data, self._split_by_tokens_batch(texts=texts, loading_bar=loading_bar, desc="Splitting Documents")) :
+            for document in documents :
+                document.metadata = source.metadata
+            splitted_text.extend(documents)
+        return splitted_text
+
+    def _split_by_tokens_batch(self, texts : List[str], loading_bar : bool = True, desc : str = "Splitting Texts", model_name : str = "cl100k_base") :
+        '''Split a corpus by tokens, encoding and decoding it with tiktoken's multithreaded batch API.
+        Yield one list of DocumentHandler per input text'''
+
+        encoding = get_encoding(model_name)
+        batch_starts = range(0, len(texts), self.encode_batch_size)
+        if loading_bar :
+            batch_starts = tqdm(batch_starts, desc=desc)
+
+        for start in batch_starts :
+            encoded_texts = encoding.encode_batch(texts[start:start+self.encode_batch_size], num_threads=self.num_threads)
+            for encoded_text in encoded_texts :
+                chunks = self._split_a_chunk(encoded_text)
+                yield [DocumentHandler(page_content=text) for text in encoding.decode_batch(chunks, num_threads=self.num_threads)]
+
     def _split_a_chunk(self,text:str)  :
 
         splitted_text = []
@@ -82,6 +129,8 @@ class SizeSplitter(TextSplitter):
 
 class SeparatorSplitter(TextSplitter):
 
+    SETTINGS = ("separator", "is_separator_regex")
+
     def __init__(self, 
                 separator: Union[str, Pattern] = "\n", 
                 is_separator_regex: bool = False
@@ -111,16 +160,121 @@ class SeparatorSplitter(TextSplitter):
 
         return splitted_text
 
+class JSONStreamParser():
+    """
+    Incremental parser for a streamed JSON response made of objects (an array of objects, or a single object).
+    feed returns the objects closed by the new chunk, as soon as their closing brace arrives.
+    Text around the JSON (a ```json code fence, a sentence) is skipped : the JSON starts at a "[" followed by "{" or "]",
+    or at a "{" followed by '"' or "}", so a bracket in the preamble ("the chunks [JSON]:") is ignored.
+    If the response is truncated, the objects already closed are kept and complete stays False.
+    """
+
+    # Characters that may follow the opening bracket of the JSON response, whitespace apart
+    JSON_STARTS = {"[" : "{]", "{" : '"}'}
+
+    def __init__(self) :
+        self.depth = 0 #Nesting level of [ and {
+        self.root = None #First bracket of the JSON, "[" or "{"
+        self.candidate = None #Bracket that may start the JSON, confirmed by the next character
+        self.in_string = False
+        self.escaped = False
+        self.buffer = [] #Characters of the object being received
+        self.complete = False
+
+    def feed(self, chunk : str) -> List[dict] :
+        objects = []
+        for char in chunk :
+            if self.complete :
+                break
+            if self.root is None and not self._find_root(char) :
+                continue
+            if self.buffer :
+                self.buffer.append(char)
+
+            if self.in_string :
+                if self.escaped :
+                    self.escaped = False
+                elif char == "\\" :
+                    self.escaped = True
+                elif char == '"' :
+                    self.in_string = False
+                continue
+
+            if char == '"' and self.depth > 0 :
+                self.in_string = True
+            elif char in "[{" :
+                # An object at the top of the response or of the root array
+                if char == "{" and self.depth == (1 if self.root == "[" else 0) :
+                    self.buffer = ["{"]
+                self.depth += 1
+            elif char in "]}" and self.depth > 0 :
+                self.depth -= 1
+                if char == "}" and self.buffer and self.depth == (1 if self.root == "[" else 0) :
+                    try :
+                        objects.append(json.loads("".join(self.buffer)))
+                    except json.JSONDecodeError :
+                        pass #A malformed object is dropped, the next ones are still parsed
+                    self.buffer = []
+                if self.depth == 0 :
+                    self.complete = True
+        return objects
+
+    def _find_root(self, char : str) -> bool :
+        """Before the JSON : return True when char is the first character after its opening bracket"""
+        if self.candidate is not None :
+            if char.isspace() :
+                return False
+            if char in self.JSON_STARTS[self.candidate] :
+                self.root = self.candidate
+                self.depth = 1
+                self.buffer = ["{"] if self.root == "{" else []
+                self.candidate = None
+                return True
+            self.candidate = None
+        if char in self.JSON_STARTS :
+            self.candidate = char
+        return False
+
+
 class LLMSplitter(TextSplitter,LLMChain):
+    """
+    Split pages with an LLM, one request per page.
+    With max_workers > 1 the requests are sent from a thread pool, the chunks keep the page order.
+    With a cache_path, each LLM response is stored in a SQLite file keyed by a hash of (page text, prompt, model),
+    so a rerun or a run resumed after a crash only sends the pages not split yet.
+    With a pack_token_budget, consecutive short pages sharing the same metadata are packed in one request.
+    With stream=True the completion is streamed and parsed incrementally (see JSONStreamParser) :
+    lazy_split yields each chunk as soon as its JSON object is closed, and a truncated response keeps its complete chunks.
+    With max_workers > 1 or a pack_token_budget, the requests run in worker threads : a streamed response is then
+    collected by its worker and its chunks are yielded with the others, in page order.
+    A response without any chunk is never cached.
+    """
     
+    encoder = LazyEncoder()
+    SETTINGS = ("document_source", "document_context", "pack_token_budget", "prompt_template", "model_name", "max_tokens")
+
     def __init__(self,
                  document_source : str = "pdf",
                  document_context : str = "from a random file on my computer",
-                 llm = llm.ChatOpenAI(model="gpt-4")) : 
+                 llm = None,
+                 max_workers : int = 1,
+                 cache_path : Optional[str] = None,
+                 pack_token_budget : Optional[int] = None,
+                 encoder : Optional[OpenAIEncoder] = None,
+                 stream : bool = False) : 
         
                 self.document_source = document_source
                 self.document_context = document_context
+                self.max_workers = max_workers
+                self.cache = SQLiteStore(path=cache_path, table="llm_splits") if cache_path else None
+                self.pack_token_budget = pack_token_budget
+                self._encoder = encoder
+                self.stream = stream
+                self.last_split_stats = None
 
+                # Built here rather than as a default argument, so that no client is created at import time
+                if llm is None :
+                    llm = ChatOpenAI(model="gpt-4")
                 llm.temperature = 0
 
                 prompt_template = ChatPromptTemplate.from_messages(
@@ -132,9 +286,165 @@ class LLMSplitter(TextSplitter,LLMChain):
                     )
                 super().__init__(prompt_template=prompt_template,llm = llm, max_tokens = 2500)
 
+
     def _split_text_str(self, input_data : str) -> List[DocumentHandler]:
+        return self._split_request(input_data)[0]
+
+    def _split_request(self, text : str) -> Tuple[List[DocumentHandler], bool] :
+        """Split the text of one request, return (documents, whether the response came from the cache)"""
+
+        key = self._cache_key(text) if self.cache is not None else None
+        cached_items = self._cached_items(key)
+        if cached_items is not None :
+            return [DocumentHandler(**item) for item in cached_items], True
+
+        if self.stream :
+            return list(self._stream_request(text, key)), False
 
-        llm_response = self.run(document_source=self.document_source,document_context=self.document_context,document_text=input_data)
+        llm_response = self.run(document_source=self.document_source,document_context=self.document_context,document_text=text)
         json_loaded = json.loads(llm_response)
         documents = [DocumentHandler(**item) for item in json_loaded]
-        return documents
+
+        # Only valid responses with chunks are cached, the others are requested again on the next run
+        if key is not None and documents :
+            self.cache.set(key, llm_response)
+        return documents, False
+
+    def _iter_split_text_str(self, input_data : str) -> Iterator[DocumentHandler] :
+
+        if not self.stream :
+            yield from super()._iter_split_text_str(input_data=input_data)
+            return
+
+        key = self._cache_key(input_data) if self.cache is not None else None
+        cached_items = self._cached_items(key)
+        if cached_items is not None :
+            yield from [DocumentHandler(**item) for item in cached_items]
+        else :
+            yield from self._stream_request(input_data, key)
+
+    def _stream_request(self, text : str, key : Optional[str] = None) -> Iterator[DocumentHandler] :
+        """Yield the chunks while the completion is streamed. Only a complete response is cached."""
+
+        parser = JSONStreamParser()
+        items = []
+        for chunk in self.run(document_source=self.document_source,document_context=self.document_context,document_text=text,stream=True) :
+            for item in parser.feed(chunk or "") :
+                items.append(item)
+                yield DocumentHandler(**item)
+
+        if key is not None and parser.complete and items :
+            self.cache.set(key, json.dumps(items, ensure_ascii=False))
+
+    def _cached_items(self, key : Optional[str]) -> Optional[List[dict]] :
+        """Chunks of the cached response, None on a miss. A cached response without chunks counts as a miss."""
+        llm_response = self.cache.get(key) if key is not None else None
+        if llm_response is None :
+            return None
+        return json.loads(llm_response) or None
+
+    @property
+    def model_name(self) -> str :
+        return str(getattr(self.llm, "model", type(self.llm).__name__))
+
+    def _cache_key(self, text : str) -> str :
+        content = json.dumps([text, str(self.prompt_template), self.document_source, self.document_context, self.model_name, self.max_tokens], ensure_ascii=False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def lazy_split(self, input_data : Union[DocumentHandler, Iterable[DocumentHandler], str, Iterable[str], Loader], loading_bar : bool = False) -> Iterator[DocumentHandler]:
+
+        if self.max_workers <= 1 and self.pack_token_budget is None :
+            yield from super().lazy_split(input_data, loading_bar=loading_bar)
+            return
+
+        if isinstance(input_data, (DocumentHandler, str)) :
+            input_data = [input_data]
+        if isinstance(input_data, Loader) :
+            yield from self._split_pages(input_data.lazy_load(), total=len(input_data), loading_bar=loading_bar)
+        elif isinstance(input_data, Iterable) :
+            yield from self._split_pages(input_data, loading_bar=loading_bar)
+        else :
+            raise TypeError(f"Unsupported input type: {type(input_data).__name__}.")
+
+    def _split_text_loader(self, input_data : Loader, loading_bar : bool = True) :
+        return list(self._split_pages(input_data.lazy_load(), total=len(input_data), loading_bar=loading_bar))
+
+    def _split_text_DocumentHandler_list(self, input_data : List[DocumentHandler], loading_bar : bool = True) :
+        return list(self._split_pages(input_data, loading_bar=loading_bar))
+
+    def _split_text_str_list(self, input_data : List[str], loading_bar : bool = True) :
+        return list(self._split_pages(input_data, loading_bar=loading_bar))
+
+    def _split_pages(self, pages : Iterable[Union[DocumentHandler, str]], total : Optional[int] = None, loading_bar : bool = False) -> Iterator[DocumentHandler] :
+        """Pack the pages into requests, send them from max_workers threads and yield the chunks in page order.
+        At most 2 * max_workers requests are in flight or waiting to be consumed.
+        The chunks of a page get its metadata, like _split_text_DocumentHandler (strings keep the LLM metadata)."""
+
+        progress_bar = tqdm(total=total, desc="Splitting Documents") if loading_bar else None
+        stats = {"pages" : 0, "requests" : 0, "cached_requests" : 0}
+        self.last_split_stats = stats
+        requests = self._pack_pages(pages)
+
+        def collect(future, metadata, num_pages) :
+            documents, from_cache = future.result()
+            stats["pages"] += num_pages
+            stats["requests"] += 1
+            stats["cached_requests"] += from_cache
+            if progress_bar is not None :
+                progress_bar.update(num_pages)
+            if metadata is not None :
+                for document in documents :
+                    document.metadata = metadata
+            return documents
+
+        executor = ThreadPoolExecutor(max_workers=max(1, self.max_workers))
+        try :
+            pending = deque()
+            for text, metadata, num_pages in requests :
+                pending.append((executor.submit(self._split_request, text), metadata, num_pages))
+                if len(pending) >= 2 * self.max_workers :
+                    break
+
+            while pending :
+                future, metadata, num_pages = pending.popleft()
+                documents = collect(future, metadata, num_pages)
+                next_request = next(requests, None)
+                if next_request is not None :
+                    text, next_metadata, next_num_pages = next_request
+                    pending.append((executor.submit(self._split_request, text), next_metadata, next_num_pages))
+                yield from documents
+        finally :
+            executor.shutdown(wait=True, cancel_futures=True)
+            if progress_bar is not None :
+                progress_bar.close()
+
+    def _pack_pages(self, pages : Iterable[Union[DocumentHandler, str]]) -> Iterator[Tuple[str, Optional[dict], int]] :
+        """Yield (request text, metadata, number of pages). Without pack_token_budget, one request per page.
+        Otherwise consecutive pages with the same metadata are joined while they fit in the budget."""
+
+        pack = []
+        pack_metadata = None
+        pack_tokens = 0
+        for page in pages :
+            if isinstance(page, DocumentHandler) :
+                text, metadata = page.page_content, page.metadata
+            elif isinstance(page, str) :
+                text, metadata = page, None
+            else :
+                raise TypeError(f"Unsupported input type: {type(page).__name__}.")
+
+            if self.pack_token_budget is None :
+                yield text, metadata, 1
+                continue
+
+            num_tokens = self.encoder.count_tokens(text)
+            if pack and (metadata != pack_metadata or pack_tokens + num_tokens > self.pack_token_budget) :
+                yield "\n\n".join(pack), pack_metadata, len(pack)
+                pack = []
+                pack_tokens = 0
+            pack.append(text)
+            pack_metadata = metadata
+            pack_tokens += num_tokens
+
+        if pack :
+            yield "\n\n".join(pack), pack_metadata, len(pack)
@@ -1,28 +1,62 @@
 from typing import List,Any
-
-import tiktoken
+import functools
 
 from .schema import Encoder
 
-    
-    
-class OpenAIEncoder(Encoder) : 
 
-    encoder : Any 
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name : str = "cl100k_base") :
+    """Process-wide registry, each tiktoken encoding is resolved once (and tiktoken imported on first use)"""
+    import tiktoken
+    return tiktoken.get_encoding(encoding_name)
+
+@functools.lru_cache(maxsize=None)
+def encoding_for_model(model_name : str) :
+    import tiktoken
+    return tiktoken.encoding_for_model(model_name)
+
+
+class OpenAIEncoder(Encoder) :
+
+    encoder : Any
 
-    def __init__(self, model_name="cl100k_base") :
+    def __init__(self, model_name="cl100k_base", num_threads : int = 8) :
         super().__init__(model_name=model_name)
-        self.encoder = tiktoken.get_encoding(self.model_name)
+        self.encoder = get_encoding(self.model_name)
+        self.num_threads = num_threads
 
     def encode_a_string(self, text : str) -> List[int]:
         encoded_text = self.encoder.encode(text)
         return encoded_text
-    
 
-    def decode_a_string(self,encoded_text : List[int]) -> str: 
+
+    def decode_a_string(self,encoded_text : List[int]) -> str:
         decoded_text = self.encoder.decode(encoded_text)
         return decoded_text
-                
+
+    def encode_batch(self, texts : List[str]) -> List[List[int]]:
+        """Encode many strings at once, using tiktoken's thread pool"""
+        return self.encoder.encode_batch(texts, num_threads=self.num_threads)
+
+    def decode_batch(self, encoded_texts : List[List[int]]) -> List[str]:
+        return self.encoder.decode_batch(encoded_texts, num_threads=self.num_threads)
+
+    def count_tokens(self, text : str) -> int:
+        return len(self.encoder.encode(text))
+
+    def count_tokens_batch(self, texts : List[str]) -> List[int]:
+        return [len(encoded_text) for encoded_text in self.encode_batch(texts)]
 
 
+class LazyEncoder() :
+    """
+    Class attribute for the encoder of a component : the encoder given to its constructor (kept in _encoder),
+    or an OpenAIEncoder built on first use, so that tiktoken is only loaded when tokens are actually counted.
+    """
 
+    def __get__(self, instance : Any, owner : Any = None) :
+        if instance is None :
+            return self
+        if instance._encoder is None :
+            instance._encoder = OpenAIEncoder()
+        return instance._encoder
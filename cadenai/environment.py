@@ -0,0 +1,14 @@
+"""
+Heavy dependencies are imported on first use rather than at import time, so that importing cadenai stays fast :
+the provider SDKs and load_environment in the client constructors, tiktoken in encoder.get_encoding
+(components get their encoder through encoder.LazyEncoder) and pypdf in file_handler.open_pdf.
+"""
+
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def load_environment() -> None :
+    """Load the .env file once, when the first API client is built rather than at import time"""
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
@@ -0,0 +1,196 @@
+from abc import ABC, abstractmethod
+from typing import Any, Callable, List, Optional
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+
+from ..schema import LLM
+from ..storage import SQLiteStore
+from ..streaming import record_stream, replay
+
+
+class CompletionCache(ABC) :
+
+    @abstractmethod
+    def get(self, key : str) -> Optional[str] :
+        pass
+
+    @abstractmethod
+    def set(self, key : str, completion : str) -> None :
+        pass
+
+    @abstractmethod
+    def clear(self) -> None :
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int :
+        pass
+
+
+class InMemoryCompletionCache(CompletionCache) :
+    """LRU cache in the process memory, bounded by max_entries, entries expire after ttl seconds"""
+
+    def __init__(self,
+                 max_entries : int = 1000,
+                 ttl : Optional[float] = None,
+                 clock : Callable[[], float] = time.monotonic
+                 ) :
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() #key -> (completion, creation time)
+
+    def get(self, key : str) -> Optional[str] :
+        with self._lock :
+            entry = self._entries.get(key)
+            if entry is None :
+                return None
+            if self.ttl is not None and self._clock() - entry[1] > self.ttl :
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key : str, completion : str) -> None :
+        with self._lock :
+            self._entries[key] = (completion, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries :
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None :
+        with self._lock :
+            self._entries.clear()
+
+    def __len__(self) -> int :
+        return len(self._entries)
+
+
+class SQLiteCompletionCache(CompletionCache) :
+    """On-disk cache shared between runs and processes, max_entries bounds it with LRU eviction.
+    The clock is wall time, so that ttl holds across processes."""
+
+    def __init__(self,
+                 path : str = "completions_cache.sqlite",
+                 max_entries : Optional[int] = None,
+                 ttl : Optional[float] = None,
+                 clock : Callable[[], float] = time.time
+                 ) :
+
+        self.store = SQLiteStore(path=path, table="completions", max_entries=max_entries)
+        self.ttl = ttl
+        self._clock = clock
+
+    def get(self, key : str) -> Optional[str] :
+        value = self.store.get(key)
+        if value is None :
+            return None
+        created_at, completion = json.loads(value)
+        if self.ttl is not None and self._clock() - created_at > self.ttl :
+            self.store.delete_many([key])
+            return None
+        return completion
+
+    def set(self, key : str, completion : str) -> None :
+        self.store.set(key, json.dumps([self._clock(), completion], ensure_ascii=False))
+
+    def clear(self) -> None :
+        self.store.clear()
+
+    def __len__(self) -> int :
+        return len(self.store)
+
+
+class CachedLLM(LLM) :
+    """
+    Wrap an LLM (ChatOpenAI, ChatMistral...) with a completion cache.
+    At temperature 0 a completion only depends on (model, messages, max_tokens), so it is served from the cache
+    when the same prompt was already sent. Other temperatures bypass the cache, unless only_deterministic is False.
+    A cached completion requested with stream=True is replayed as a stream.
+    """
+
+    def __init__(self,
+                 llm : LLM,
+                 cache : Optional[CompletionCache] = None,
+                 only_deterministic : bool = True
+                 ) :
+
+        self.llm = llm
+        self.cache = cache if cache is not None else InMemoryCompletionCache()
+        self.only_deterministic = only_deterministic
+        self.hits = 0
+        self.misses = 0
+
+    # The chains read and set these attributes on their LLM, they belong to the wrapped one
+    @property
+    def temperature(self) -> float :
+        return self.llm.temperature
+
+    @temperature.setter
+    def temperature(self, temperature : float) -> None :
+        self.llm.temperature = temperature
+
+    @property
+    def _prompt_syntax(self) -> str :
+        return self.llm._prompt_syntax
+
+    @property
+    def model(self) -> str :
+        return getattr(self.llm, "model", type(self.llm).__name__)
+
+    @property
+    def hit_rate(self) -> float :
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_completion(self, prompt : List, max_tokens : Optional[int] = None, stream : bool = False) :
+
+        # Without max_tokens, the wrapped LLM uses its own default
+        completion_kwargs = {} if max_tokens is None else {"max_tokens" : max_tokens}
+
+        if self.only_deterministic and getattr(self.llm, "temperature", 0) != 0 :
+            return self.llm.get_completion(prompt=prompt, stream=stream, **completion_kwargs)
+
+        key = self._key(prompt, max_tokens)
+        cached = self.cache.get(key)
+        if cached is not None :
+            self.hits += 1
+            return replay(cached) if stream else cached
+
+        self.misses += 1
+        completion = self.llm.get_completion(prompt=prompt, stream=stream, **completion_kwargs)
+        if stream :
+            return record_stream(completion, lambda text : self.cache.set(key, text))
+        self.cache.set(key, completion)
+        return completion
+
+    def cache_info(self) -> dict :
+        return {"hits" : self.hits, "misses" : self.misses, "hit_rate" : self.hit_rate, "size" : len(self.cache)}
+
+    def _key(self, prompt : List, max_tokens : Optional[int]) -> str :
+        content = json.dumps(
+            [type(self.llm).__name__, self.model, getattr(self.llm, "temperature", None), max_tokens, canonical_prompt(prompt)],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def canonical_prompt(prompt : List[Any]) -> List[dict] :
+    """Same serialization for the prompt whatever its syntax : OpenAI dicts, Cadenai tuples or Mistral ChatMessage objects"""
+
+    messages = []
+    for message in prompt :
+        if isinstance(message, dict) :
+            messages.append(message)
+        elif isinstance(message, tuple) :
+            messages.append({"role" : message[0], "content" : message[1]})
+        elif hasattr(message, "model_dump") :
+            messages.append(message.model_dump(exclude_none=True))
+        else :
+            messages.append({"role" : getattr(message, "role", None), "content" : getattr(message, "content", None)})
+    return messages
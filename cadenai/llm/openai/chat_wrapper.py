@@ -1,10 +1,11 @@
 from ...schema import LLM
+from ...rate_limiter import RateLimiter
+from ...environment import load_environment
+from ... import tracing
 
-from openai import OpenAI
 import os
-from dotenv import load_dotenv, find_dotenv
-_ = load_dotenv(find_dotenv())
-from typing import List
+import time
+from typing import List, Optional
 from tenacity import retry, wait_exponential
 
 
@@ -12,16 +13,23 @@ class ChatOpenAI(LLM):
 
     def __init__(self,
                 model : str,
-                temperature : float = 0.7
+                temperature : float = 0.7,
+                rate_limiter : Optional[RateLimiter] = None
                 ): 
         self.model = model
         self.temperature = temperature
+        self.rate_limiter = rate_limiter
+        from openai import OpenAI
+        load_environment()
         self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self._prompt_syntax = "openai"
     
-    @retry(wait=wait_exponential(multiplier=1, min=2, max=4))
+    @retry(wait=wait_exponential(multiplier=1, min=2, max=4), before_sleep=tracing.trace_retry("llm.completion"))
     def get_completion(self, prompt : List, max_tokens : int = 2500, stream : bool = False) -> str:
 
+        if self.rate_limiter is not None :
+            self.rate_limiter.acquire_for_prompt(prompt=prompt, max_tokens=max_tokens)
+
         if stream: 
             return self._get_completion_stream(prompt=prompt, max_tokens=max_tokens)
         
@@ -29,26 +37,34 @@ class ChatOpenAI(LLM):
             return self._get_completion_without_stream(prompt=prompt, max_tokens=max_tokens)
     
     def _get_completion_without_stream(self, prompt : List, max_tokens : int = 2500) -> str:
-        completion = self.client.chat.completions.create(
-        model=self.model,
-        temperature = self.temperature,
-        messages=prompt,
-        max_tokens=max_tokens,
-        )
-
-        return completion.choices[0].message.content
+        with tracing.span("llm.completion", model=self.model, max_tokens=max_tokens, stream=False) as span :
+            completion = self.client.chat.completions.create(
+            model=self.model,
+            temperature = self.temperature,
+            messages=prompt,
+            max_tokens=max_tokens,
+            )
+            if span.recording :
+                span.set(**tracing.usage_attributes(completion))
+
+            return completion.choices[0].message.content
     
     def _get_completion_stream(self, prompt : List, max_tokens : int = 2500) -> str:
-        
-        completion = self.client.chat.completions.create(
-        model=self.model,
-        temperature = self.temperature,
-        messages=prompt,
-        max_tokens=max_tokens,
-        stream = True
-        )
-
-        for chunk in completion:
-            yield chunk.choices[0].delta.content
+        with tracing.stream_span("llm.completion", model=self.model, max_tokens=max_tokens, stream=True) as span :
+            completion = self.client.chat.completions.create(
+            model=self.model,
+            temperature = self.temperature,
+            messages=prompt,
+            max_tokens=max_tokens,
+            stream = True
+            )
+
+            chunks = 0
+            for chunk in completion:
+                if chunks == 0 and span.recording :
+                    span.set(time_to_first_token_seconds=time.perf_counter() - span.start)
+                chunks += 1
+                yield chunk.choices[0].delta.content
+            span.set(chunks=chunks)
 
         
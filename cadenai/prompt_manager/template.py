@@ -1,10 +1,12 @@
-from pydantic import BaseModel
-from typing import List, Tuple
+from pydantic import BaseModel, PrivateAttr
+from typing import List, Tuple, Optional
 from enum import Enum
-import tiktoken
-from mistralai.models.chat_completion import ChatMessage as MistralChatMessage
+import functools
+import string
 
 from ..schema import BasePromptTemplate
+from ..encoder import encoding_for_model
+from .. import tracing
 
 class Role(Enum):
     SYSTEM = ("system","system")
@@ -31,24 +33,81 @@ class Role(Enum):
         raise ValueError(f"Invalid role name: {role_name}")
 
 def token_counter(text,model_type="gpt-4"):
-    encoding = tiktoken.encoding_for_model(model_type)
+    encoding = encoding_for_model(model_type)
     encoded = encoding.encode(text)
     num_tokens = len(encoded)
     return num_tokens
 
+@functools.lru_cache(maxsize=None)
+def mistral_chat_message() :
+    """Mistral's ChatMessage class, mistralai is only imported when a Mistral prompt is formatted"""
+    from mistralai.models.chat_completion import ChatMessage
+    return ChatMessage
+
+_formatter = string.Formatter()
+
+@functools.lru_cache(maxsize=1024)
+def parse_template(template : str) -> Tuple[Tuple[str, Optional[str], Optional[str], Optional[str]], ...] :
+    """Split a str.format template into (literal_text, field_name, format_spec, conversion) segments"""
+    return tuple(_formatter.parse(template))
+
+def format_field(field_name : str, format_spec : str, conversion : Optional[str], kwargs : dict) -> str :
+    """Render one field of a parsed template the way str.format does"""
+    value, _ = _formatter.get_field(field_name, (), kwargs)
+    value = _formatter.convert_field(value, conversion)
+    return _formatter.format_field(value, format_spec)
+
+class TokenCountCache() :
+    """Token count of a template text, recomputed only when the text changes"""
+
+    def __init__(self) :
+        self._text = None
+        self._count = None
+        self._literal_text = None
+        self._literal_count = None
+
+    def count(self, text : str) -> int :
+        if self._count is None or self._text != text :
+            self._text = text
+            self._count = token_counter(text)
+        return self._count
+
+    def count_formatted(self, template : str, **kwargs) -> int :
+        """Number of tokens of the formatted template : the literal parts are tokenized once,
+        only the variables are tokenized on each call. Tokens merging across a literal/variable
+        boundary make it an estimate, usually within a token or two per variable."""
+
+        if self._literal_count is None or self._literal_text != template :
+            self._literal_text = template
+            self._literal_count = sum(token_counter(literal_text) for literal_text, _, _, _ in parse_template(template) if literal_text)
+
+        num_tokens = self._literal_count
+        for _, field_name, format_spec, conversion in parse_template(template) :
+            if field_name is not None :
+                num_tokens += token_counter(format_field(field_name, format_spec, conversion, kwargs))
+        return num_tokens
+
+    def __eq__(self, other) -> bool :
+        # A cache is not part of the template value, two templates with the same content are equal
+        return isinstance(other, TokenCountCache)
+
 class PromptTemplate(BaseModel,BasePromptTemplate) : 
 
     input_variables: List[str]
     template : str  #f-string template
+    _token_count : TokenCountCache = PrivateAttr(default_factory=TokenCountCache)
 
     def format(self, **kwargs) -> str : 
         return self.template.format(**kwargs)
+
+    def count_formatted_tokens(self, **kwargs) -> int :
+        return self._token_count.count_formatted(self.template, **kwargs)
     
     def __str__(self) -> str:
         return self.template
     
     def __len__(self) -> str:
-        return token_counter(self.template)
+        return self._token_count.count(self.template)
     
 class PromptSyntax(Enum):
     CADENAI = ("cadenai","Cadenai","cadenAI","CadenAI")
@@ -67,6 +126,7 @@ class MessageTemplate(BaseModel, BasePromptTemplate) :
 
     role : Role
     content : str
+    _token_count : TokenCountCache = PrivateAttr(default_factory=TokenCountCache)
 
     def format(self, syntax : str, **kwargs) -> str : 
         prompt_syntax = PromptSyntax.from_str(syntax)
@@ -74,20 +134,87 @@ class MessageTemplate(BaseModel, BasePromptTemplate) :
             case prompt_syntax.OPENAI : 
                 return {"role" : self.role.openai, "content" : self.content.format(**kwargs)}
             case prompt_syntax.MISTRAL :
-                return MistralChatMessage(role=self.role.mistral, content=self.content.format(**kwargs))
+                return mistral_chat_message()(role=self.role.mistral, content=self.content.format(**kwargs))
             case prompt_syntax.CADENAI :
                 return (self.role.cadenai,self.content.format(**kwargs))
     
     def __str__(self) -> str:
         return repr((self.role.cadenai,self.content))
     
+    def count_formatted_tokens(self, **kwargs) -> int :
+        return self._token_count.count_formatted(self.content, **kwargs)
+
     def __len__(self) -> int:
-        return token_counter(self.content)
+        return self._token_count.count(self.content)
+
+class CompiledChatPrompt() :
+    """
+    Renderer of a ChatPromptTemplate for one syntax.
+    The syntax is resolved and each message is parsed into literal and field segments once :
+    messages without field are kept as plain strings, messages with simple fields ({name})
+    become a %-mapping template rendered in a single C-level pass, the others keep str.format.
+    """
+
+    def __init__(self, messages : List[Tuple[Role, str]], syntax : str) :
+        self.syntax = PromptSyntax.from_str(syntax)
+        self._messages = []
+        for role, content in messages :
+            match self.syntax :
+                case PromptSyntax.OPENAI :
+                    role_name = role.openai
+                case PromptSyntax.MISTRAL :
+                    role_name = role.mistral
+                case PromptSyntax.CADENAI :
+                    role_name = role.cadenai
+            self._messages.append((role_name,) + self._compile_content(content))
+
+    @staticmethod
+    def _compile_content(content : str) -> Tuple[str, Optional[str]] :
+        """Return (template, how to render it) : None for a static text, "%" or "format" otherwise"""
+        segments = parse_template(content)
+        if all(field_name is None for _, field_name, _, _ in segments) :
+            return "".join(literal_text for literal_text, _, _, _ in segments), None
+        if all(field_name is None or (field_name.isidentifier() and not format_spec and conversion is None) for _, field_name, format_spec, conversion in segments) :
+            parts = []
+            for literal_text, field_name, _, _ in segments :
+                parts.append(literal_text.replace("%", "%%"))
+                if field_name is not None :
+                    parts.append(f"%({field_name})s")
+            return "".join(parts), "%"
+        return content, "format"
+
+    @staticmethod
+    def _render(template : str, method : Optional[str], kwargs : dict) -> str :
+        if method is None :
+            return template
+        if method == "%" :
+            return template % kwargs
+        return template.format_map(kwargs)
+
+    def format(self, **kwargs) -> list :
+        render = self._render
+        match self.syntax :
+            case PromptSyntax.OPENAI :
+                return [{"role" : role_name, "content" : render(template, method, kwargs)} for role_name, template, method in self._messages]
+            case PromptSyntax.MISTRAL :
+                # The messages are built by us, no need to pay for pydantic validation
+                MistralChatMessage = mistral_chat_message()
+                return [MistralChatMessage.model_construct(role=role_name, content=render(template, method, kwargs)) for role_name, template, method in self._messages]
+            case PromptSyntax.CADENAI :
+                return [(role_name, render(template, method, kwargs)) for role_name, template, method in self._messages]
+
+class CompiledPromptCache(dict) :
+    """syntax -> (messages fingerprint, CompiledChatPrompt)"""
+
+    def __eq__(self, other) -> bool :
+        # A cache is not part of the template value, two templates with the same messages are equal
+        return isinstance(other, CompiledPromptCache)
 
 class ChatPromptTemplate(BaseModel,BasePromptTemplate) : 
 
     input_variables: List[str]
     messages_template : List[MessageTemplate]  
+    _compiled : CompiledPromptCache = PrivateAttr(default_factory=CompiledPromptCache)
 
     @classmethod
     def from_messages(cls, input_variables : List[str], messages :  List[Tuple]) : 
@@ -97,10 +224,22 @@ class ChatPromptTemplate(BaseModel,BasePromptTemplate) :
         return instance
 
     def format(self, syntax : str, **kwargs) -> str : 
-        formatted_template = []
-        for message_template in self.messages_template :
-            formatted_template.append(message_template.format(syntax=syntax,**kwargs))
-        return formatted_template
+        # Formatting takes microseconds, skip even the no-op span when tracing is off
+        if not tracing.is_enabled() :
+            return self.compile(syntax).format(**kwargs)
+        with tracing.span("prompt.format", syntax=syntax, messages=len(self.messages_template)) :
+            return self.compile(syntax).format(**kwargs)
+
+    def compile(self, syntax : str) -> CompiledChatPrompt :
+        '''Return the renderer for this syntax, rebuilt only when the messages changed since the last call'''
+        fingerprint = [(message_template.role, message_template.content) for message_template in self.messages_template]
+        # Read the private attribute directly, pydantic's attribute fallback costs more than the whole lookup
+        compiled_cache = self.__pydantic_private__["_compiled"]
+        cached = compiled_cache.get(syntax)
+        if cached is None or cached[0] != fingerprint :
+            cached = (fingerprint, CompiledChatPrompt(messages=fingerprint, syntax=syntax))
+            compiled_cache[syntax] = cached
+        return cached[1]
     
     def add_system_message(self, content : str, input_variables : List[str] = None) : 
         if input_variables : 
@@ -123,6 +262,10 @@ class ChatPromptTemplate(BaseModel,BasePromptTemplate) :
             output.append((message_template.role.cadenai, message_template.content))
         return repr(output)
 
+    def count_formatted_tokens(self, **kwargs) -> int :
+        '''Estimated number of tokens of the formatted messages, only the variables are tokenized'''
+        return sum(message_template.count_formatted_tokens(**kwargs) for message_template in self.messages_template)
+
     def __len__(self) -> int:
         length = 0
         for message_template in self.messages_template:
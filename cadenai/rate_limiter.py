@@ -0,0 +1,99 @@
+from typing import Any, Callable, List, Optional
+import threading
+import time
+
+from .schema import Encoder
+from .encoder import LazyEncoder
+
+
+class RateLimiter() :
+    """
+    Client-side token bucket limiting requests per minute and tokens per minute.
+    Share one instance between every wrapper that hits the same provider account
+    so that they all wait for capacity instead of getting 429s and backing off together.
+    Requests are pre-charged with their token count (prompt + max_tokens for completions).
+    """
+
+    encoder = LazyEncoder()
+
+    def __init__(self,
+                 requests_per_minute : Optional[int] = None,
+                 tokens_per_minute : Optional[int] = None,
+                 encoder : Optional[Encoder] = None,
+                 clock : Callable[[], float] = time.monotonic,
+                 sleep : Callable[[float], None] = time.sleep
+                 ) :
+
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._encoder = encoder
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+        # Buckets start full, so a burst up to the per-minute limits goes through right away
+        self._available_requests = float(requests_per_minute) if requests_per_minute else 0.0
+        self._available_tokens = float(tokens_per_minute) if tokens_per_minute else 0.0
+        self._last_refill = self._clock()
+
+
+    def acquire_for_prompt(self, prompt : List[Any], max_tokens : int) -> float :
+        tokens = count_prompt_tokens(prompt, self.encoder) + max_tokens if self.tokens_per_minute else 0
+        return self.acquire(tokens)
+
+    def acquire_for_texts(self, texts : List[str]) -> float :
+        tokens = sum(len(self.encoder.encode_a_string(text)) for text in texts) if self.tokens_per_minute else 0
+        return self.acquire(tokens)
+
+    def acquire(self, tokens : int = 0) -> float :
+        """Block until the request can be sent, then charge it. Return the time spent waiting."""
+
+        if self.tokens_per_minute :
+            # A request bigger than the whole bucket would wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+
+        waited = 0.0
+        while True :
+            with self._lock :
+                self._refill()
+                wait_time = self._wait_time(tokens)
+                if wait_time <= 0 :
+                    if self.requests_per_minute :
+                        self._available_requests -= 1
+                    if self.tokens_per_minute :
+                        self._available_tokens -= tokens
+                    return waited
+            self._sleep(wait_time)
+            waited += wait_time
+
+    def _refill(self) -> None :
+        now = self._clock()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute :
+            self._available_requests = min(float(self.requests_per_minute), self._available_requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute :
+            self._available_tokens = min(float(self.tokens_per_minute), self._available_tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time(self, tokens : int) -> float :
+        wait_time = 0.0
+        if self.requests_per_minute and self._available_requests < 1 :
+            wait_time = max(wait_time, (1 - self._available_requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._available_tokens < tokens :
+            wait_time = max(wait_time, (tokens - self._available_tokens) * 60 / self.tokens_per_minute)
+        return wait_time
+
+
+def count_prompt_tokens(prompt : List[Any], encoder : Encoder, tokens_per_message : int = 4) -> int :
+    """Estimate the number of tokens of a chat prompt, whatever the syntax used to format it"""
+
+    num_tokens = 0
+    for message in prompt :
+        if isinstance(message, dict) :
+            content = message.get("content") or ""
+        elif isinstance(message, tuple) :
+            content = message[1]
+        else :
+            content = getattr(message, "content", "") or ""
+        num_tokens += len(encoder.encode_a_string(content)) + tokens_per_message
+    return num_tokens
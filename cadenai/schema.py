@@ -1,8 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import List, Optional, Dict, Union, Iterator
+from typing import List, Optional, Dict, Union, Iterator, Iterable
 from tqdm import tqdm
 from pydantic import BaseModel, Field
 import json
+import hashlib
 
 class BasePromptTemplate(ABC) : 
 
@@ -87,6 +88,14 @@ class Loader(ABC):
 
 class TextSplitter(ABC):
 
+    SETTINGS = () #Attributes that change the chunks, see fingerprint
+
+    def fingerprint(self) -> str :
+        """Hash of the splitter class and its SETTINGS, documents split with another fingerprint must be split again"""
+        settings = {name : getattr(self, name) for name in self.SETTINGS}
+        content = json.dumps([type(self).__name__, settings], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
     def split_text(self, input_data : Union[DocumentHandler,List[DocumentHandler], str, List[str], Loader], loading_bar : bool = True ) -> List[DocumentHandler]:
 
         if isinstance(input_data, Loader):
@@ -107,6 +116,37 @@ class TextSplitter(ABC):
         else : #Or raise an exception
             raise TypeError(f"Unsupported input type: {type(input_data).__name__}.")
         
+    def lazy_split(self, input_data : Union[DocumentHandler, Iterable[DocumentHandler], str, Iterable[str], Loader], loading_bar : bool = False) -> Iterator[DocumentHandler]:
+        """Yield the chunks one input document at a time, a Loader is consumed page by page as lazy_load produces them"""
+
+        if isinstance(input_data, (DocumentHandler, str)) :
+            input_data = [input_data]
+
+        if isinstance(input_data, Loader) :
+            documents = input_data.lazy_load()
+            if loading_bar :
+                documents = tqdm(documents, total=len(input_data), desc="Loading and Splitting Documents")
+        elif isinstance(input_data, Iterable) :
+            documents = tqdm(input_data, desc="Splitting Documents") if loading_bar else input_data
+        else :
+            raise TypeError(f"Unsupported input type: {type(input_data).__name__}.")
+
+        for document in documents :
+            if isinstance(document, DocumentHandler) :
+                yield from self._iter_split_text_DocumentHandler(input_data=document)
+            elif isinstance(document, str) :
+                yield from self._iter_split_text_str(input_data=document)
+            else :
+                raise TypeError(f"Unsupported input type: {type(document).__name__}.")
+
+    def _iter_split_text_DocumentHandler(self, input_data : DocumentHandler) -> Iterator[DocumentHandler] :
+        for document in self._iter_split_text_str(input_data=input_data.page_content) :
+            document.metadata = input_data.metadata
+            yield document
+
+    def _iter_split_text_str(self, input_data : str) -> Iterator[DocumentHandler] :
+        yield from self._split_text_str(input_data=input_data)
+
     def _split_text_loader(self, input_data : Loader, loading_bar : bool = True) :
         splitted_text = []
         if loading_bar :
@@ -150,7 +190,7 @@ class TextSplitter(ABC):
 class VectorDB(ABC) : 
     
     @abstractmethod
-    def add_documents(self, documents : List[DocumentHandler]) : 
+    def add_documents(self, documents : Iterable[DocumentHandler]) : 
         pass
 
     @abstractmethod
@@ -158,13 +198,21 @@ class VectorDB(ABC) :
         pass
 
     @abstractmethod
-    def similarity_search(self, query : str, limit : int) -> List[str]:
+    def similarity_search(self, query : str, limit : int, show_metadata : bool = False, query_vector : Optional[List[float]] = None) -> List[str]:
+        """query_vector is the query embedding when the caller already has it, computed with the store's embedder"""
         pass
 
     @abstractmethod
     def similarity_search_with_scores(self, query : str, limit : int) -> List :
         pass
 
+    def similarity_search_batch(self, queries : List[str], limit : int, show_metadata : bool = False, **search_kwargs) -> List[List] :
+        """One result list per query, stores with a batched search endpoint override it"""
+        return [self.similarity_search(query, limit=limit, show_metadata=show_metadata, **search_kwargs) for query in queries]
+
+    def similarity_search_batch_with_scores(self, queries : List[str], limit : int, **search_kwargs) -> List[List] :
+        return [self.similarity_search_with_scores(query, limit=limit, **search_kwargs) for query in queries]
+
     @abstractmethod
     def __len__(self) -> int:
         pass
\ No newline at end of file
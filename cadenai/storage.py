@@ -0,0 +1,101 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import sqlite3
+import threading
+import time
+
+
+class SQLiteStore() :
+    """
+    Small persistent key/value store backed by a SQLite file.
+    Keys are strings, values are anything SQLite can hold (str, bytes, int, float).
+    When max_entries is set, the least recently used entries are evicted.
+    """
+
+    def __init__(self,
+                 path : str,
+                 table : str = "store",
+                 max_entries : Optional[int] = None
+                 ) :
+
+        if not table.isidentifier() :
+            raise ValueError(f"Invalid table name: {table}")
+
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection :
+            self._connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value BLOB, last_access REAL)"
+            )
+            self._connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table} (last_access)"
+            )
+
+    def get(self, key : str) -> Optional[Any] :
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys : Iterable[str]) -> Dict[str, Any] :
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock, self._connection :
+            # SQLite limits the number of bound parameters, so query by chunks
+            for start in range(0, len(keys), 500) :
+                chunk = keys[start:start+500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT key, value FROM {self.table} WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update(rows)
+            if found and self.max_entries is not None :
+                now = time.time()
+                self._connection.executemany(
+                    f"UPDATE {self.table} SET last_access = ? WHERE key = ?", [(now, key) for key in found]
+                )
+        return found
+
+    def set(self, key : str, value : Any) -> None :
+        self.set_many([(key, value)])
+
+    def set_many(self, items : Iterable[Tuple[str, Any]]) -> None :
+        now = time.time()
+        with self._lock, self._connection :
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, last_access) VALUES (?, ?, ?)",
+                [(key, value, now) for key, value in items]
+            )
+            if self.max_entries is not None :
+                self._evict()
+
+    def delete_many(self, keys : Iterable[str]) -> None :
+        with self._lock, self._connection :
+            self._connection.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in keys])
+
+    def keys(self) -> List[str] :
+        with self._lock :
+            return [row[0] for row in self._connection.execute(f"SELECT key FROM {self.table}")]
+
+    def clear(self) -> None :
+        with self._lock, self._connection :
+            self._connection.execute(f"DELETE FROM {self.table}")
+
+    def close(self) -> None :
+        self._connection.close()
+
+    def _evict(self) -> None :
+        count = self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0 :
+            self._connection.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+
+    def __contains__(self, key : str) -> bool :
+        with self._lock :
+            return self._connection.execute(f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int :
+        with self._lock :
+            return self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
@@ -0,0 +1,15 @@
+from typing import Callable, Iterator, Optional
+
+
+def record_stream(chunks : Iterator[Optional[str]], on_complete : Callable[[str], None]) -> Iterator[Optional[str]] :
+    """Yield the streamed chunks, on_complete receives the full text once the stream is complete"""
+    received = []
+    for chunk in chunks :
+        if chunk :
+            received.append(chunk)
+        yield chunk
+    on_complete("".join(received))
+
+def replay(text : str) -> Iterator[str] :
+    """Stream a cached text, like a streamed completion"""
+    yield text
@@ -0,0 +1,224 @@
+"""
+Lightweight tracing : the pipeline emits spans (name, duration, attributes such as token counts) to the tracers
+registered with add_tracer. Without tracer, span() returns a shared no-op span, so tracing costs almost nothing.
+
+    aggregator = MetricsAggregator()
+    add_tracer(aggregator)
+    chain.run(user_input="...")
+    print(aggregator.summary())
+    print(aggregator.to_prometheus())
+"""
+
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+from collections import defaultdict, deque
+import contextvars
+import threading
+import time
+
+_tracers : List["Tracer"] = []
+_current_span = contextvars.ContextVar("cadenai_current_span", default=None)
+
+#Attributes summed by MetricsAggregator, the other numeric attributes are parameters (limit, max_tokens...)
+COUNTERS = frozenset({
+    "prompt_tokens", "completion_tokens", "total_tokens", "context_tokens",
+    "retries", "results", "chunks", "cache_hits",
+})
+
+
+class Span() :
+    """A timed operation. The aggregator sums the COUNTERS attributes, those ending with _seconds are distributions."""
+
+    recording = True
+
+    def __init__(self, name : str, attributes : Dict[str, Any], detached : bool = False) :
+        self.name = name
+        self.attributes = attributes
+        self.detached = detached #A detached span is not the parent of the spans opened while it runs
+        self.parent = None
+        self.start = None
+        self.duration = None
+        self.error = None
+        self._token = None
+
+    def set(self, **attributes) -> None :
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span" :
+        parent = _current_span.get()
+        self.parent = parent.name if parent is not None else None
+        if not self.detached :
+            self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool :
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit) : #A stream closed early by its consumer did not fail
+            self.error = exc_type.__name__
+        if self._token is not None :
+            _current_span.reset(self._token)
+        for tracer in list(_tracers) :
+            tracer.on_span_end(self)
+        return False
+
+
+class NoOpSpan() :
+    """Returned by span() when no tracer is registered"""
+
+    recording = False
+
+    def set(self, **attributes) -> None :
+        pass
+
+    def __enter__(self) -> "NoOpSpan" :
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool :
+        return False
+
+NOOP_SPAN = NoOpSpan()
+
+
+class Tracer(ABC) :
+
+    @abstractmethod
+    def on_span_end(self, span : Span) -> None :
+        pass
+
+
+def add_tracer(tracer : Tracer) -> None :
+    _tracers.append(tracer)
+
+def remove_tracer(tracer : Tracer) -> None :
+    if tracer in _tracers :
+        _tracers.remove(tracer)
+
+def is_enabled() -> bool :
+    return bool(_tracers)
+
+def span(name : str, **attributes) :
+    """Context manager timing an operation, use span.set(...) to add attributes known at the end"""
+    if not _tracers :
+        return NOOP_SPAN
+    return Span(name, attributes)
+
+def stream_span(name : str, **attributes) :
+    """span() for a generator : the consumer's own spans, opened between two yields, are not its children"""
+    if not _tracers :
+        return NOOP_SPAN
+    return Span(name, attributes, detached=True)
+
+def trace_retry(name : str) -> Callable :
+    """before_sleep callback for tenacity : each retry is emitted as a "<name>.retry" span"""
+    def before_sleep(retry_state) -> None :
+        if _tracers :
+            with span(f"{name}.retry", retries=1, attempt=retry_state.attempt_number) :
+                pass
+    return before_sleep
+
+def usage_attributes(response : Any) -> Dict[str, int] :
+    """Token counts reported by the API in response.usage (OpenAI and Mistral)"""
+    usage = getattr(response, "usage", None)
+    attributes = {}
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens") :
+        value = getattr(usage, key, None)
+        if isinstance(value, int) :
+            attributes[key] = value
+    return attributes
+
+
+class MetricsAggregator(Tracer) :
+    """
+    In-process aggregation of the spans by name : count, errors, p50/p95/p99 of the durations
+    (over the last max_samples spans) and totals of the counter attributes (tokens, retries...).
+    """
+
+    def __init__(self, max_samples : int = 10000, quantiles : tuple = (0.5, 0.95, 0.99), counters : frozenset = COUNTERS) :
+        self.max_samples = max_samples
+        self.quantiles = quantiles
+        self.counters = counters
+        self._lock = threading.Lock()
+        self._counts = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._durations_sum = defaultdict(float)
+        self._durations = defaultdict(lambda : deque(maxlen=self.max_samples))
+        self._totals = defaultdict(lambda : defaultdict(float)) #span name -> attribute -> sum
+        self._distributions = defaultdict(lambda : deque(maxlen=self.max_samples)) #(span name, attribute) -> samples
+
+    def on_span_end(self, span : Span) -> None :
+        with self._lock :
+            self._counts[span.name] += 1
+            self._errors[span.name] += span.error is not None
+            self._durations_sum[span.name] += span.duration
+            self._durations[span.name].append(span.duration)
+            for key, value in span.attributes.items() :
+                if isinstance(value, bool) or not isinstance(value, (int, float)) :
+                    continue
+                if key.endswith("_seconds") :
+                    self._distributions[(span.name, key)].append(value)
+                elif key in self.counters :
+                    self._totals[span.name][key] += value
+
+    def summary(self) -> Dict[str, dict] :
+        with self._lock :
+            output = {}
+            for name, count in self._counts.items() :
+                stats = {"count" : count, "errors" : self._errors[name], "total_seconds" : self._durations_sum[name]}
+                stats.update({f"p{round(q * 100)}" : value for q, value in zip(self.quantiles, quantiles(self._durations[name], self.quantiles))})
+                stats.update(self._totals[name])
+                for (span_name, key), samples in self._distributions.items() :
+                    if span_name == name :
+                        stats.update({f"{key}_p{round(q * 100)}" : value for q, value in zip(self.quantiles, quantiles(samples, self.quantiles))})
+                output[name] = stats
+            return output
+
+    def reset(self) -> None :
+        with self._lock :
+            for values in (self._counts, self._errors, self._durations_sum, self._durations, self._totals, self._distributions) :
+                values.clear()
+
+    def to_prometheus(self, prefix : str = "cadenai") -> str :
+        """Metrics in the Prometheus text exposition format, to serve on a /metrics endpoint"""
+
+        with self._lock :
+            lines = [
+                f"# HELP {prefix}_span_duration_seconds Duration of the traced operations",
+                f"# TYPE {prefix}_span_duration_seconds summary",
+            ]
+            for name, count in self._counts.items() :
+                label = f'span="{escape_label(name)}"'
+                for q, value in zip(self.quantiles, quantiles(self._durations[name], self.quantiles)) :
+                    lines.append(f'{prefix}_span_duration_seconds{{{label},quantile="{q}"}} {value}')
+                lines.append(f"{prefix}_span_duration_seconds_sum{{{label}}} {self._durations_sum[name]}")
+                lines.append(f"{prefix}_span_duration_seconds_count{{{label}}} {count}")
+
+            lines += [f"# HELP {prefix}_span_errors_total Traced operations that raised", f"# TYPE {prefix}_span_errors_total counter"]
+            for name in self._counts :
+                lines.append(f'{prefix}_span_errors_total{{span="{escape_label(name)}"}} {self._errors[name]}')
+
+            lines += [f"# HELP {prefix}_span_attribute_total Sum of a counter span attribute (tokens, retries...)", f"# TYPE {prefix}_span_attribute_total counter"]
+            for name, totals in self._totals.items() :
+                for key, value in totals.items() :
+                    lines.append(f'{prefix}_span_attribute_total{{span="{escape_label(name)}",attribute="{escape_label(key)}"}} {value}')
+
+            lines += [f"# HELP {prefix}_span_attribute_seconds Timing attribute of a span (e.g. time to first token)", f"# TYPE {prefix}_span_attribute_seconds summary"]
+            for (name, key), samples in self._distributions.items() :
+                label = f'span="{escape_label(name)}",attribute="{escape_label(key)}"'
+                for q, value in zip(self.quantiles, quantiles(samples, self.quantiles)) :
+                    lines.append(f'{prefix}_span_attribute_seconds{{{label},quantile="{q}"}} {value}')
+                lines.append(f"{prefix}_span_attribute_seconds_sum{{{label}}} {sum(samples)}")
+                lines.append(f"{prefix}_span_attribute_seconds_count{{{label}}} {len(samples)}")
+
+            return "\n".join(lines) + "\n"
+
+
+def quantiles(samples : Any, levels : tuple) -> List[Optional[float]] :
+    """Nearest-rank quantiles of the samples, None when there is no sample"""
+    ordered = sorted(samples)
+    if not ordered :
+        return [None for _ in levels]
+    return [ordered[min(len(ordered) - 1, max(0, int(round(level * len(ordered))) - 1))] for level in levels]
+
+def escape_label(value : str) -> str :
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,52 +1,232 @@
-from typing import List, Union
+from typing import List, Union, Iterator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from array import array
+import hashlib
 
 from tenacity import retry
 
 from tqdm import tqdm
-from openai import OpenAI
 from tenacity import retry, wait_exponential
 import os
-from dotenv import load_dotenv, find_dotenv
-_ = load_dotenv(find_dotenv())
 
+from ..environment import load_environment
 from ..schema import DocumentHandler, Embeddings
+from ..encoder import LazyEncoder
+from ..storage import SQLiteStore
+from ..rate_limiter import RateLimiter
+from .. import tracing
 
-class OpenAIEmbeddings(Embeddings) : 
+class OpenAIEmbeddings(Embeddings) :
 
-    def __init__(self, model : str = "text-embedding-ada-002"):
+    encoder = LazyEncoder()
 
+    def __init__(self,
+                 model : str = "text-embedding-ada-002",
+                 batch_size : int = 512,
+                 max_tokens_per_batch : int = 100000,
+                 max_concurrent_requests : int = 1,
+                 rate_limiter : Optional[RateLimiter] = None
+                 ):
+
+        from openai import OpenAI
+        load_environment()
         self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self.model = model
         self.dimension = 1536
+        self.batch_size = batch_size #The API accepts at most 2048 inputs per request
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_concurrent_requests = max_concurrent_requests #Number of batches in flight at the same time
+        self.rate_limiter = rate_limiter
+        self._encoder = None
+
 
     def embed_query(self, text : Union[str,DocumentHandler]) -> List[float]:
 
         if isinstance(text,DocumentHandler) :
             text = text.page_content
 
-        response = self.client.embeddings.create(
-            input=text,
-            model=self.model
-        )
+        if self.rate_limiter is not None :
+            self.rate_limiter.acquire_for_texts([text])
+
+        with tracing.span("embeddings.embed_query", model=self.model) as span :
+            response = self.client.embeddings.create(
+                input=text,
+                model=self.model
+            )
+            if span.recording :
+                span.set(**tracing.usage_attributes(response))
 
         return response.data[0].embedding
-    
-    @retry(wait=wait_exponential(multiplier=1, min=4, max=10))
+
+    @retry(wait=wait_exponential(multiplier=1, min=4, max=10), before_sleep=tracing.trace_retry("embeddings.embed_query"))
     def embed_with_retry(self, text) -> List[float]:
         return self.embed_query(text=text)
 
+    @retry(wait=wait_exponential(multiplier=1, min=4, max=10), before_sleep=tracing.trace_retry("embeddings.embed_batch"))
+    def embed_batch_with_retry(self, texts : List[str], num_tokens : Optional[int] = None) -> List[List[float]]:
+        '''Embed a batch of texts in a single request, the vectors are returned in input order.
+        num_tokens is the token count of the batch when the caller already has it, it is charged to the rate limiter.'''
+
+        if self.rate_limiter is not None :
+            if num_tokens is None :
+                self.rate_limiter.acquire_for_texts(texts)
+            else :
+                self.rate_limiter.acquire(num_tokens)
+
+        with tracing.span("embeddings.embed_batch", model=self.model, texts=len(texts)) as span :
+            response = self.client.embeddings.create(
+                input=texts,
+                model=self.model
+            )
+            if span.recording :
+                span.set(**tracing.usage_attributes(response))
+
+        embeddings = [None] * len(texts)
+        for item in response.data :
+            embeddings[item.index] = item.embedding
+        return embeddings
+
     def embed_documents(self, documents: List[DocumentHandler], loading_bar : bool = True ) -> List[List[float]]:
-        '''Embed documents'''
+        '''Embed documents, packed in batches bounded by batch_size and max_tokens_per_batch.
+        With max_concurrent_requests > 1 the batches are sent from a thread pool, the output order stays the input order'''
+
+        texts = [document.page_content if isinstance(document,DocumentHandler) else document for document in documents]
+        embeddings: List[List[float]] = [None] * len(texts)
+
+        progress_bar = tqdm(total=len(texts), desc="Embedding documents") if loading_bar else None
 
-        embeddings: List[List[float]] = []
-        if loading_bar : 
-            documents = tqdm(documents, desc="Embedding documents")
+        def embed_batch(batch : Tuple[List[int], int]) :
+            batch_indices, batch_tokens = batch
+            batch_embeddings = self.embed_batch_with_retry(texts=[texts[i] for i in batch_indices], num_tokens=batch_tokens)
+            for i, embedding in zip(batch_indices, batch_embeddings) :
+                embeddings[i] = embedding
+            if progress_bar is not None :
+                progress_bar.update(len(batch_indices))
 
-        for text in documents : 
-            if isinstance(text,DocumentHandler) :
-                text = text.page_content
-            response = self.embed_with_retry(text=text)
-            embeddings.append(response)
+        with tracing.span("embeddings.embed_documents", model=self.model, documents=len(texts)) :
+            if self.max_concurrent_requests > 1 :
+                with ThreadPoolExecutor(max_workers=self.max_concurrent_requests) as executor :
+                    futures = [executor.submit(embed_batch, batch) for batch in self._make_batches(texts)]
+                    for future in as_completed(futures) :
+                        future.result()
+            else :
+                for batch in self._make_batches(texts) :
+                    embed_batch(batch)
+
+        if progress_bar is not None :
+            progress_bar.close()
 
         return embeddings
-        
\ No newline at end of file
+
+    def _make_batches(self, texts : List[str], count_block_size : int = 1024) -> Iterator[Tuple[List[int], int]]:
+        '''Yield (list of indices, number of tokens), each list fitting in one embeddings request.
+        Tokens are counted once per text, by blocks of count_block_size texts'''
+
+        batch = []
+        batch_tokens = 0
+        for block_start in range(0, len(texts), count_block_size) :
+            token_counts = self.encoder.count_tokens_batch(texts[block_start:block_start+count_block_size])
+            for i, num_tokens in enumerate(token_counts, start=block_start) :
+                if batch and (len(batch) >= self.batch_size or batch_tokens + num_tokens > self.max_tokens_per_batch) :
+                    yield batch, batch_tokens
+                    batch = []
+                    batch_tokens = 0
+                batch.append(i)
+                batch_tokens += num_tokens
+
+        if batch :
+            yield batch, batch_tokens
+
+
+class CacheBackedEmbeddings(Embeddings) :
+    """
+    Wrap an embedder with a persistent cache keyed by a hash of (model, text).
+    Only the cache misses are sent to the wrapped embedder.
+    Vectors are stored as float32 in a SQLite file, max_entries bounds it with LRU eviction.
+    """
+
+    def __init__(self,
+                 embedder : Embeddings,
+                 path : str = "embeddings_cache.sqlite",
+                 max_entries : Optional[int] = None
+                 ):
+
+        self.embedder = embedder
+        self.store = SQLiteStore(path=path, table="embeddings", max_entries=max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self) -> str :
+        return getattr(self.embedder, "model", type(self.embedder).__name__)
+
+    @property
+    def dimension(self) -> int :
+        return self.embedder.dimension
+
+    # Read by the vector stores to size their ingest batches
+    @property
+    def batch_size(self) -> Optional[int] :
+        return getattr(self.embedder, "batch_size", None)
+
+    @property
+    def max_concurrent_requests(self) -> Optional[int] :
+        return getattr(self.embedder, "max_concurrent_requests", None)
+
+    @property
+    def hit_rate(self) -> float :
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def embed_query(self, text : Union[str,DocumentHandler]) -> List[float]:
+
+        if isinstance(text,DocumentHandler) :
+            text = text.page_content
+
+        key = self._key(text)
+        cached = self.store.get(key)
+        if cached is not None :
+            self.hits += 1
+            return self._decode(cached)
+
+        self.misses += 1
+        embedding = self.embedder.embed_query(text)
+        self.store.set(key, self._encode(embedding))
+        return embedding
+
+    def embed_documents(self, documents: List[DocumentHandler], loading_bar : bool = True ) -> List[List[float]]:
+
+        texts = [document.page_content if isinstance(document,DocumentHandler) else document for document in documents]
+        keys = [self._key(text) for text in texts]
+        cached = self.store.get_many(keys)
+
+        missing = {} #key -> text, each distinct text is embedded once
+        for key, text in zip(keys, texts) :
+            if key not in cached and key not in missing :
+                missing[key] = text
+
+        num_misses = sum(1 for key in keys if key not in cached)
+        self.hits += len(keys) - num_misses
+        self.misses += num_misses
+
+        computed = {}
+        if missing :
+            missing_embeddings = self.embedder.embed_documents(list(missing.values()), loading_bar=loading_bar)
+            computed = dict(zip(missing.keys(), missing_embeddings))
+            self.store.set_many((key, self._encode(embedding)) for key, embedding in computed.items())
+
+        return [computed[key] if key in computed else self._decode(cached[key]) for key in keys]
+
+    def cache_info(self) -> dict :
+        return {"hits" : self.hits, "misses" : self.misses, "hit_rate" : self.hit_rate, "size" : len(self.store)}
+
+    def _key(self, text : str) -> str :
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _encode(embedding : List[float]) -> bytes :
+        return array("f", embedding).tobytes()
+
+    @staticmethod
+    def _decode(data : bytes) -> List[float] :
+        return array("f", data).tolist()
@@ -1,8 +1,121 @@
-from typing import List, Any
+from typing import List, Any, Dict, Iterable, Iterator, Union, Optional, Tuple
+from itertools import islice
+import hashlib
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from tqdm import tqdm
+import numpy as np
 
 from qdrant_client import QdrantClient, models
 
-from ..schema import VectorDB, Embeddings, DocumentHandler
+from ..schema import VectorDB, Embeddings, DocumentHandler, Loader, TextSplitter
+from ..storage import SQLiteStore
+from .. import tracing
+from .vector_index import create_index, BLOCK_SIZE
+
+POINT_ID_NAMESPACE = uuid.UUID("6f1c2b9e-3d4a-5b8c-9e7f-0a1b2c3d4e5f")
+
+def point_id(payload : dict) -> str :
+    """Deterministic UUID of a chunk, derived from its text and source metadata.
+    Uploading the same chunk twice upserts the same point, so writers can run in parallel."""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, json.dumps(payload, sort_keys=True, ensure_ascii=False)))
+
+def prepare_payloads(documents : List[DocumentHandler]) -> List[dict]: 
+    """Payload of each chunk : its metadata plus its text under the "text" key"""
+
+    payloads = []
+    for document in documents : 
+        if isinstance(document, DocumentHandler) : 
+            text = document.page_content
+            metadata = document.metadata.copy()
+            metadata["text"] = text
+            payloads.append(metadata)
+        else : 
+            raise Exception("Documents must be of type DocumentHandler")
+        
+    return payloads
+
+def document_hash(document : DocumentHandler) -> str :
+    return hashlib.sha256(json.dumps(document.model_dump(), sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def batched(iterable : Iterable, batch_size : int) -> Iterator[List] :
+    """Split any iterable in lists of batch_size items, without materializing it"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)) :
+        yield batch
+
+RANGE_OPERATORS = ("gt", "gte", "lt", "lte")
+
+def ingest_batch_size(embedder : Embeddings, batch_size : Optional[int] = None) -> int :
+    """batch_size, by default enough documents to fill every concurrent embeddings request of the embedder"""
+    if batch_size is not None :
+        return batch_size
+    request_size = getattr(embedder, "batch_size", None)
+    concurrency = getattr(embedder, "max_concurrent_requests", None)
+    if not isinstance(request_size, int) :
+        return 256
+    return request_size * (concurrency if isinstance(concurrency, int) else 1)
+
+def build_filter(metadata_filter : Optional[Union[dict, models.Filter]]) -> Optional[models.Filter] :
+    """
+    Translate a metadata filter to a Qdrant filter, every condition must match :
+    {"tenant" : "acme"} an exact value, {"type" : ["pdf", "html"]} any of the values, {"year" : {"gte" : 2020}} a range.
+    Nested fields use dots ("author.name"). A models.Filter is passed as is.
+    """
+
+    if metadata_filter is None or isinstance(metadata_filter, models.Filter) :
+        return metadata_filter
+
+    conditions = []
+    for key, condition in metadata_filter.items() :
+        if isinstance(condition, dict) :
+            if not condition or set(condition) - set(RANGE_OPERATORS) :
+                raise ValueError(f"Invalid range for '{key}', use the operators: {', '.join(RANGE_OPERATORS)}")
+            conditions.append(models.FieldCondition(key=key, range=models.Range(**condition)))
+        elif isinstance(condition, (list, tuple, set)) :
+            conditions.append(models.FieldCondition(key=key, match=models.MatchAny(any=list(condition))))
+        else :
+            conditions.append(models.FieldCondition(key=key, match=models.MatchValue(value=condition)))
+
+    return models.Filter(must=conditions)
+
+def match_filter(payload : dict, metadata_filter : dict) -> bool :
+    """Evaluate a metadata filter (see build_filter) on a payload, like Qdrant does.
+    A list in the payload matches if one of its values matches."""
+
+    for key, condition in metadata_filter.items() :
+        value = payload
+        for part in key.split(".") :
+            value = value.get(part) if isinstance(value, dict) else None
+        values = value if isinstance(value, list) else [value]
+
+        if isinstance(condition, dict) :
+            if not condition or set(condition) - set(RANGE_OPERATORS) :
+                raise ValueError(f"Invalid range for '{key}', use the operators: {', '.join(RANGE_OPERATORS)}")
+            matched = any(in_range(value, condition) for value in values)
+        elif isinstance(condition, (list, tuple, set)) :
+            matched = any(value in condition for value in values if value is not None)
+        else :
+            matched = condition in values
+
+        if not matched :
+            return False
+
+    return True
+
+def in_range(value : Any, condition : dict) -> bool :
+    if isinstance(value, bool) or not isinstance(value, (int, float)) :
+        return False
+    return (
+        ("gt" not in condition or value > condition["gt"])
+        and ("gte" not in condition or value >= condition["gte"])
+        and ("lt" not in condition or value < condition["lt"])
+        and ("lte" not in condition or value <= condition["lte"])
+    )
 
 class QdrantManager() : 
 
@@ -34,8 +147,12 @@ class Qdrant(VectorDB):
         location : str, 
         port : int,
         collection_name : str,
-        embedder : Embeddings
+        embedder : Embeddings,
+        payload_indexes : Optional[Dict[str, str]] = None,
+        text_store : Optional[SQLiteStore] = None
     ): 
+        if text_store is not None and text_store.max_entries is not None :
+            raise ValueError("text_store must not have max_entries : an evicted text could not be returned by a search")
         self.location = location
         self.port = port
         self.client = QdrantClient(
@@ -44,22 +161,108 @@ class Qdrant(VectorDB):
         )
         self.collection_name = collection_name
         self.embedder = embedder
+        self.payload_indexes = payload_indexes #Metadata field -> schema type ("keyword", "integer", "float", "bool", "text"...), indexed by create_collection
+        self.text_store = text_store #With a store (without max_entries), chunk texts are kept there by point ID instead of in the Qdrant payload
+        self.last_ingest_stats = None
 
     def __len__(self) -> int:
         return self.client.count(collection_name=self.collection_name).count
     
-    def add_documents(self,documents : List[DocumentHandler], loading_bar : bool = False) : 
+    def add_documents(self,
+                      documents : Iterable[DocumentHandler],
+                      loading_bar : bool = False,
+                      batch_size : Optional[int] = None,
+                      parallel : int = 1,
+                      pipeline : bool = False
+                      ) : 
+        """
+        Embed and upload the documents by batches of batch_size (by default, see ingest_batch_size).
+        documents can be any iterable, e.g. TextSplitter.lazy_split(loader), only one batch is held in memory
+        (two with pipeline=True, where batch N is uploaded while batch N+1 is embedded).
+        With parallel > 1, each batch is split in parallel sub-batches uploaded at the same time from a thread pool.
+        Per-stage throughput is stored in last_ingest_stats.
+        """
+
+        progress_bar = tqdm(desc="Adding documents", unit="docs") if loading_bar else None
+        stats = {"documents" : 0, "batches" : 0, "embedding_seconds" : 0.0, "upload_seconds" : 0.0}
+        start = time.perf_counter()
+        batch_size = ingest_batch_size(self.embedder, batch_size)
+
+        def upload(records : List[models.Record]) :
+            upload_start = time.perf_counter()
+            operation_info = self._upload_records(records, executor=upload_executor, parallel=parallel)
+            stats["upload_seconds"] += time.perf_counter() - upload_start
+            if progress_bar is not None :
+                progress_bar.update(len(records))
+            return operation_info
+
+        operation_info = None
+        upload_executor = ThreadPoolExecutor(max_workers=parallel) if parallel > 1 else None
+        executor = ThreadPoolExecutor(max_workers=1) if pipeline else None
+        pending_upload = None
+        try :
+            for batch in batched(documents, batch_size) :
+                embedding_start = time.perf_counter()
+                records = self._embed_batch(batch)
+                stats["embedding_seconds"] += time.perf_counter() - embedding_start
+                stats["documents"] += len(batch)
+                stats["batches"] += 1
+
+                if executor is None :
+                    operation_info = upload(records)
+                    continue
+
+                # Wait for the previous upload before queuing this one, so at most one batch waits in memory
+                if pending_upload is not None :
+                    operation_info = pending_upload.result()
+                pending_upload = executor.submit(upload, records)
+
+            if pending_upload is not None :
+                operation_info = pending_upload.result()
+        finally :
+            if executor is not None :
+                executor.shutdown(wait=True)
+            if upload_executor is not None :
+                upload_executor.shutdown(wait=True)
+            if progress_bar is not None :
+                progress_bar.close()
 
-        documents_embedded = self.embedder.embed_documents(documents=documents,loading_bar=loading_bar)
+        stats["total_seconds"] = time.perf_counter() - start
+        stats["embedding_docs_per_second"] = stats["documents"] / stats["embedding_seconds"] if stats["embedding_seconds"] else 0.0
+        stats["upload_docs_per_second"] = stats["documents"] / stats["upload_seconds"] if stats["upload_seconds"] else 0.0
+        self.last_ingest_stats = stats
+
+        return operation_info
+
+    def _embed_batch(self, documents : List[DocumentHandler]) -> List[models.Record] :
+
+        documents_embedded = self.embedder.embed_documents(documents=documents,loading_bar=False)
         payloads = self._prepare_payloads(documents)
-        vector_list = self._prepare_vector_list(documents_embedded, payloads)
+        records = self._prepare_vector_list(documents_embedded, payloads)
+
+        if self.text_store is not None :
+            # The IDs are computed with the text, so they stay the same with or without text store
+            self.text_store.set_many((record.id, record.payload.pop("text")) for record in records)
 
-        operation_info = self.client.upload_records(
+        return records
+
+    def _upload_records(self, records : List[models.Record], executor : Optional[ThreadPoolExecutor] = None, parallel : int = 1) :
+        """Upload the records in one request, or in parallel sub-batches sent from the executor"""
+
+        with tracing.span("vector_db.upload", collection=self.collection_name, records=len(records)) :
+            if executor is None or parallel <= 1 :
+                return self._upload_request(records)
+            sub_batch_size = -(-len(records) // parallel)
+            futures = [executor.submit(self._upload_request, sub_batch) for sub_batch in batched(records, sub_batch_size)]
+            return [future.result() for future in futures][-1]
+
+    def _upload_request(self, records : List[models.Record]) :
+        return self.client.upload_records(
             collection_name=self.collection_name,
             wait=True,
-            records = vector_list
+            records=records,
+            batch_size=len(records)
         )
-        return operation_info
     
     def create_collection(self):
         self.client.recreate_collection(
@@ -69,70 +272,649 @@ class Qdrant(VectorDB):
                 distance=models.Distance.COSINE
             )
         )
+        if self.text_store is not None :
+            self.text_store.clear()
+        self.create_payload_indexes()
 
-    def create_from_documents(self, documents: List[DocumentHandler], loading_bar : bool = True):
+    def create_payload_indexes(self) :
+        """Index the payload_indexes fields, filters on them no longer scan every payload"""
+        for field_name, field_schema in (self.payload_indexes or {}).items() :
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=field_name,
+                field_schema=models.PayloadSchemaType(field_schema) if isinstance(field_schema, str) else field_schema
+            )
+
+    def create_from_documents(self, documents: Iterable[DocumentHandler], loading_bar : bool = True):
         self.create_collection()
         return self.add_documents(documents=documents, loading_bar=loading_bar)
     
     def delete_collection(self):
         self.client.delete_collection(collection_name=self.collection_name)
+        if self.text_store is not None :
+            self.text_store.clear()
+
+    def collection_exists(self) -> bool :
+        return self.collection_name in [collection.name for collection in self.client.get_collections().collections]
+
+    def sync_documents(self,
+                       documents : Union[Loader, Iterable[DocumentHandler]],
+                       manifest_path : str,
+                       text_splitter : Optional[TextSplitter] = None,
+                       source_key : str = "source",
+                       loading_bar : bool = False,
+                       batch_size : Optional[int] = None
+                       ) -> dict :
+        """
+        Incremental alternative to create_from_documents.
+        The manifest (a JSON file) keeps, for each source document, its hash and the IDs of its chunks.
+        Only new or changed documents are split, embedded and upserted, the chunks that disappeared are deleted,
+        and so are the documents missing from this run. Nothing is wiped.
+        Source documents are identified by metadata[source_key] and their rank among the documents of that source
+        (the pages of a PDF share one source), or by their position when source_key is missing.
+        The manifest also keeps the text_splitter fingerprint : when the splitter or its settings change, every document is split again.
+        """
+
+        batch_size = ingest_batch_size(self.embedder, batch_size)
+        manifest, previous_splitter = self._load_manifest(manifest_path)
+        if not self.collection_exists() :
+            self.create_collection()
+            manifest = {}
+        splitter = text_splitter.fingerprint() if text_splitter else None
+        same_splitter = splitter == previous_splitter
+
+        stats = {"added" : 0, "updated" : 0, "unchanged" : 0, "removed" : 0, "upserted_chunks" : 0, "deleted_chunks" : 0}
+        new_manifest = {}
+        stale_ids = []
+
+        if isinstance(documents, Loader) :
+            documents = documents.lazy_load()
+
+        source_ranks = defaultdict(int)
+
+        def changed_chunks() :
+            for position, document in enumerate(documents) :
+                source = document.metadata.get(source_key)
+                if source is None :
+                    key = str(position)
+                else :
+                    key = f"{source}#{source_ranks[source]}"
+                    source_ranks[source] += 1
+                if key in new_manifest :
+                    raise ValueError(f"Two documents have the manifest key '{key}', set distinct metadata['{source_key}']")
+                digest = document_hash(document)
+                previous = manifest.get(key)
+
+                if previous is not None and previous["hash"] == digest and same_splitter :
+                    new_manifest[key] = previous
+                    stats["unchanged"] += 1
+                    continue
+
+                chunks = list(text_splitter.lazy_split(document)) if text_splitter else [document]
+                ids = [point_id(payload) for payload in self._prepare_payloads(chunks)]
+                new_manifest[key] = {"hash" : digest, "ids" : ids}
+                stats["updated" if previous is not None else "added"] += 1
+                stats["upserted_chunks"] += len(chunks)
+                if previous is not None :
+                    stale_ids.extend(set(previous["ids"]) - set(ids))
+                yield from chunks
+
+        self.add_documents(changed_chunks(), loading_bar=loading_bar, batch_size=batch_size)
+
+        for key, entry in manifest.items() :
+            if key not in new_manifest :
+                stats["removed"] += 1
+                stale_ids.extend(entry["ids"])
+
+        # A chunk that moved to another document keeps its ID, it must not be deleted
+        live_ids = {chunk_id for entry in new_manifest.values() for chunk_id in entry["ids"]}
+        stale_ids = [chunk_id for chunk_id in dict.fromkeys(stale_ids) if chunk_id not in live_ids]
+
+        if stale_ids :
+            for ids in batched(stale_ids, batch_size) :
+                self.client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=models.PointIdsList(points=ids)
+                )
+                if self.text_store is not None :
+                    self.text_store.delete_many(ids)
+            stats["deleted_chunks"] = len(stale_ids)
+
+        self._save_manifest(manifest_path, new_manifest, splitter)
+        return stats
+
+    def _load_manifest(self, manifest_path : str) -> Tuple[dict, Optional[str]] :
+        """Return the sources of the manifest and the fingerprint of the splitter that produced their chunks"""
+        if not os.path.exists(manifest_path) :
+            return {}, None
+        with open(manifest_path, "r", encoding="utf-8") as file :
+            content = json.load(file)
+        if content.get("collection_name") != self.collection_name :
+            raise ValueError(f"Manifest {manifest_path} belongs to the collection {content.get('collection_name')}")
+        return content["sources"], content.get("splitter")
+
+    def _save_manifest(self, manifest_path : str, sources : dict, splitter : Optional[str]) -> None :
+        # Written next to the target and renamed, so a crash never leaves a half-written manifest
+        temporary_path = manifest_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file :
+            json.dump({"collection_name" : self.collection_name, "splitter" : splitter, "sources" : sources}, file, ensure_ascii=False)
+        os.replace(temporary_path, manifest_path)
     
-    def similarity_search(self, query : str, limit : int, show_metadata : bool = False) -> List[str] :
-            
-        query_vector = self.embedder.embed_query(query)
+    def similarity_search(self,
+                          query : str,
+                          limit : int,
+                          show_metadata : bool = False,
+                          query_vector : Optional[List[float]] = None,
+                          metadata_filter : Optional[Union[dict, models.Filter]] = None,
+                          score_threshold : Optional[float] = None,
+                          hnsw_ef : Optional[int] = None,
+                          exact : bool = False
+                          ) -> List[str] :
+        """
+        query_vector skips the query embedding when the caller already has it.
+        metadata_filter is applied by Qdrant during the search (see build_filter), results under score_threshold are dropped,
+        hnsw_ef and exact tune the latency / recall trade-off of this call.
+        """
 
-        search_result = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_vector,
-            limit=limit
-        )
+        if query_vector is None :
+            query_vector = self.embedder.embed_query(query)
+
+        with tracing.span("vector_db.search", collection=self.collection_name, limit=limit) as span :
+            search_result = self.client.search(
+                collection_name=self.collection_name,
+                query_vector=query_vector,
+                limit=limit,
+                with_payload=self._payload_selector(show_metadata),
+                with_vectors=False,
+                **self._search_kwargs(metadata_filter, score_threshold, hnsw_ef, exact)
+            )
+            span.set(results=len(search_result))
+        payloads = self._result_payloads(search_result)
         
         if show_metadata : 
-            return [result.payload for result in search_result]
+            return payloads
         else : 
-            return [result.payload["text"] for result in search_result]
+            return [payload["text"] for payload in payloads]
     
-    def similarity_search_with_scores(self, query : str, limit : int) -> List :
+    def similarity_search_with_scores(self,
+                                      query : str,
+                                      limit : int,
+                                      metadata_filter : Optional[Union[dict, models.Filter]] = None,
+                                      score_threshold : Optional[float] = None,
+                                      hnsw_ef : Optional[int] = None,
+                                      exact : bool = False
+                                      ) -> List :
 
         query_vector = self.embedder.embed_query(query)
 
-        search_result = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_vector,
-            limit=limit
-        )
+        with tracing.span("vector_db.search", collection=self.collection_name, limit=limit) as span :
+            search_result = self.client.search(
+                collection_name=self.collection_name,
+                query_vector=query_vector,
+                limit=limit,
+                with_payload=self._payload_selector(show_metadata=False),
+                with_vectors=False,
+                **self._search_kwargs(metadata_filter, score_threshold, hnsw_ef, exact)
+            )
+            span.set(results=len(search_result))
 
         output = []
-        for result in search_result : 
-            output.append([result.payload["text"],result.score])
+        for result, payload in zip(search_result, self._result_payloads(search_result)) : 
+            output.append([payload["text"],result.score])
 
         return output
 
+    def similarity_search_batch(self, queries : List[str], limit : int, show_metadata : bool = False, batch_size : int = 256, **search_kwargs) -> List[List] :
+        """Search many queries at once : the queries are embedded in batched requests
+        and sent to Qdrant batch_size at a time with search_batch. Returns one result list per query.
+        search_kwargs are the metadata_filter, score_threshold, hnsw_ef and exact of similarity_search, applied to every query."""
+
+        batch_results = self._search_batch(queries, limit, batch_size, show_metadata=show_metadata, **search_kwargs)
+        batch_payloads = [self._result_payloads(search_result) for search_result in batch_results]
+
+        if show_metadata :
+            return batch_payloads
+        else :
+            return [[payload["text"] for payload in payloads] for payloads in batch_payloads]
+
+    def similarity_search_batch_with_scores(self, queries : List[str], limit : int, batch_size : int = 256, **search_kwargs) -> List[List] :
+
+        batch_results = self._search_batch(queries, limit, batch_size, **search_kwargs)
+
+        return [
+            [[payload["text"], result.score] for result, payload in zip(search_result, self._result_payloads(search_result))]
+            for search_result in batch_results
+        ]
+
+    def _search_batch(self,
+                      queries : List[str],
+                      limit : int,
+                      batch_size : int,
+                      show_metadata : bool = False,
+                      metadata_filter : Optional[Union[dict, models.Filter]] = None,
+                      score_threshold : Optional[float] = None,
+                      hnsw_ef : Optional[int] = None,
+                      exact : bool = False
+                      ) -> List[List[models.ScoredPoint]] :
+
+        if not queries :
+            return []
+
+        query_vectors = self.embedder.embed_documents(list(queries), loading_bar=False)
+        search_kwargs = self._search_kwargs(metadata_filter, score_threshold, hnsw_ef, exact)
+
+        batch_results = []
+        for vectors in batched(query_vectors, batch_size) :
+            with tracing.span("vector_db.search_batch", collection=self.collection_name, limit=limit, queries=len(vectors)) :
+                batch_results.extend(self.client.search_batch(
+                    collection_name=self.collection_name,
+                    requests=[models.SearchRequest(
+                        vector=vector,
+                        limit=limit,
+                        with_payload=self._payload_selector(show_metadata),
+                        with_vector=False,
+                        filter=search_kwargs.get("query_filter"),
+                        params=search_kwargs.get("search_params"),
+                        score_threshold=search_kwargs.get("score_threshold")
+                    ) for vector in vectors]
+                ))
+
+        return batch_results
+
+    def _payload_selector(self, show_metadata : bool) -> Union[bool, List[str]] :
+        """Only the payload keys the caller needs are transferred"""
+        if show_metadata :
+            return True
+        return False if self.text_store is not None else ["text"]
+
+    def _result_payloads(self, search_result : List[models.ScoredPoint]) -> List[dict] :
+        """Payloads of the results, with their text taken back from the text store"""
+        if self.text_store is None :
+            return [result.payload for result in search_result]
+        texts = self.text_store.get_many(str(result.id) for result in search_result)
+        return [{**(result.payload or {}), "text" : texts.get(str(result.id))} for result in search_result]
+
+    @staticmethod
+    def _search_kwargs(metadata_filter : Optional[Union[dict, models.Filter]],
+                       score_threshold : Optional[float],
+                       hnsw_ef : Optional[int],
+                       exact : bool
+                       ) -> dict :
+        """Optional arguments of client.search, only those set are sent"""
+
+        search_kwargs = {}
+        query_filter = build_filter(metadata_filter)
+        if query_filter is not None :
+            search_kwargs["query_filter"] = query_filter
+        if score_threshold is not None :
+            search_kwargs["score_threshold"] = score_threshold
+        if hnsw_ef is not None or exact :
+            search_kwargs["search_params"] = models.SearchParams(hnsw_ef=hnsw_ef, exact=exact)
+        return search_kwargs
+
     def _prepare_payloads(self, documents : List[DocumentHandler]) -> List[dict]: 
-        
-        payloads = []
-        for document in documents : 
-            if isinstance(document, DocumentHandler) : 
-                text = document.page_content
-                metadata = document.metadata.copy()
-                metadata["text"] = text
-                payloads.append(metadata)
-            else : 
-                raise Exception("Documents must be of type DocumentHandler")
-            
-        return payloads
+        return prepare_payloads(documents)
     
     def _prepare_vector_list(self, documents_embedded : List[List[float]], payloads : List[dict]):
                 
         vector_list = []
 
-        i=len(self)
         for vector, payload in zip(documents_embedded, payloads) :
             vector_list.append(models.Record(
-                id=i,
+                id=point_id(payload),
                 vector=vector,
                 payload=payload
             ))
-            i+=1
 
-        return vector_list
\ No newline at end of file
+        return vector_list
+
+
+class NumpyVectorDB(VectorDB) :
+
+    """
+    In-process vector store for small and medium collections, no Qdrant server needed.
+    Vectors are normalized and kept in one contiguous float32 matrix, a search is a single matmul
+    plus argpartition, with the same cosine scores and payloads as Qdrant.
+    With a path, the collection is persisted as .npy + JSON files and memory-mapped when loaded.
+
+    For large collections, index selects a compressed or approximate index kept in memory
+    ("int8" or "binary" quantization, "ivf" clustering, see vector_index.py) : it shortlists
+    limit * oversampling candidates, which are then rescored with the full precision vectors.
+    Use it with a path, so that the float32 matrix stays memory-mapped and only the candidates are read.
+    With a path the index is saved next to vectors.npy when it is built, and memory-mapped by load().
+    Any write (add_documents, create_collection) invalidates it : the first search after a write rebuilds it
+    over the whole matrix (a full quantization pass, or k-means for "ivf"), so batch the writes before querying.
+    """
+
+    def __init__(self,
+                 embedder : Embeddings,
+                 path : Optional[str] = None,
+                 index : str = "exact",
+                 oversampling : int = 4,
+                 **index_kwargs
+                 ) :
+        self.embedder = embedder
+        self.dimension = embedder.dimension
+        self.path = path
+        self.index_name = index
+        self.index = create_index(index, **index_kwargs)
+        self.index_kwargs = json.loads(json.dumps(index_kwargs, default=str)) #As read back from index.json
+        self.oversampling = oversampling
+        self._reset()
+        if self.path and os.path.exists(self._vectors_path) :
+            self.load()
+
+    @property
+    def _vectors_path(self) -> str :
+        return os.path.join(self.path, "vectors.npy")
+
+    @property
+    def _payloads_path(self) -> str :
+        return os.path.join(self.path, "payloads.json")
+
+    @property
+    def _index_meta_path(self) -> str :
+        return os.path.join(self.path, "index.json")
+
+    def _index_array_path(self, name : str) -> str :
+        return os.path.join(self.path, f"index.{name}.npy")
+
+    @property
+    def vectors(self) -> np.ndarray :
+        return self._vectors[:self._size]
+
+    def __len__(self) -> int :
+        return self._size
+
+    def add_documents(self, documents : Iterable[DocumentHandler], loading_bar : bool = False, batch_size : Optional[int] = None) :
+
+        progress_bar = tqdm(desc="Adding documents", unit="docs") if loading_bar else None
+
+        for batch in batched(documents, ingest_batch_size(self.embedder, batch_size)) :
+            documents_embedded = self.embedder.embed_documents(documents=batch, loading_bar=False)
+            payloads = self._prepare_payloads(batch)
+            self._upsert([point_id(payload) for payload in payloads], documents_embedded, payloads)
+            if progress_bar is not None :
+                progress_bar.update(len(batch))
+
+        if progress_bar is not None :
+            progress_bar.close()
+
+        if self.path :
+            self.save()
+
+    def create_collection(self) :
+        self._reset()
+        if self.path :
+            self.save()
+
+    def create_from_documents(self, documents : Iterable[DocumentHandler], loading_bar : bool = True) :
+        self.create_collection()
+        return self.add_documents(documents=documents, loading_bar=loading_bar)
+
+    def delete_collection(self) :
+        self._reset()
+        if self.path :
+            index_paths = [self._index_array_path(name) for name in self.index.ARRAYS] if self.index is not None else []
+            for file_path in [self._vectors_path, self._payloads_path, self._index_meta_path] + index_paths :
+                if os.path.exists(file_path) :
+                    os.remove(file_path)
+
+    def similarity_search(self,
+                          query : str,
+                          limit : int,
+                          show_metadata : bool = False,
+                          query_vector : Optional[List[float]] = None,
+                          metadata_filter : Optional[dict] = None,
+                          score_threshold : Optional[float] = None,
+                          hnsw_ef : Optional[int] = None,
+                          exact : bool = False
+                          ) -> List[str] :
+        """
+        Same filters as Qdrant (see build_filter) as a dict, a models.Filter is not supported.
+        exact bypasses the approximate index, hnsw_ef is accepted for compatibility with Qdrant and ignored.
+        """
+
+        self._check_filter(metadata_filter) #Before the query is embedded
+        results = self._search(self.embedder.embed_query(query) if query_vector is None else query_vector, limit, metadata_filter, score_threshold, exact)
+
+        if show_metadata :
+            return [dict(self._payloads[row]) for row, _ in results] #Copies, the caller must not edit the stored payloads
+        else :
+            return [self._payloads[row]["text"] for row, _ in results]
+
+    def similarity_search_with_scores(self,
+                                      query : str,
+                                      limit : int,
+                                      metadata_filter : Optional[dict] = None,
+                                      score_threshold : Optional[float] = None,
+                                      hnsw_ef : Optional[int] = None,
+                                      exact : bool = False
+                                      ) -> List :
+
+        self._check_filter(metadata_filter)
+        results = self._search(self.embedder.embed_query(query), limit, metadata_filter, score_threshold, exact)
+
+        return [[self._payloads[row]["text"], score] for row, score in results]
+
+    def similarity_search_batch(self, queries : List[str], limit : int, show_metadata : bool = False, **search_kwargs) -> List[List] :
+        """Search many queries at once, the queries are embedded in batched requests and scored together.
+        search_kwargs are the metadata_filter, score_threshold, hnsw_ef and exact of similarity_search."""
+
+        self._check_filter(search_kwargs.get("metadata_filter"))
+        batch_results = self._search_batch(self.embedder.embed_documents(list(queries), loading_bar=False), limit, **search_kwargs) if queries else []
+
+        if show_metadata :
+            return [[dict(self._payloads[row]) for row, _ in results] for results in batch_results]
+        else :
+            return [[self._payloads[row]["text"] for row, _ in results] for results in batch_results]
+
+    def similarity_search_batch_with_scores(self, queries : List[str], limit : int, **search_kwargs) -> List[List] :
+
+        self._check_filter(search_kwargs.get("metadata_filter"))
+        batch_results = self._search_batch(self.embedder.embed_documents(list(queries), loading_bar=False), limit, **search_kwargs) if queries else []
+
+        return [[[self._payloads[row]["text"], score] for row, score in results] for results in batch_results]
+
+    def save(self) -> None :
+        os.makedirs(self.path, exist_ok=True)
+        # Written next to the targets and renamed, so a crash never leaves half-written files
+        with open(self._vectors_path + ".tmp", "wb") as file :
+            np.save(file, self.vectors)
+        with open(self._payloads_path + ".tmp", "w", encoding="utf-8") as file :
+            json.dump({"ids" : self._ids, "payloads" : self._payloads}, file, ensure_ascii=False)
+        # The saved index no longer matches the vectors, it is rebuilt and saved again on the next search
+        if self._index_is_stale and os.path.exists(self._index_meta_path) :
+            os.remove(self._index_meta_path)
+        os.replace(self._vectors_path + ".tmp", self._vectors_path)
+        os.replace(self._payloads_path + ".tmp", self._payloads_path)
+
+    def _index_meta(self) -> dict :
+        return {"index" : self.index_name, "params" : self.index_kwargs, "size" : self._size}
+
+    def _save_index(self) -> None :
+        """Save the index arrays, then index.json : an index is only loaded when its index.json matches"""
+        for name, array in self.index.state().items() :
+            with open(self._index_array_path(name) + ".tmp", "wb") as file :
+                np.save(file, array)
+            os.replace(self._index_array_path(name) + ".tmp", self._index_array_path(name))
+        with open(self._index_meta_path + ".tmp", "w", encoding="utf-8") as file :
+            json.dump(self._index_meta(), file)
+        os.replace(self._index_meta_path + ".tmp", self._index_meta_path)
+
+    def _load_index(self) -> bool :
+        """Memory-map the saved index, return False when there is none for these vectors and parameters"""
+        if not os.path.exists(self._index_meta_path) :
+            return False
+        with open(self._index_meta_path, "r", encoding="utf-8") as file :
+            if json.load(file) != self._index_meta() :
+                return False
+        self.index.load_state({name : np.load(self._index_array_path(name), mmap_mode="r") for name in self.index.ARRAYS})
+        return True
+
+    def load(self) -> None :
+        vectors = np.load(self._vectors_path, mmap_mode="r")
+        with open(self._payloads_path, "r", encoding="utf-8") as file :
+            content = json.load(file)
+        self._vectors = vectors
+        self._size = vectors.shape[0]
+        self._ids = content["ids"]
+        self._payloads = content["payloads"]
+        self._id_to_row = {id : row for row, id in enumerate(self._ids)}
+        self._index_is_stale = not (self.index is not None and self._load_index())
+
+    def _reset(self) -> None :
+        self._vectors = np.empty((0, self.dimension), dtype=np.float32)
+        self._size = 0
+        self._ids = []
+        self._payloads = []
+        self._id_to_row = {}
+        self._index_is_stale = True
+
+    def _upsert(self, ids : List[str], vectors : List[List[float]], payloads : List[dict]) -> None :
+
+        vectors = self._normalize(np.asarray(vectors, dtype=np.float32))
+        new_rows = sum(1 for id in dict.fromkeys(ids) if id not in self._id_to_row)
+        self._reserve(self._size + new_rows)
+
+        for id, vector, payload in zip(ids, vectors, payloads) :
+            row = self._id_to_row.get(id)
+            if row is None :
+                row = self._size
+                self._size += 1
+                self._ids.append(id)
+                self._payloads.append(payload)
+                self._id_to_row[id] = row
+            else :
+                self._payloads[row] = payload
+            self._vectors[row] = vector
+
+        self._index_is_stale = True
+
+    def _reserve(self, size : int) -> None :
+        """Grow the matrix by doubling its capacity, a memory-mapped matrix is copied in memory before the first write"""
+        capacity = self._vectors.shape[0]
+        if size <= capacity and not isinstance(self._vectors, np.memmap) :
+            return
+        new_capacity = max(size, 2 * capacity, 1024)
+        vectors = np.empty((new_capacity, self.dimension), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+
+    def _search(self,
+                query_vector : List[float],
+                limit : int,
+                metadata_filter : Optional[dict] = None,
+                score_threshold : Optional[float] = None,
+                exact : bool = False
+                ) -> List :
+        """Top-k : return [(row, score), ...] sorted by decreasing cosine similarity.
+        Without index the search is exact, with one the shortlisted candidates are rescored exactly.
+        With a metadata filter, the matching rows are searched exactly."""
+
+        if self._size == 0 or limit <= 0 :
+            return []
+        query = self._normalize(np.asarray(query_vector, dtype=np.float32))
+        rows = self._filter_rows(metadata_filter)
+        limit = min(limit, self._size if rows is None else len(rows))
+
+        shortlist_size = limit * self.oversampling
+        if rows is not None :
+            scores = self.vectors[rows] @ query
+        elif self.index is None or exact or shortlist_size >= self._size :
+            rows = np.arange(self._size)
+            scores = self.vectors @ query
+        else :
+            rows = np.sort(self._get_index().shortlist(query, shortlist_size))
+            scores = self._vectors[rows] @ query
+            limit = min(limit, len(rows))
+
+        if limit == 0 :
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return self._apply_threshold([(int(rows[i]), float(scores[i])) for i in top], score_threshold)
+
+    def _search_batch(self,
+                      query_vectors : List[List[float]],
+                      limit : int,
+                      metadata_filter : Optional[dict] = None,
+                      score_threshold : Optional[float] = None,
+                      hnsw_ef : Optional[int] = None, #Ignored, see similarity_search
+                      exact : bool = False
+                      ) -> List[List] :
+        """_search for many queries : without index, each block of queries is scored against the collection
+        (or the rows matching the filter) with a single matmul. With an index, the shortlists are per query."""
+
+        use_index = self.index is not None and not exact and limit * self.oversampling < self._size
+        if use_index and metadata_filter is None :
+            return [self._search(query_vector, limit, score_threshold=score_threshold) for query_vector in query_vectors]
+        if self._size == 0 or limit <= 0 :
+            return [[] for _ in query_vectors]
+
+        rows = self._filter_rows(metadata_filter)
+        candidates = self.vectors if rows is None else self.vectors[rows]
+        limit = min(limit, len(candidates))
+        if limit == 0 :
+            return [[] for _ in query_vectors]
+
+        queries = self._normalize(np.asarray(query_vectors, dtype=np.float32))
+        # Queries per matmul, bounds the (candidates x queries) score matrix to about BLOCK_SIZE * 64 floats
+        queries_per_block = max(1, BLOCK_SIZE * 64 // len(candidates))
+
+        batch_results = []
+        for start in range(0, len(queries), queries_per_block) :
+            scores = candidates @ queries[start:start+queries_per_block].T
+            top = np.argpartition(-scores, limit - 1, axis=0)[:limit]
+            for column in range(scores.shape[1]) :
+                column_top = top[:, column]
+                column_scores = scores[column_top, column]
+                order = np.argsort(-column_scores, kind="stable")
+                column_rows = column_top if rows is None else rows[column_top]
+                batch_results.append(self._apply_threshold([(int(column_rows[i]), float(column_scores[i])) for i in order], score_threshold))
+
+        return batch_results
+
+    @staticmethod
+    def _check_filter(metadata_filter : Optional[dict]) -> None :
+        if isinstance(metadata_filter, models.Filter) :
+            raise TypeError("NumpyVectorDB only supports metadata filters as a dict (see build_filter), not a models.Filter")
+
+    def _filter_rows(self, metadata_filter : Optional[dict]) -> Optional[np.ndarray] :
+        """Rows whose payload matches the filter, None without filter"""
+        if metadata_filter is None :
+            return None
+        return np.array([row for row, payload in enumerate(self._payloads) if match_filter(payload, metadata_filter)], dtype=np.int64)
+
+    @staticmethod
+    def _apply_threshold(results : List, score_threshold : Optional[float]) -> List :
+        if score_threshold is None :
+            return results
+        return [(row, score) for row, score in results if score >= score_threshold]
+
+    def _get_index(self) :
+        """Build the index on the first search after a change, and save it with the collection"""
+        if self._index_is_stale :
+            self.index.build(self.vectors)
+            self._index_is_stale = False
+            if self.path :
+                self._save_index()
+        return self.index
+
+    def index_stats(self) -> dict :
+        """Memory footprint of the collection : the index in memory, and the float32 vectors (in memory or memory-mapped)"""
+        return {
+            "index" : self.index_name,
+            "size" : self._size,
+            "index_bytes" : self._get_index().memory_usage() if self.index is not None and self._size else 0,
+            "vectors_bytes" : self.vectors.nbytes,
+            "vectors_memory_mapped" : isinstance(self._vectors, np.memmap),
+        }
+
+    @staticmethod
+    def _normalize(vectors : np.ndarray) -> np.ndarray :
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _prepare_payloads(self, documents : List[DocumentHandler]) -> List[dict] :
+        return prepare_payloads(documents)
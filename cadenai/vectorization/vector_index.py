@@ -0,0 +1,179 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+import numpy as np
+
+# Rows processed at once when scanning a compressed index, bounds the temporary float32 copies
+BLOCK_SIZE = 65536
+
+# Rows scanned at once at query time, small enough for the temporary copy to stay in the CPU cache
+SCAN_BLOCK_SIZE = 4096
+
+# Number of set bits of every byte value, used to compute Hamming distances on packed bits
+POPCOUNT_TABLE = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def top_k(scores : np.ndarray, k : int) -> np.ndarray :
+    """Indices of the k highest scores, unordered"""
+    if k >= len(scores) :
+        return np.arange(len(scores))
+    return np.argpartition(-scores, k - 1)[:k]
+
+
+class VectorIndex(ABC) :
+    """
+    Compressed or approximate index over normalized vectors.
+    It only shortlists candidate rows, NumpyVectorDB rescores them with the full precision vectors.
+    ARRAYS names the attributes holding the index, saved and memory-mapped by NumpyVectorDB.
+    """
+
+    ARRAYS = ()
+
+    @abstractmethod
+    def build(self, vectors : np.ndarray) -> None :
+        pass
+
+    @abstractmethod
+    def shortlist(self, query : np.ndarray, k : int) -> np.ndarray :
+        """Rows of the (about) k best candidates for a normalized query"""
+        pass
+
+    @abstractmethod
+    def memory_usage(self) -> int :
+        """Bytes held in memory by the index"""
+        pass
+
+    def state(self) -> Dict[str, np.ndarray] :
+        return {name : getattr(self, name) for name in self.ARRAYS}
+
+    def load_state(self, arrays : Dict[str, np.ndarray]) -> None :
+        for name in self.ARRAYS :
+            setattr(self, name, arrays[name])
+
+
+class Int8Index(VectorIndex) :
+    """Scalar quantization : each vector is scaled to [-127, 127] and stored as int8 (4x smaller than float32)"""
+
+    ARRAYS = ("codes", "scales")
+
+    def __init__(self) :
+        self.codes = np.empty((0, 0), dtype=np.int8)
+        self.scales = np.empty(0, dtype=np.float32)
+
+    def build(self, vectors : np.ndarray) -> None :
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        scales = np.empty(len(vectors), dtype=np.float32)
+        for start in range(0, len(vectors), BLOCK_SIZE) :
+            block = np.asarray(vectors[start:start+BLOCK_SIZE], dtype=np.float32)
+            block_scales = np.abs(block).max(axis=1) / 127
+            block_scales[block_scales == 0] = 1
+            codes[start:start+BLOCK_SIZE] = np.round(block / block_scales[:, None])
+            scales[start:start+BLOCK_SIZE] = block_scales
+        self.codes = codes
+        self.scales = scales
+
+    def shortlist(self, query : np.ndarray, k : int) -> np.ndarray :
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), SCAN_BLOCK_SIZE) :
+            scores[start:start+SCAN_BLOCK_SIZE] = self.codes[start:start+SCAN_BLOCK_SIZE].astype(np.float32) @ query
+        scores *= self.scales
+        return top_k(scores, k)
+
+    def memory_usage(self) -> int :
+        return self.codes.nbytes + self.scales.nbytes
+
+
+class BinaryIndex(VectorIndex) :
+    """Binary quantization : one sign bit per dimension (32x smaller than float32), candidates ranked by Hamming distance"""
+
+    ARRAYS = ("codes",)
+
+    def __init__(self) :
+        self.codes = np.empty((0, 0), dtype=np.uint8)
+
+    def build(self, vectors : np.ndarray) -> None :
+        self.codes = np.concatenate(
+            [np.packbits(np.asarray(vectors[start:start+BLOCK_SIZE]) > 0, axis=1) for start in range(0, len(vectors), BLOCK_SIZE)]
+        ) if len(vectors) else np.empty((0, 0), dtype=np.uint8)
+
+    def shortlist(self, query : np.ndarray, k : int) -> np.ndarray :
+        query_code = np.packbits(query > 0)
+        distances = np.empty(len(self.codes), dtype=np.int32)
+        for start in range(0, len(self.codes), SCAN_BLOCK_SIZE) :
+            block = np.bitwise_xor(self.codes[start:start+SCAN_BLOCK_SIZE], query_code)
+            distances[start:start+SCAN_BLOCK_SIZE] = POPCOUNT_TABLE[block].sum(axis=1, dtype=np.int32)
+        return top_k(-distances, k)
+
+    def memory_usage(self) -> int :
+        return self.codes.nbytes
+
+
+class IVFIndex(VectorIndex) :
+    """
+    Inverted file index : vectors are clustered with k-means (nlist clusters, sqrt(n) by default),
+    a query only scans the rows of its nprobe closest clusters.
+    """
+
+    ARRAYS = ("centroids", "sorted_rows", "offsets")
+
+    def __init__(self, nlist : Optional[int] = None, nprobe : int = 8, iterations : int = 10, seed : int = 0) :
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        self.sorted_rows = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+
+    def build(self, vectors : np.ndarray) -> None :
+        num_vectors = len(vectors)
+        nlist = min(self.nlist or max(1, int(np.sqrt(num_vectors))), max(1, num_vectors))
+        self.centroids = self._kmeans(vectors, nlist)
+
+        assignments = np.empty(num_vectors, dtype=np.int64)
+        for start in range(0, num_vectors, BLOCK_SIZE) :
+            assignments[start:start+BLOCK_SIZE] = np.argmax(np.asarray(vectors[start:start+BLOCK_SIZE]) @ self.centroids.T, axis=1)
+
+        # Rows grouped by cluster : the rows of cluster c are sorted_rows[offsets[c]:offsets[c+1]]
+        self.sorted_rows = np.argsort(assignments, kind="stable")
+        self.offsets = np.searchsorted(assignments[self.sorted_rows], np.arange(nlist + 1))
+
+    def _kmeans(self, vectors : np.ndarray, nlist : int) -> np.ndarray :
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(vectors), 256 * nlist)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.iterations) :
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            # Empty clusters keep their previous centroid
+            filled = counts > 0
+            norms = np.linalg.norm(sums[filled], axis=1, keepdims=True)
+            centroids[filled] = sums[filled] / np.where(norms == 0, 1, norms)
+
+        return centroids
+
+    def shortlist(self, query : np.ndarray, k : int) -> np.ndarray :
+        clusters = top_k(self.centroids @ query, self.nprobe)
+        return np.concatenate([self.sorted_rows[self.offsets[cluster]:self.offsets[cluster + 1]] for cluster in clusters])
+
+    def memory_usage(self) -> int :
+        return self.centroids.nbytes + self.sorted_rows.nbytes + self.offsets.nbytes
+
+
+INDEXES = {
+    "int8" : Int8Index,
+    "binary" : BinaryIndex,
+    "ivf" : IVFIndex,
+}
+
+def create_index(index : str, **kwargs) -> Optional[VectorIndex] :
+    """Return the index for this mode, None for the exact brute-force search"""
+    if index == "exact" :
+        return None
+    if index not in INDEXES :
+        raise ValueError(f"'{index}' is not a valid index, choose among: exact, {', '.join(INDEXES)}")
+    return INDEXES[index](**kwargs)
@@ -1,4 +1,7 @@
 import pytest
+import asyncio
+import threading
+import time
 from cadenai.chains import LLMChain
 from cadenai.prompt_manager.template import ChatPromptTemplate
 
@@ -108,3 +111,80 @@ def test_multiple_runs_stream(chain, mocker, mock_llm, mock_template, _prompt_sy
     
     # Vérifier que les réponses sont correctes
     assert responses == ["response_1", "response_2"]
+
+@pytest.mark.parametrize("max_workers",[1, 4])
+def test_multiple_runs_captures_failures(chain, mock_llm, mock_template, max_workers):
+    mock_llm._prompt_syntax = "openai"
+    error = RuntimeError("API down")
+
+    def fake_completion(prompt, max_tokens, stream):
+        if prompt == "fail":
+            raise error
+        return f"response to {prompt}"
+
+    mock_template.format.side_effect = lambda syntax, name : name
+    mock_llm.get_completion.side_effect = fake_completion
+
+    responses = chain.multiple_runs([{"name": "a"}, {"name": "fail"}, {"name": "c"}], max_workers=max_workers)
+
+    assert responses == ["response to a", error, "response to c"]
+    assert chain.last_runs_stats["runs"] == 3
+    assert chain.last_runs_stats["errors"] == 1
+
+def test_multiple_runs_raise_on_error(chain, mock_llm):
+    mock_llm._prompt_syntax = "openai"
+    mock_llm.get_completion.side_effect = RuntimeError("API down")
+
+    with pytest.raises(RuntimeError):
+        chain.multiple_runs([{"name": "a"}], raise_on_error=True)
+
+def test_multiple_runs_parallel_keeps_order(chain, mock_llm, mock_template):
+    mock_llm._prompt_syntax = "openai"
+    mock_template.format.side_effect = lambda syntax, index : index
+
+    def slow_completion(prompt, max_tokens, stream):
+        # Les premières entrées répondent le plus lentement
+        time.sleep(0.01 * (10 - prompt))
+        return prompt
+
+    mock_llm.get_completion.side_effect = slow_completion
+
+    responses = chain.multiple_runs([{"index": i} for i in range(10)], max_workers=5, loading_bar=True)
+
+    assert responses == list(range(10))
+
+def test_arun(chain, mock_llm, mock_template):
+    mock_llm._prompt_syntax = "openai"
+    mock_llm.get_completion.return_value = "Salut petit coquinou"
+
+    response = asyncio.run(chain.arun(name="Minou"))
+
+    assert response == "Salut petit coquinou"
+    mock_llm.get_completion.assert_called_once_with(prompt="Salut petit coquinou", max_tokens=256, stream=False)
+
+def test_amultiple_runs_bounds_concurrency_and_keeps_order(chain, mock_llm, mock_template):
+    mock_llm._prompt_syntax = "openai"
+    mock_template.format.side_effect = lambda syntax, index : index
+    lock = threading.Lock()
+    in_flight = {"current": 0, "max": 0}
+
+    def slow_completion(prompt, max_tokens, stream):
+        with lock:
+            in_flight["current"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["current"])
+        time.sleep(0.02)
+        with lock:
+            in_flight["current"] -= 1
+        if prompt == 3:
+            raise ValueError("bad input")
+        return prompt
+
+    mock_llm.get_completion.side_effect = slow_completion
+
+    responses = asyncio.run(chain.amultiple_runs([{"index": i} for i in range(8)], max_concurrency=2))
+
+    assert responses[:3] == [0, 1, 2]
+    assert isinstance(responses[3], ValueError)
+    assert responses[4:] == [4, 5, 6, 7]
+    assert in_flight["max"] == 2
+    assert chain.last_runs_stats["errors"] == 1
@@ -1,7 +1,7 @@
 import pytest
 import json
 
-from cadenai.chains import RetrievalChain
+from cadenai.chains import RetrievalChain, SemanticCache
 from cadenai.prompt_manager.prompt_list import RETRIEVAL_PROMPT, RETRIEVAL_PROMPT_WITH_METADATA
 from cadenai.llm.mistral import ChatMistral
 
@@ -224,4 +224,111 @@ def test_retrieval_chain_run_with_stream_and_metadata(mocker, mock_llm, mock_vec
         prompt=expected_prompt,
         max_tokens=retrieval_chain_with_metadata.max_tokens,
         stream=True
-    )
\ No newline at end of file
+    )
+
+def test_retrieval_chain_answer_cache(mocker, mock_llm, mock_vector_db):
+
+    mock_llm.get_completion.return_value = "C'est Paris"
+    mock_vector_db.similarity_search.return_value = ["fact1", "fact2"]
+    embedder = mocker.Mock()
+    embedder.embed_query.return_value = [1.0, 0.0]
+    answer_cache = SemanticCache(embedder=embedder)
+    mock_vector_db.embedder = embedder
+
+    retrieval_chain = RetrievalChain(llm=mock_llm, vector_db=mock_vector_db, answer_cache=answer_cache)
+
+    assert retrieval_chain.run(user_input="Quelle est la capitale de la France ?") == "C'est Paris"
+    # Le vecteur de la requête calculé par le cache est réutilisé par la recherche
+    mock_vector_db.similarity_search.assert_called_once_with(query="Quelle est la capitale de la France ?", limit=5, show_metadata=False, query_vector=[1.0, 0.0])
+
+    # Question reformulée : réponse servie par le cache, sans recherche ni appel au LLM
+    embedder.embed_query.return_value = [0.99, 0.01]
+    assert retrieval_chain.run(user_input="Quelle est la capitale de la France, déjà ?") == "C'est Paris"
+    assert list(retrieval_chain.run(user_input="quelle est la capitale de la france", stream=True)) == ["C'est Paris"]
+
+    mock_llm.get_completion.assert_called_once()
+    mock_vector_db.similarity_search.assert_called_once()
+    assert answer_cache.cache_info()["hit_rate"] == pytest.approx(2 / 3)
+
+def test_retrieval_chain_answer_cache_vector_not_reused_with_another_embedder(mocker, mock_llm, mock_vector_db):
+    mock_vector_db.similarity_search.return_value = ["fact1"]
+    embedder = mocker.Mock()
+    embedder.embed_query.return_value = [1.0, 0.0]
+    mock_vector_db.embedder = mocker.Mock() # Autre modèle, autre dimension
+
+    retrieval_chain = RetrievalChain(llm=mock_llm, vector_db=mock_vector_db, answer_cache=SemanticCache(embedder=embedder))
+    retrieval_chain.run(user_input="Question ?")
+
+    mock_vector_db.similarity_search.assert_called_once_with(query="Question ?", limit=5, show_metadata=False)
+
+def test_retrieval_chain_answer_cache_with_vector_db_without_query_vector(mocker, mock_llm):
+    embedder = mocker.Mock()
+    embedder.embed_query.return_value = [1.0, 0.0]
+
+    class SimpleVectorDB:
+        def __init__(self):
+            self.embedder = embedder
+            self.calls = []
+
+        def similarity_search(self, query, limit, show_metadata=False):
+            self.calls.append(query)
+            return ["fact1"]
+
+    vector_db = SimpleVectorDB()
+    retrieval_chain = RetrievalChain(llm=mock_llm, vector_db=vector_db, answer_cache=SemanticCache(embedder=embedder))
+    retrieval_chain.run(user_input="Question ?")
+
+    assert vector_db.calls == ["Question ?"]
+
+def test_retrieval_chain_answer_cache_with_stream(mock_llm, mock_vector_db):
+
+    mock_llm.get_completion.return_value = iter(["C'est ", "Paris", None])
+    mock_vector_db.similarity_search.return_value = ["fact1", "fact2"]
+    retrieval_chain = RetrievalChain(llm=mock_llm, vector_db=mock_vector_db, answer_cache=SemanticCache())
+
+    assert list(retrieval_chain.run(user_input="Quelle est la capitale de la France ?", stream=True)) == ["C'est ", "Paris", None]
+    assert retrieval_chain.run(user_input="Quelle est la capitale de la France ?") == "C'est Paris"
+    mock_llm.get_completion.assert_called_once()
+    mock_vector_db.similarity_search.assert_called_once_with(query="Quelle est la capitale de la France ?", limit=5, show_metadata=False)
+
+@pytest.fixture
+def word_encoder(mocker):
+    # Un token par mot
+    encoder = mocker.Mock()
+    encoder.count_tokens_batch.side_effect = lambda texts : [len(text.split()) for text in texts]
+    return encoder
+
+def test_retrieval_chain_packs_knowledge_in_token_budget(mock_llm, mock_vector_db, word_encoder):
+
+    mock_vector_db.similarity_search.return_value = [
+        "paris is the capital of france",
+        "paris is the capital of france and",      # chevauchement quasi total avec le premier
+        "a very long chunk that does not fit in the remaining budget at all",
+        "lyon is a city",
+    ]
+    retrieval_chain = RetrievalChain(llm=mock_llm, vector_db=mock_vector_db, context_token_budget=12, fetch_limit=10, encoder=word_encoder)
+
+    knowledge = retrieval_chain._retrieve_knowledge_from_vector_db("capitale ?")
+
+    mock_vector_db.similarity_search.assert_called_once_with(query="capitale ?", limit=10, show_metadata=False)
+    assert knowledge == "paris is the capital of france\nlyon is a city"
+    assert retrieval_chain.last_context_tokens == 6 + 1 + 4
+
+def test_retrieval_chain_packs_metadata_compactly(mock_llm, mock_vector_db, word_encoder):
+
+    mock_vector_db.similarity_search.return_value = [
+        {"text": "fact 1", "source": "été.pdf"},
+        {"text": "fact 2", "source": "b.pdf"},
+    ]
+    retrieval_chain = RetrievalChain(llm=mock_llm, vector_db=mock_vector_db, include_metadata=True, context_token_budget=100, encoder=word_encoder)
+
+    knowledge = retrieval_chain._retrieve_knowledge_from_vector_db("test query")
+
+    assert knowledge == '{"text":"fact 1","source":"été.pdf"}\n{"text":"fact 2","source":"b.pdf"}'
+    assert retrieval_chain.last_context_tokens == 2 + 1 + 2
+
+def test_retrieval_chain_without_budget_keeps_default_context(mock_retrieval_chain_without_metadata, mock_vector_db):
+    mock_vector_db.similarity_search.return_value = ["fact1", "fact1"]
+
+    assert mock_retrieval_chain_without_metadata._retrieve_knowledge_from_vector_db("test query") == "fact1\nfact1"
+    assert mock_retrieval_chain_without_metadata.last_context_tokens is None
@@ -0,0 +1,103 @@
+import pytest
+
+from cadenai.chains.semantic_cache import SemanticCache, normalize_question
+
+VECTORS = {
+    "What is the capital of France?": [1.0, 0.0, 0.0],
+    "Which city is the capital of France?": [0.99, 0.1, 0.0],
+    "How tall is the Eiffel tower?": [0.0, 1.0, 0.0],
+}
+
+@pytest.fixture
+def embedder(mocker):
+    embedder = mocker.Mock()
+    embedder.embed_query.side_effect = lambda text : VECTORS[text]
+    return embedder
+
+def test_normalize_question():
+    assert normalize_question("  What is   the capital of FRANCE ?? ") == "what is the capital of france"
+
+def test_normalize_question_keeps_meaningful_trailing_characters():
+    assert normalize_question("What is C++?") == "what is c++"
+    assert normalize_question("What is C#!") == "what is c#"
+    assert normalize_question("What is C...") == "what is c"
+
+    cache = SemanticCache()
+    cache.set("What is C++?", "Un langage orienté objet")
+    assert cache.lookup("What is C?") == (None, None)
+    assert cache.lookup("what is c++ ?")[0] == "Un langage orienté objet"
+
+def test_exact_hit_does_not_embed(embedder):
+    cache = SemanticCache(embedder=embedder)
+    cache.set("What is the capital of France?", "Paris")
+
+    answer, query_vector = cache.lookup("what is the capital of france")
+
+    assert answer == "Paris"
+    assert query_vector is None
+    embedder.embed_query.assert_not_called()
+    assert cache.exact_hits == 1
+
+def test_semantic_hit(embedder):
+    cache = SemanticCache(embedder=embedder, similarity_threshold=0.95)
+    cache.set("What is the capital of France?", "Paris", VECTORS["What is the capital of France?"])
+
+    answer, query_vector = cache.lookup("Which city is the capital of France?")
+
+    assert answer == "Paris"
+    assert query_vector == VECTORS["Which city is the capital of France?"]
+    assert cache.semantic_hits == 1
+
+def test_miss_below_threshold(embedder):
+    cache = SemanticCache(embedder=embedder, similarity_threshold=0.95)
+    cache.set("What is the capital of France?", "Paris", VECTORS["What is the capital of France?"])
+
+    answer, query_vector = cache.lookup("How tall is the Eiffel tower?")
+
+    # Le vecteur calculé est renvoyé pour être réutilisé par la recherche
+    assert answer is None
+    assert query_vector == VECTORS["How tall is the Eiffel tower?"]
+    assert cache.cache_info() == {"exact_hits" : 0, "semantic_hits" : 0, "misses" : 1, "hit_rate" : 0.0, "size" : 1}
+
+def test_without_embedder_only_exact_match():
+    cache = SemanticCache()
+    cache.set("What is the capital of France?", "Paris")
+
+    assert cache.lookup("Which city is the capital of France?") == (None, None)
+    assert cache.lookup("What is the capital of France") == ("Paris", None)
+    assert cache.hit_rate == 0.5
+
+def test_ttl(embedder, clock):
+    cache = SemanticCache(embedder=embedder, ttl=60, clock=clock)
+    cache.set("What is the capital of France?", "Paris", VECTORS["What is the capital of France?"])
+
+    clock.now = 30
+    assert cache.lookup("What is the capital of France?")[0] == "Paris"
+    clock.now = 61
+    assert cache.lookup("Which city is the capital of France?")[0] is None
+    assert cache.lookup("What is the capital of France?")[0] is None
+    assert len(cache) == 0
+
+def test_lru_eviction():
+    cache = SemanticCache(max_entries=2)
+    cache.set("question 1", "answer 1")
+    cache.set("question 2", "answer 2")
+    cache.lookup("question 1")
+    cache.set("question 3", "answer 3")
+
+    # question 2 est la moins récemment utilisée
+    assert len(cache) == 2
+    assert cache.lookup("question 2")[0] is None
+    assert cache.lookup("question 1")[0] == "answer 1"
+    assert cache.lookup("question 3")[0] == "answer 3"
+
+def test_record_stream_caches_once_complete():
+    cache = SemanticCache()
+
+    stream = cache.record_stream("question", iter(["Par", "is", None]))
+    assert next(stream) == "Par"
+    assert cache.lookup("question")[0] is None
+
+    assert list(stream) == ["is", None]
+    assert cache.lookup("question")[0] == "Paris"
+    assert list(cache.replay("Paris")) == ["Paris"]
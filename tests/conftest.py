@@ -0,0 +1,21 @@
+import pytest
+
+class FakeClock():
+    # Horloge simulée : sleep fait avancer le temps au lieu d'attendre, l'instance s'appelle comme time.time
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -1,5 +1,7 @@
 import pytest
-from cadenai.document.file_handler import DocumentHandler, Loader, PDFHandler
+from concurrent.futures import ThreadPoolExecutor
+from cadenai.document import file_handler
+from cadenai.document.file_handler import DocumentHandler, Loader, PDFHandler, extract_pages_text
 
 def test_document_handler_initialization():
     page_content = "Test content"
@@ -64,20 +66,20 @@ def mock_pdf_reader(mocker,  mock_pdf_pages) :
     return mock_reader
 
 def test_pdf_handler_initialization(mock_pdf_reader,mocker): 
-    mocker.patch('cadenai.document.file_handler.PdfReader', return_value=mock_pdf_reader)
+    mocker.patch('cadenai.document.file_handler.open_pdf', return_value=mock_pdf_reader)
 
     pdf = PDFHandler('dummy_path.pdf')
     assert pdf.file_path == 'dummy_path.pdf'
 
 def test_pdf_handler_load_a_page(mocker, mock_pdf_reader):
-    mocker.patch('cadenai.document.file_handler.PdfReader', return_value=mock_pdf_reader)
+    mocker.patch('cadenai.document.file_handler.open_pdf', return_value=mock_pdf_reader)
     handler = PDFHandler("fake_path.pdf")
     doc = handler.load_a_page(1)
     assert isinstance(doc, DocumentHandler)
     assert doc.page_content == "Page 2 content"
 
 def test_pdf_handler_lazy_load(mocker, mock_pdf_reader):
-    mocker.patch('cadenai.document.file_handler.PdfReader', return_value=mock_pdf_reader)
+    mocker.patch('cadenai.document.file_handler.open_pdf', return_value=mock_pdf_reader)
     handler = PDFHandler("fake_path.pdf")
     pages_gen = handler.lazy_load()
         
@@ -97,8 +99,61 @@ def test_pdf_handler_lazy_load(mocker, mock_pdf_reader):
 
 def test_pdf_handler_len(mocker, mock_pdf_reader) : 
 
-    mocker.patch('cadenai.document.file_handler.PdfReader', return_value=mock_pdf_reader)
+    mocker.patch('cadenai.document.file_handler.open_pdf', return_value=mock_pdf_reader)
 
     pdf_handler = PDFHandler('kamasutra.pdf')
 
     assert len(pdf_handler) == 3
+
+@pytest.fixture
+def mock_many_pages_reader(mocker):
+    pages = []
+    for i in range(10):
+        page = mocker.MagicMock()
+        page.extract_text.return_value = f"Page {i + 1} content"
+        pages.append(page)
+    mock_reader = mocker.MagicMock()
+    mock_reader.pages = pages
+    return mock_reader
+
+def test_pdf_handler_parallel_lazy_load_keeps_page_order(mocker, mock_many_pages_reader):
+    mocker.patch('cadenai.document.file_handler.open_pdf', return_value=mock_many_pages_reader)
+    # Des threads à la place des processus, pour que les workers voient le mock
+    mocker.patch('cadenai.document.file_handler.ProcessPoolExecutor', ThreadPoolExecutor)
+    mocked_extract = mocker.spy(file_handler, "extract_pages_text")
+
+    handler = PDFHandler("fake_path.pdf", num_workers=2, pages_per_task=3)
+    documents = list(handler.lazy_load())
+
+    assert [doc.page_content for doc in documents] == [f"Page {i + 1} content" for i in range(10)]
+    assert sorted(call.args for call in mocked_extract.call_args_list) == [(0, 3), (3, 6), (6, 9), (9, 10)]
+
+def test_pdf_handler_parallel_lazy_load_bounds_prefetch(mocker, mock_many_pages_reader):
+    mocker.patch('cadenai.document.file_handler.open_pdf', return_value=mock_many_pages_reader)
+    mocker.patch('cadenai.document.file_handler.ProcessPoolExecutor', ThreadPoolExecutor)
+    mocked_extract = mocker.spy(file_handler, "extract_pages_text")
+
+    handler = PDFHandler("fake_path.pdf", num_workers=2, pages_per_task=1, prefetch=2)
+    pages_gen = handler.lazy_load()
+
+    assert next(pages_gen).page_content == "Page 1 content"
+    # Une tâche consommée, une en attente et la suivante soumise : jamais plus de prefetch en avance
+    assert mocked_extract.call_count <= 3
+
+    pages_gen.close()
+
+def test_extract_pages_text(mocker, mock_many_pages_reader):
+    mocker.patch('cadenai.document.file_handler.open_pdf', return_value=mock_many_pages_reader)
+
+    file_handler.open_worker_reader("fake_path.pdf")
+    assert extract_pages_text(2, 4) == ["Page 3 content", "Page 4 content"]
+
+def test_pdf_handler_parallel_lazy_load_opens_the_pdf_once_per_worker(mocker, mock_many_pages_reader):
+    mocked_open = mocker.patch('cadenai.document.file_handler.open_pdf', return_value=mock_many_pages_reader)
+    mocker.patch('cadenai.document.file_handler.ProcessPoolExecutor', ThreadPoolExecutor)
+
+    handler = PDFHandler("fake_path.pdf", num_workers=2, pages_per_task=1)
+    assert len(list(handler.lazy_load())) == 10
+
+    # Une ouverture pour le handler, puis au plus une par worker, et non une par tâche (10 tâches)
+    assert mocked_open.call_count <= 3
@@ -1,5 +1,8 @@
 import pytest 
-from cadenai.document.text_splitter import SizeSplitter, SeparatorSplitter, ChunkType, LLMSplitter 
+import json
+import threading
+import time
+from cadenai.document.text_splitter import SizeSplitter, SeparatorSplitter, ChunkType, LLMSplitter, JSONStreamParser
 from cadenai.schema import DocumentHandler, Loader
 
 @pytest.fixture
@@ -24,6 +27,17 @@ def test_separatorsplitter_default_attributes():
     assert splitter.separator == "\n"
     assert splitter.is_separator_regex == False
 
+def test_splitter_fingerprint_depends_on_class_and_settings():
+    assert SizeSplitter(chunk_size=10).fingerprint() == SizeSplitter(chunk_size=10, num_threads=1).fingerprint()
+    assert SizeSplitter(chunk_size=10).fingerprint() != SizeSplitter(chunk_size=20).fingerprint()
+    assert SizeSplitter(chunk_type="words").fingerprint() != SizeSplitter(chunk_type="tokens").fingerprint()
+    assert SeparatorSplitter(separator="\n").fingerprint() != SeparatorSplitter(separator="\n\n").fingerprint()
+
+def test_llmsplitter_fingerprint_depends_on_model(mocker):
+    # Le client LLM lui-même n'entre pas dans l'empreinte, seulement son modèle
+    assert LLMSplitter(llm=mocker.Mock(model="gpt-4")).fingerprint() == LLMSplitter(llm=mocker.Mock(model="gpt-4"), max_workers=4).fingerprint()
+    assert LLMSplitter(llm=mocker.Mock(model="gpt-4")).fingerprint() != LLMSplitter(llm=mocker.Mock(model="gpt-3.5-turbo")).fingerprint()
+
 def test_sizesplitter_split_text_by_characters():
     splitter = SizeSplitter(chunk_size=5, chunk_overlap=2,chunk_type="characters")
     input_text = "1234567890"
@@ -71,7 +85,7 @@ def test_sizesplitter_split_text_by_tokens(mocker):
     mocked_encoding = mocker.Mock()
     mocked_encoding.decode.return_value = "mocked_decoded_text"
     mocked_encoding.encode.return_value = "mocked_encoded_text"
-    mocker.patch('cadenai.document.text_splitter.tiktoken.get_encoding', return_value=mocked_encoding)
+    mocker.patch('cadenai.document.text_splitter.get_encoding', return_value=mocked_encoding)
 
     splitter = SizeSplitter(chunk_size=5, chunk_overlap=2, chunk_type="tokens")
 
@@ -87,7 +101,7 @@ def test_sizesplitter_split_text_by_tokens_with_document_handler(mocker):
     mocked_encoding = mocker.Mock()
     mocked_encoding.decode.return_value = "mocked_decoded_text"
     mocked_encoding.encode.return_value = "mocked_encoded_text"
-    mocker.patch('cadenai.document.text_splitter.tiktoken.get_encoding', return_value=mocked_encoding)
+    mocker.patch('cadenai.document.text_splitter.get_encoding', return_value=mocked_encoding)
 
     splitter = SizeSplitter(chunk_size=5, chunk_overlap=2, chunk_type="tokens")
 
@@ -178,4 +192,271 @@ def test_split_text_str(mocker, splitter):
     mocker.patch.object(splitter, 'run', return_value=mock_response)
 
     result = splitter._split_text_str(input_data)
-    assert result == expected_output
\ No newline at end of file
+    assert result == expected_output
+
+def test_sizesplitter_split_text_list_by_tokens_uses_batch_encoding(mocker):
+
+    mocked_encoding = mocker.Mock()
+    mocked_encoding.encode_batch.side_effect = lambda texts, num_threads : [list(range(len(text))) for text in texts]
+    mocked_encoding.decode_batch.side_effect = lambda chunks, num_threads : ["-".join(str(token) for token in chunk) for chunk in chunks]
+    mocker.patch('cadenai.document.text_splitter.get_encoding', return_value=mocked_encoding)
+
+    splitter = SizeSplitter(chunk_size=3, chunk_overlap=1, chunk_type="tokens", encode_batch_size=2)
+
+    input_docs = [
+        DocumentHandler(page_content="abcde", metadata={"doc": 1}),
+        DocumentHandler(page_content="ab", metadata={"doc": 2}),
+        DocumentHandler(page_content="abc", metadata={"doc": 3}),
+    ]
+    result = splitter.split_text(input_docs, loading_bar=False)
+
+    assert [doc.page_content for doc in result] == ["0-1-2", "2-3-4", "0-1", "0-1-2"]
+    assert [doc.metadata for doc in result] == [{"doc": 1}, {"doc": 1}, {"doc": 2}, {"doc": 3}]
+    # Deux lots pour trois documents avec encode_batch_size=2
+    assert mocked_encoding.encode_batch.call_count == 2
+    mocked_encoding.encode.assert_not_called()
+
+    result = splitter.split_text(["abcde", "ab"], loading_bar=False)
+    assert [doc.page_content for doc in result] == ["0-1-2", "2-3-4", "0-1"]
+
+def test_lazy_split_with_loader_is_lazy():
+
+    pulled = []
+
+    class RecordingLoader(Loader):
+        def lazy_load(self):
+            for i in range(3):
+                pulled.append(i)
+                yield DocumentHandler(page_content=f"page{i} word", metadata={"page": i})
+
+        def __len__(self):
+            return 3
+
+    splitter = SizeSplitter(chunk_size=1, chunk_overlap=0, chunk_type="words")
+    chunks = splitter.lazy_split(RecordingLoader())
+
+    first = next(chunks)
+    assert first.page_content == "page0"
+    assert first.metadata == {"page": 0}
+    # Seule la première page a été chargée
+    assert pulled == [0]
+
+    rest = list(chunks)
+    assert [doc.page_content for doc in rest] == ["word", "page1", "word", "page2", "word"]
+    assert pulled == [0, 1, 2]
+
+@pytest.mark.parametrize("input_data", [
+    "one two three",
+    ["one two three"],
+    DocumentHandler(page_content="one two three"),
+    (doc for doc in [DocumentHandler(page_content="one two three")]),
+])
+def test_lazy_split_matches_split_text(input_data):
+    splitter = SizeSplitter(chunk_size=2, chunk_overlap=1, chunk_type="words")
+
+    result = list(splitter.lazy_split(input_data))
+
+    assert [doc.page_content for doc in result] == ["one two", "two three"]
+
+def test_lazy_split_invalid_type():
+    splitter = SizeSplitter()
+    with pytest.raises(TypeError):
+        list(splitter.lazy_split(12345))
+    with pytest.raises(TypeError):
+        list(splitter.lazy_split([12345]))
+
+def fake_llm_response(document_text, **kwargs):
+    # Un chunk par ligne du texte envoyé
+    return json.dumps([{"page_content": line, "metadata": {}} for line in document_text.split("\n\n")])
+
+def test_llmsplitter_concurrent_requests_keep_page_order(mocker, mock_llm):
+    splitter = LLMSplitter(llm=mock_llm, max_workers=4)
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def slow_run(document_text, **kwargs):
+        with lock:
+            in_flight.append(document_text)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.remove(document_text)
+        return fake_llm_response(document_text)
+
+    mocker.patch.object(splitter, "run", side_effect=slow_run)
+    pages = [DocumentHandler(page_content=f"page {i}", metadata={"page": i}) for i in range(10)]
+
+    result = splitter.split_text(pages, loading_bar=False)
+
+    assert [doc.page_content for doc in result] == [f"page {i}" for i in range(10)]
+    assert [doc.metadata for doc in result] == [{"page": i} for i in range(10)]
+    assert 1 < max(max_in_flight) <= 4
+    assert splitter.last_split_stats == {"pages": 10, "requests": 10, "cached_requests": 0}
+
+def test_llmsplitter_cache_resumes_after_failure(mocker, mock_llm, tmp_path):
+    cache_path = str(tmp_path / "splits.sqlite")
+    pages = [f"page {i}" for i in range(4)]
+
+    def failing_run(document_text, **kwargs):
+        if document_text == "page 2":
+            raise RuntimeError("API down")
+        return fake_llm_response(document_text)
+
+    splitter = LLMSplitter(llm=mock_llm, cache_path=cache_path)
+    mocker.patch.object(splitter, "run", side_effect=failing_run)
+    with pytest.raises(RuntimeError):
+        splitter.split_text(pages, loading_bar=False)
+
+    # Nouvelle instance : seules les pages non découpées sont renvoyées au LLM
+    splitter = LLMSplitter(llm=mock_llm, cache_path=cache_path)
+    run = mocker.patch.object(splitter, "run", side_effect=fake_llm_response)
+    result = splitter.split_text(pages, loading_bar=False)
+
+    assert [doc.page_content for doc in result] == pages
+    # La page 3, préchargée, a pu être découpée avant l'échec
+    sent = [call.kwargs["document_text"] for call in run.call_args_list]
+    assert sent[0] == "page 2" and set(sent) <= {"page 2", "page 3"}
+    assert splitter.last_split_stats["cached_requests"] == 4 - len(sent)
+
+def test_llmsplitter_cache_key_depends_on_prompt_and_model(mocker, tmp_path):
+    cache_path = str(tmp_path / "splits.sqlite")
+    first = LLMSplitter(llm=mocker.Mock(model="gpt-4"), cache_path=cache_path)
+    mocker.patch.object(first, "run", side_effect=fake_llm_response)
+    first.split_text(["page"], loading_bar=False)
+
+    other_model = LLMSplitter(llm=mocker.Mock(model="gpt-3.5-turbo"), cache_path=cache_path)
+    other_context = LLMSplitter(llm=mocker.Mock(model="gpt-4"), cache_path=cache_path, document_context="another file")
+    same = LLMSplitter(llm=mocker.Mock(model="gpt-4"), cache_path=cache_path)
+
+    assert first._cache_key("page") == same._cache_key("page")
+    assert first._cache_key("page") != other_model._cache_key("page")
+    assert first._cache_key("page") != other_context._cache_key("page")
+
+def test_llmsplitter_invalid_response_is_not_cached(mocker, mock_llm, tmp_path):
+    splitter = LLMSplitter(llm=mock_llm, cache_path=str(tmp_path / "splits.sqlite"))
+    mocker.patch.object(splitter, "run", return_value="not json")
+
+    with pytest.raises(json.JSONDecodeError):
+        splitter.split_text(["page"], loading_bar=False)
+    assert len(splitter.cache) == 0
+
+def test_llmsplitter_packs_short_pages(mocker, mock_llm):
+    encoder = mocker.Mock()
+    encoder.count_tokens.side_effect = lambda text : len(text.split())
+    splitter = LLMSplitter(llm=mock_llm, pack_token_budget=6, encoder=encoder)
+    run = mocker.patch.object(splitter, "run", side_effect=fake_llm_response)
+    pages = [
+        DocumentHandler(page_content="one two", metadata={"source": "a"}),
+        DocumentHandler(page_content="three four", metadata={"source": "a"}),
+        DocumentHandler(page_content="five six seven", metadata={"source": "a"}),   # dépasse le budget
+        DocumentHandler(page_content="eight", metadata={"source": "b"}),            # autres métadonnées
+    ]
+
+    result = list(splitter.lazy_split(pages))
+
+    assert [call.kwargs["document_text"] for call in run.call_args_list] == ["one two\n\nthree four", "five six seven", "eight"]
+    assert [(doc.page_content, doc.metadata) for doc in result] == [
+        ("one two", {"source": "a"}), ("three four", {"source": "a"}), ("five six seven", {"source": "a"}), ("eight", {"source": "b"})
+    ]
+    assert splitter.last_split_stats == {"pages": 4, "requests": 3, "cached_requests": 0}
+
+STREAMED_RESPONSE = '''```json
+[
+    {"page_content": "Le chat {noir} dit \\"miaou\\" ]", "metadata": {"page_number": 1, "chunk_id": 1}},
+    {"page_content": "Deuxième section", "metadata": {"page_number": 1, "chunk_id": 2}}
+]
+```'''
+
+def parse_by_chunks(response, chunk_size):
+    parser = JSONStreamParser()
+    objects = []
+    for start in range(0, len(response), chunk_size):
+        objects.extend(parser.feed(response[start:start + chunk_size]))
+    return parser, objects
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_json_stream_parser(chunk_size):
+    parser, objects = parse_by_chunks(STREAMED_RESPONSE, chunk_size)
+
+    # Bloc de code ignoré, accolades et guillemets échappés dans les chaînes gérés
+    assert objects == json.loads(STREAMED_RESPONSE.strip("`").removeprefix("json"))
+    assert parser.complete
+
+def test_json_stream_parser_yields_objects_as_soon_as_closed():
+    parser = JSONStreamParser()
+
+    assert parser.feed('[{"page_content": "a", "metadata": {}}, {"page_con') == [{"page_content": "a", "metadata": {}}]
+    assert parser.feed('tent": "b"}]') == [{"page_content": "b"}]
+    assert parser.complete
+
+def test_json_stream_parser_truncated_response():
+    truncated = STREAMED_RESPONSE[:STREAMED_RESPONSE.index("Deuxième") + 5]
+
+    parser, objects = parse_by_chunks(truncated, 3)
+
+    assert [item["metadata"]["chunk_id"] for item in objects] == [1]
+    assert not parser.complete
+
+def test_json_stream_parser_single_object():
+    parser, objects = parse_by_chunks('{"page_content": "seul", "metadata": {"tags": [1, 2]}}', 4)
+
+    assert objects == [{"page_content": "seul", "metadata": {"tags": [1, 2]}}]
+    assert parser.complete
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1000])
+def test_json_stream_parser_ignores_brackets_in_preamble(chunk_size):
+    response = 'Here are the chunks [JSON] {as asked}:\n' + STREAMED_RESPONSE
+
+    parser, objects = parse_by_chunks(response, chunk_size)
+
+    assert [item["metadata"]["chunk_id"] for item in objects] == [1, 2]
+    assert parser.complete
+
+def test_llmsplitter_never_caches_a_response_without_chunks(mocker, mock_llm, tmp_path):
+    splitter = LLMSplitter(llm=mock_llm, stream=True, cache_path=str(tmp_path / "splits.sqlite"))
+    mocker.patch.object(splitter, "run", side_effect=lambda **kwargs : iter(["[]"]))
+
+    assert list(splitter.lazy_split("page")) == []
+    assert len(splitter.cache) == 0
+
+    # Une réponse vide déjà en cache est redemandée
+    splitter.cache.set(splitter._cache_key("page"), "[]")
+    splitter.run.side_effect = lambda **kwargs : iter([STREAMED_RESPONSE])
+    assert len(list(splitter.lazy_split("page"))) == 2
+
+def test_llmsplitter_stream_yields_chunks_before_the_end_of_the_completion(mocker, mock_llm):
+    splitter = LLMSplitter(llm=mock_llm, stream=True)
+    streamed = []
+
+    def stream_run(document_text, stream, **kwargs):
+        assert stream
+        for chunk in ['[{"page_content": "un", "metadata": {}},', ' {"page_content": "deux", "metadata": {}}]', None]:
+            streamed.append(chunk)
+            yield chunk
+
+    mocker.patch.object(splitter, "run", side_effect=stream_run)
+    chunks = splitter.lazy_split(DocumentHandler(page_content="page", metadata={"page": 1}))
+
+    first = next(chunks)
+    assert (first.page_content, first.metadata) == ("un", {"page": 1})
+    # Le premier chunk est disponible alors que la réponse est encore en cours
+    assert len(streamed) == 1
+    assert [doc.page_content for doc in chunks] == ["deux"]
+
+def test_llmsplitter_stream_recovers_truncated_response(mocker, mock_llm, tmp_path):
+    splitter = LLMSplitter(llm=mock_llm, stream=True, cache_path=str(tmp_path / "splits.sqlite"))
+    truncated = STREAMED_RESPONSE[:STREAMED_RESPONSE.index("Deuxième")]
+    mocker.patch.object(splitter, "run", side_effect=lambda **kwargs : iter([truncated]))
+
+    result = splitter.split_text(["page"], loading_bar=False)
+
+    assert [doc.metadata for doc in result] == [{"page_number": 1, "chunk_id": 1}]
+    # Réponse incomplète : pas mise en cache, la page sera redemandée
+    assert len(splitter.cache) == 0
+
+    splitter.run.side_effect = lambda **kwargs : iter([STREAMED_RESPONSE])
+    assert len(list(splitter.lazy_split("page"))) == 2
+    assert len(splitter.cache) == 1
+    assert len(splitter.split_text(["page"], loading_bar=False)) == 2
+    assert splitter.last_split_stats["cached_requests"] == 1
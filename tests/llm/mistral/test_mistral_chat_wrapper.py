@@ -62,3 +62,14 @@ def test_get_completion(mock_mistral):
         max_tokens=50,
     )
 
+
+def test_get_completion_waits_for_rate_limiter(mocker, mock_mistral):
+
+    rate_limiter = mocker.Mock()
+    chat_ai = ChatMistral(model="mistral-tiny", rate_limiter=rate_limiter)
+    chat_ai.client = mock_mistral
+
+    prompt = [ChatMessage(role="user", content="Test")]
+    chat_ai.get_completion(prompt, max_tokens=50)
+
+    rate_limiter.acquire_for_prompt.assert_called_once_with(prompt=prompt, max_tokens=50)
@@ -60,3 +60,14 @@ def test_get_completion(mock_openai):
         max_tokens=50,
     )
 
+
+def test_get_completion_waits_for_rate_limiter(mocker, mock_openai):
+
+    rate_limiter = mocker.Mock()
+    chat_ai = ChatOpenAI(model="gpt-4", rate_limiter=rate_limiter)
+    chat_ai.client = mock_openai
+
+    prompt = [{"role": "user", "content": "Test"}]
+    chat_ai.get_completion(prompt, max_tokens=50)
+
+    rate_limiter.acquire_for_prompt.assert_called_once_with(prompt=prompt, max_tokens=50)
@@ -0,0 +1,109 @@
+import pytest
+from mistralai.models.chat_completion import ChatMessage
+
+from cadenai.llm.cache import CachedLLM, InMemoryCompletionCache, SQLiteCompletionCache, canonical_prompt
+from cadenai.llm.openai import ChatOpenAI
+
+PROMPT = [{"role": "system", "content": "Tu es un assistant"}, {"role": "user", "content": "Bonjour"}]
+
+@pytest.fixture
+def mock_llm(mocker):
+    llm = mocker.Mock()
+    llm.model = "gpt-4"
+    llm.temperature = 0
+    llm._prompt_syntax = "openai"
+    llm.get_completion.return_value = "Salut !"
+    return llm
+
+def test_cached_llm_serves_repeated_prompts(mock_llm):
+    cached_llm = CachedLLM(mock_llm)
+
+    assert cached_llm.get_completion(PROMPT, max_tokens=100) == "Salut !"
+    assert cached_llm.get_completion([dict(message) for message in PROMPT], max_tokens=100) == "Salut !"
+
+    mock_llm.get_completion.assert_called_once_with(prompt=PROMPT, stream=False, max_tokens=100)
+    assert cached_llm.cache_info() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "size": 1}
+
+def test_cached_llm_key_depends_on_max_tokens_and_model(mock_llm):
+    cached_llm = CachedLLM(mock_llm)
+
+    cached_llm.get_completion(PROMPT, max_tokens=100)
+    cached_llm.get_completion(PROMPT, max_tokens=200)
+    mock_llm.model = "gpt-3.5-turbo"
+    cached_llm.get_completion(PROMPT, max_tokens=100)
+
+    assert mock_llm.get_completion.call_count == 3
+
+def test_cached_llm_bypasses_cache_when_not_deterministic(mock_llm):
+    mock_llm.temperature = 0.7
+    cached_llm = CachedLLM(mock_llm)
+
+    cached_llm.get_completion(PROMPT)
+    cached_llm.get_completion(PROMPT)
+
+    assert mock_llm.get_completion.call_count == 2
+    assert cached_llm.hits == cached_llm.misses == 0
+
+    # La température est celle du LLM enveloppé, comme le fait RetrievalChain
+    cached_llm.temperature = 0
+    assert mock_llm.temperature == 0
+    assert cached_llm._prompt_syntax == "openai"
+
+def test_cached_llm_stream(mock_llm):
+    mock_llm.get_completion.return_value = iter(["Sa", "lut", None])
+    cached_llm = CachedLLM(mock_llm)
+
+    stream = cached_llm.get_completion(PROMPT, stream=True)
+    assert next(stream) == "Sa"
+    # Réponse incomplète : pas encore en cache
+    assert len(cached_llm.cache) == 0
+    assert list(stream) == ["lut", None]
+
+    assert list(cached_llm.get_completion(PROMPT, stream=True)) == ["Salut"]
+    assert cached_llm.get_completion(PROMPT) == "Salut"
+    mock_llm.get_completion.assert_called_once()
+
+def test_canonical_prompt_with_mistral_messages():
+    mistral_prompt = [ChatMessage(role="system", content="Tu es un assistant"), ChatMessage.model_construct(role="user", content="Bonjour")]
+
+    assert canonical_prompt(mistral_prompt) == PROMPT
+    assert canonical_prompt([("system", "Tu es un assistant")]) == PROMPT[:1]
+
+def test_in_memory_cache_ttl_and_lru(clock):
+    cache = InMemoryCompletionCache(max_entries=2, ttl=60, clock=clock)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    clock.now = 61
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+def test_sqlite_cache_persists_between_instances(tmp_path, mock_llm):
+    path = str(tmp_path / "completions.sqlite")
+    CachedLLM(mock_llm, cache=SQLiteCompletionCache(path)).get_completion(PROMPT)
+
+    cached_llm = CachedLLM(mock_llm, cache=SQLiteCompletionCache(path))
+    assert cached_llm.get_completion(PROMPT) == "Salut !"
+    mock_llm.get_completion.assert_called_once()
+
+def test_sqlite_cache_ttl(tmp_path, clock):
+    cache = SQLiteCompletionCache(str(tmp_path / "completions.sqlite"), ttl=10, clock=clock)
+    cache.set("key", "réponse")
+
+    assert cache.get("key") == "réponse"
+    clock.now = 11
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+def test_cached_llm_with_chat_openai(mocker):
+    chat_ai = ChatOpenAI(model="gpt-4", temperature=0)
+    chat_ai.client = mocker.MagicMock()
+    chat_ai.client.chat.completions.create.return_value.choices = [mocker.MagicMock(message=mocker.MagicMock(content="Salut !"))]
+    cached_llm = CachedLLM(chat_ai)
+
+    assert cached_llm.get_completion(PROMPT) == cached_llm.get_completion(PROMPT) == "Salut !"
+    chat_ai.client.chat.completions.create.assert_called_once_with(model="gpt-4", temperature=0, messages=PROMPT, max_tokens=2500)
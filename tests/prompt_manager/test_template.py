@@ -174,4 +174,98 @@ def test_chatprompt_template_add_human_message_with_input_variables():
     assert len(cpt.messages_template) == 1
     assert cpt.messages_template[0].role == Role.HUMAN
     assert cpt.messages_template[0].content == "Hello, {name}."
-    assert "name" in cpt.input_variables
\ No newline at end of file
+    assert "name" in cpt.input_variables
+
+@pytest.fixture
+def mock_token_counter(mocker):
+    # Un token par mot, pour ne pas dépendre des fichiers de tiktoken
+    return mocker.patch("cadenai.prompt_manager.template.token_counter", side_effect=lambda text : len(text.split()))
+
+def test_message_template_len_is_memoized(mock_token_counter):
+    mt = MessageTemplate(role=Role.SYSTEM, content="You are a helpful bot")
+
+    assert len(mt) == 5
+    assert len(mt) == 5
+    assert mock_token_counter.call_count == 1
+
+    # Changer le contenu invalide le cache
+    mt.content = "You are a bot"
+    assert len(mt) == 4
+    assert mock_token_counter.call_count == 2
+
+def test_chatprompt_template_len_after_adding_messages(mock_token_counter):
+    cpt = ChatPromptTemplate.from_messages(input_variables=[], messages=[("system", "You are a helpful bot")])
+    assert len(cpt) == 5
+
+    cpt.add_human_message("Hello there")
+    cpt.add_ai_message("Hi")
+    assert len(cpt) == 8
+    assert len(cpt) == 8
+    assert mock_token_counter.call_count == 3
+
+def test_prompt_template_len_is_memoized(mock_token_counter):
+    pt = PromptTemplate(input_variables=["name"], template="Hello, {name} !")
+
+    assert len(pt) == 3
+    assert len(pt) == 3
+    assert mock_token_counter.call_count == 1
+
+def test_count_formatted_tokens_only_tokenizes_variables(mock_token_counter):
+    cpt = ChatPromptTemplate.from_messages(input_variables=["name", "user_input"], messages=[
+        ("system", "You are a helpful AI bot. Your name is {name}."),
+        ("human", "{user_input}"),
+    ])
+
+    assert cpt.count_formatted_tokens(name="Bot", user_input="Tell me more about AI") == 10 + 1 + 5
+    calls_after_first_count = mock_token_counter.call_count
+
+    assert cpt.count_formatted_tokens(name="Bot", user_input="Hi") == 10 + 1 + 1
+    # Seules les deux variables sont re-tokenisées
+    assert mock_token_counter.call_count == calls_after_first_count + 2
+
+def test_templates_with_cached_length_are_still_equal(mock_token_counter):
+    mt = MessageTemplate(role=Role.AI, content="Hello, {name}!")
+    len(mt)
+
+    assert mt == MessageTemplate(role=Role.AI, content="Hello, {name}!")
+
+@pytest.mark.parametrize("syntax",["cadenai", "openai", "mistral"])
+def test_compiled_prompt_matches_message_template_format(syntax):
+    messages = [
+        ("system", "You are {name}, {{literal braces}} and {score:.2f} points."),
+        ("human", "{user!r} asks about {topic.upper}"),
+        ("ai", "No variable here."),
+    ]
+    kwargs = {"name": "Bot", "score": 3.14159, "user": "Max", "topic": "ai"}
+    cpt = ChatPromptTemplate.from_messages(input_variables=list(kwargs), messages=messages)
+
+    expected = [message_template.format(syntax=syntax, **kwargs) for message_template in cpt.messages_template]
+
+    assert cpt.compile(syntax).format(**kwargs) == expected
+    assert cpt.format(syntax=syntax, **kwargs) == expected
+
+def test_compiled_prompt_is_cached_per_syntax():
+    cpt = ChatPromptTemplate.from_messages(input_variables=["name"], messages=[("system", "Hello {name}")])
+
+    assert cpt.compile("openai") is cpt.compile("openai")
+    assert cpt.compile("openai") is not cpt.compile("mistral")
+
+def test_compiled_prompt_is_rebuilt_when_messages_change():
+    cpt = ChatPromptTemplate.from_messages(input_variables=["name"], messages=[("system", "Hello {name}")])
+    compiled = cpt.compile("openai")
+
+    cpt.messages_template[0].content = "Goodbye {name}"
+    assert cpt.format(syntax="openai", name="Bot") == [{"role": "system", "content": "Goodbye Bot"}]
+    assert cpt.compile("openai") is not compiled
+
+    cpt.add_human_message("{question}", input_variables=["question"])
+    assert cpt.format(syntax="openai", name="Bot", question="Why ?") == [
+        {"role": "system", "content": "Goodbye Bot"},
+        {"role": "user", "content": "Why ?"},
+    ]
+
+def test_compiled_prompt_missing_variable_raises_key_error():
+    cpt = ChatPromptTemplate.from_messages(input_variables=["name"], messages=[("system", "Hello {name}")])
+
+    with pytest.raises(KeyError):
+        cpt.format(syntax="openai")
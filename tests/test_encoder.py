@@ -1,5 +1,11 @@
 import pytest
-from cadenai.encoder import OpenAIEncoder
+from cadenai.encoder import OpenAIEncoder, get_encoding
+
+@pytest.fixture(autouse=True)
+def clear_encoding_registry():
+    get_encoding.cache_clear()
+    yield
+    get_encoding.cache_clear()
 
 # Création d'une fixture pour simuler l'encoder
 @pytest.fixture
@@ -11,7 +17,7 @@ def mock_encoder(mocker):
 
 def test_openai_encoder_initialization(mocker, mock_encoder):
     # Mock tiktoken.get_encoding pour retourner notre simulateur d'encoder
-    mocker.patch("cadenai.encoder.tiktoken.get_encoding", return_value=mock_encoder)
+    mocker.patch("tiktoken.get_encoding", return_value=mock_encoder)
 
     encoder = OpenAIEncoder()
     
@@ -20,7 +26,7 @@ def test_openai_encoder_initialization(mocker, mock_encoder):
 
 def test_openai_encoder_encode_a_string(mocker, mock_encoder):
     # Mock tiktoken.get_encoding pour retourner notre simulateur d'encoder
-    mocker.patch("cadenai.encoder.tiktoken.get_encoding", return_value=mock_encoder)
+    mocker.patch("tiktoken.get_encoding", return_value=mock_encoder)
 
     encoder = OpenAIEncoder()
     result = encoder.encode_a_string("some text")
@@ -30,10 +36,33 @@ def test_openai_encoder_encode_a_string(mocker, mock_encoder):
 
 def test_openai_encoder_decode_a_string(mocker, mock_encoder):
     # Mock tiktoken.get_encoding pour retourner notre simulateur d'encoder
-    mocker.patch("cadenai.encoder.tiktoken.get_encoding", return_value=mock_encoder)
+    mocker.patch("tiktoken.get_encoding", return_value=mock_encoder)
 
     encoder = OpenAIEncoder()
     result = encoder.decode_a_string([1, 2, 3])
     
     assert result == "decoded text"
     mock_encoder.decode.assert_called_once_with([1, 2, 3])
+
+
+def test_get_encoding_resolves_each_encoding_once(mocker, mock_encoder):
+    mocked_get_encoding = mocker.patch("tiktoken.get_encoding", return_value=mock_encoder)
+
+    OpenAIEncoder()
+    OpenAIEncoder()
+
+    assert get_encoding("cl100k_base") is mock_encoder
+    mocked_get_encoding.assert_called_once_with("cl100k_base")
+
+def test_openai_encoder_batch_methods(mocker, mock_encoder):
+    mock_encoder.encode_batch.return_value = [[1, 2, 3], [4]]
+    mock_encoder.decode_batch.return_value = ["a", "b"]
+    mocker.patch("tiktoken.get_encoding", return_value=mock_encoder)
+
+    encoder = OpenAIEncoder(num_threads=4)
+
+    assert encoder.encode_batch(["abc", "d"]) == [[1, 2, 3], [4]]
+    mock_encoder.encode_batch.assert_called_with(["abc", "d"], num_threads=4)
+    assert encoder.count_tokens_batch(["abc", "d"]) == [3, 1]
+    assert encoder.decode_batch([[1], [2]]) == ["a", "b"]
+    assert encoder.count_tokens("some text") == 3
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ["openai", "mistralai", "qdrant_client", "tiktoken", "pypdf", "dotenv", "numpy"]
+
+# Large margin over the ~0.2s measured locally, only a regression (e.g. an SDK imported at module level) should exceed it
+IMPORT_TIME_BUDGET_SECONDS = 1.0
+
+def cumulative_import_time(module : str) -> float :
+    """Cumulative import time of a module in a fresh interpreter, measured with python -X importtime"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines() :
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module :
+            return int(fields[1]) / 1e6
+    raise AssertionError(f"{module} not found in the importtime output")
+
+@pytest.mark.parametrize("module", ["cadenai.document.text_splitter", "cadenai.document.file_handler", "cadenai.chains"])
+def test_import_does_not_load_heavy_dependencies(module):
+    code = f"import sys, {module}; print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))"
+    # Sans clé d'API : rien ne doit construire de client à l'import
+    env = {key : value for key, value in os.environ.items() if key not in ("OPENAI_API_KEY", "MISTRAL_API_KEY")}
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env)
+
+    assert result.stdout.strip() == ""
+
+def test_text_splitter_import_time_budget():
+    # Meilleur de 3 mesures, pour ne pas dépendre d'un pic de charge
+    assert min(cumulative_import_time("cadenai.document.text_splitter") for _ in range(3)) < IMPORT_TIME_BUDGET_SECONDS
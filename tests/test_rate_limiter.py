@@ -0,0 +1,78 @@
+import pytest
+
+from cadenai.rate_limiter import RateLimiter, count_prompt_tokens
+
+@pytest.fixture
+def mock_encoder(mocker):
+    encoder = mocker.Mock()
+    encoder.encode_a_string.side_effect = lambda text : [0] * len(text.split())
+    return encoder
+
+def test_rate_limiter_allows_burst_up_to_the_limit(clock):
+    limiter = RateLimiter(requests_per_minute=3, clock=clock.time, sleep=clock.sleep)
+
+    for _ in range(3):
+        assert limiter.acquire() == 0.0
+    assert clock.sleeps == []
+
+def test_rate_limiter_waits_when_requests_are_exhausted(clock):
+    limiter = RateLimiter(requests_per_minute=60, clock=clock.time, sleep=clock.sleep)
+
+    for _ in range(60):
+        limiter.acquire()
+    waited = limiter.acquire()
+
+    # 60 requêtes par minute : une nouvelle place toutes les secondes
+    assert waited == pytest.approx(1.0)
+
+def test_rate_limiter_waits_for_tokens(clock):
+    limiter = RateLimiter(tokens_per_minute=600, clock=clock.time, sleep=clock.sleep)
+
+    limiter.acquire(tokens=500)
+    waited = limiter.acquire(tokens=200)
+
+    # Il manque 100 tokens, à 10 tokens par seconde
+    assert waited == pytest.approx(10.0)
+
+def test_rate_limiter_clamps_requests_bigger_than_the_bucket(clock):
+    limiter = RateLimiter(tokens_per_minute=100, clock=clock.time, sleep=clock.sleep)
+
+    assert limiter.acquire(tokens=1000) == 0.0
+
+def test_rate_limiter_without_limits_never_waits(clock):
+    limiter = RateLimiter(clock=clock.time, sleep=clock.sleep)
+
+    for _ in range(1000):
+        limiter.acquire(tokens=10000)
+    assert clock.sleeps == []
+
+def test_rate_limiter_refills_over_time(clock):
+    limiter = RateLimiter(requests_per_minute=2, clock=clock.time, sleep=clock.sleep)
+
+    limiter.acquire()
+    limiter.acquire()
+    clock.now += 30
+    assert limiter.acquire() == 0.0
+
+def test_count_prompt_tokens(mock_encoder):
+    prompt = [
+        {"role": "system", "content": "one two three"},
+        ("human", "four five"),
+    ]
+
+    assert count_prompt_tokens(prompt, mock_encoder) == 3 + 2 + 2 * 4
+
+def test_acquire_for_prompt_charges_prompt_and_max_tokens(mocker, mock_encoder, clock):
+    limiter = RateLimiter(tokens_per_minute=1000, encoder=mock_encoder, clock=clock.time, sleep=clock.sleep)
+    mocker.patch.object(limiter, "acquire")
+
+    limiter.acquire_for_prompt([{"role": "user", "content": "one two"}], max_tokens=100)
+
+    limiter.acquire.assert_called_once_with(2 + 4 + 100)
+
+def test_acquire_for_texts_does_not_count_tokens_without_token_limit(mocker, mock_encoder):
+    limiter = RateLimiter(requests_per_minute=10, encoder=mock_encoder)
+
+    limiter.acquire_for_texts(["one two"])
+
+    mock_encoder.encode_a_string.assert_not_called()
@@ -0,0 +1,51 @@
+import pytest
+
+from cadenai.storage import SQLiteStore
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStore(path=str(tmp_path / "store.sqlite"))
+
+def test_sqlite_store_set_and_get(store):
+    store.set("key", b"value")
+
+    assert store.get("key") == b"value"
+    assert store.get("missing") is None
+    assert "key" in store
+    assert len(store) == 1
+
+def test_sqlite_store_get_many(store):
+    store.set_many([("a", "1"), ("b", "2")])
+
+    assert store.get_many(["a", "b", "c"]) == {"a": "1", "b": "2"}
+
+def test_sqlite_store_persists_between_instances(tmp_path):
+    path = str(tmp_path / "store.sqlite")
+    SQLiteStore(path=path).set("key", "value")
+
+    assert SQLiteStore(path=path).get("key") == "value"
+
+def test_sqlite_store_evicts_least_recently_used(tmp_path):
+    store = SQLiteStore(path=str(tmp_path / "store.sqlite"), max_entries=2)
+    store.set("a", "1")
+    store.set("b", "2")
+    store.get("a") # "a" devient le plus récemment utilisé
+    store.set("c", "3")
+
+    assert len(store) == 2
+    assert store.get("b") is None
+    assert store.get("a") == "1"
+    assert store.get("c") == "3"
+
+def test_sqlite_store_delete_and_clear(store):
+    store.set_many([("a", "1"), ("b", "2"), ("c", "3")])
+
+    store.delete_many(["a"])
+    assert sorted(store.keys()) == ["b", "c"]
+
+    store.clear()
+    assert len(store) == 0
+
+def test_sqlite_store_rejects_invalid_table_name(tmp_path):
+    with pytest.raises(ValueError):
+        SQLiteStore(path=str(tmp_path / "store.sqlite"), table="drop table;")
@@ -0,0 +1,21 @@
+from cadenai.streaming import record_stream, replay
+
+def test_record_stream_calls_on_complete_once_the_stream_is_complete():
+    completed = []
+    stream = record_stream(iter(["C'est ", None, "Paris"]), completed.append)
+
+    assert next(stream) == "C'est "
+    assert completed == [] # Rien tant que le stream n'est pas terminé
+    assert list(stream) == [None, "Paris"]
+    assert completed == ["C'est Paris"]
+
+def test_record_stream_interrupted_is_not_completed():
+    completed = []
+    stream = record_stream(iter(["a", "b"]), completed.append)
+    next(stream)
+    stream.close()
+
+    assert completed == []
+
+def test_replay():
+    assert list(replay("C'est Paris")) == ["C'est Paris"]
@@ -0,0 +1,192 @@
+import pytest
+from tenacity import retry, wait_none, stop_after_attempt
+
+from cadenai import tracing
+from cadenai.tracing import MetricsAggregator, Span, Tracer, NOOP_SPAN, add_tracer, remove_tracer, span, quantiles
+from cadenai.llm.openai import ChatOpenAI
+from cadenai.chains import RetrievalChain
+
+class RecordingTracer(Tracer):
+    def __init__(self):
+        self.spans = []
+
+    def on_span_end(self, span):
+        self.spans.append(span)
+
+@pytest.fixture
+def recorder():
+    tracer = RecordingTracer()
+    add_tracer(tracer)
+    yield tracer
+    remove_tracer(tracer)
+
+@pytest.fixture
+def aggregator():
+    aggregator = MetricsAggregator()
+    add_tracer(aggregator)
+    yield aggregator
+    remove_tracer(aggregator)
+
+def test_span_is_a_shared_noop_without_tracer():
+    assert not tracing.is_enabled()
+    with span("operation", size=3) as current:
+        current.set(tokens=10)
+
+    assert current is NOOP_SPAN
+    assert not current.recording
+
+def test_span_records_duration_attributes_and_parent(recorder):
+    with span("parent") :
+        with span("child", size=3) as child:
+            child.set(tokens=10)
+
+    assert [s.name for s in recorder.spans] == ["child", "parent"]
+    assert isinstance(child, Span)
+    assert child.attributes == {"size": 3, "tokens": 10}
+    assert child.parent == "parent"
+    assert recorder.spans[1].parent is None
+    assert child.duration >= 0
+
+def test_span_records_errors_without_catching_them(recorder):
+    with pytest.raises(ValueError):
+        with span("failing"):
+            raise ValueError("boom")
+
+    assert recorder.spans[0].error == "ValueError"
+
+def test_span_of_a_closed_generator_is_not_an_error(recorder):
+    def generator():
+        with span("stream"):
+            yield "a"
+            yield "b"
+
+    stream = generator()
+    next(stream)
+    stream.close() # Le consommateur arrête de lire avant la fin
+
+    assert recorder.spans[0].name == "stream"
+    assert recorder.spans[0].error is None
+
+def test_trace_retry_emits_a_span_per_retry(aggregator):
+    calls = []
+
+    @retry(wait=wait_none(), stop=stop_after_attempt(3), before_sleep=tracing.trace_retry("operation"))
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError("retry")
+        return "ok"
+
+    assert flaky() == "ok"
+    stats = aggregator.summary()["operation.retry"]
+    assert stats["retries"] == 2
+    assert "attempt" not in stats
+
+def test_quantiles_nearest_rank():
+    samples = list(range(1, 101))
+
+    assert quantiles(samples, (0.5, 0.95, 0.99)) == [50, 95, 99]
+    assert quantiles([], (0.5,)) == [None]
+
+def test_aggregator_summary(aggregator, mocker):
+    # Horloge factice : chaque span dure exactement index secondes
+    durations = iter([t for index in range(1, 11) for t in (0, index)])
+    mocker.patch("cadenai.tracing.time.perf_counter", side_effect=lambda : next(durations))
+
+    for index in range(1, 11):
+        with span("llm.completion", prompt_tokens=index, max_tokens=100, model="gpt-4", stream=False) as current:
+            current.set(time_to_first_token_seconds=index / 10)
+
+    stats = aggregator.summary()["llm.completion"]
+    assert stats["count"] == 10
+    assert stats["errors"] == 0
+    assert stats["total_seconds"] == 55
+    assert (stats["p50"], stats["p95"], stats["p99"]) == (5, 10, 10)
+    assert stats["prompt_tokens"] == 55
+    assert stats["time_to_first_token_seconds_p50"] == 0.5
+    # Seuls les compteurs sont agrégés : pas les paramètres, ni les attributs non numériques et booléens
+    assert "max_tokens" not in stats
+    assert "model" not in stats and "stream" not in stats
+
+    aggregator.reset()
+    assert aggregator.summary() == {}
+
+def test_aggregator_to_prometheus(aggregator):
+    with span("vector_db.search", results=2):
+        pass
+    with pytest.raises(RuntimeError):
+        with span("vector_db.search"):
+            raise RuntimeError("down")
+
+    text = aggregator.to_prometheus()
+
+    assert "# TYPE cadenai_span_duration_seconds summary" in text
+    assert 'cadenai_span_duration_seconds{span="vector_db.search",quantile="0.99"}' in text
+    assert 'cadenai_span_duration_seconds_count{span="vector_db.search"} 2' in text
+    assert 'cadenai_span_errors_total{span="vector_db.search"} 1' in text
+    assert 'cadenai_span_attribute_total{span="vector_db.search",attribute="results"} 2.0' in text
+    assert text.endswith("\n")
+
+def test_chat_openai_spans_with_tokens(mocker, aggregator):
+    chat_ai = ChatOpenAI(model="gpt-4")
+    chat_ai.client = mocker.Mock()
+    usage = mocker.MagicMock(prompt_tokens=12, completion_tokens=5, total_tokens=17)
+    chat_ai.client.chat.completions.create.return_value = mocker.MagicMock(
+        choices=[mocker.MagicMock(message=mocker.MagicMock(content="Réponse"))], usage=usage
+    )
+
+    assert chat_ai.get_completion([{"role": "user", "content": "Test"}], max_tokens=50) == "Réponse"
+
+    stats = aggregator.summary()["llm.completion"]
+    assert (stats["prompt_tokens"], stats["completion_tokens"], stats["total_tokens"]) == (12, 5, 17)
+
+def test_chat_openai_stream_span_measures_time_to_first_token(mocker, recorder):
+    chat_ai = ChatOpenAI(model="gpt-4")
+    chat_ai.client = mocker.Mock()
+    chat_ai.client.chat.completions.create.return_value = iter([
+        mocker.MagicMock(choices=[mocker.MagicMock(delta=mocker.MagicMock(content=token))]) for token in ["a", "b", "c"]
+    ])
+
+    generator = chat_ai.get_completion([{"role": "user", "content": "Test"}], max_tokens=50, stream=True)
+    assert recorder.spans == [] # Le span se termine avec le stream
+    assert list(generator) == ["a", "b", "c"]
+
+    completion_span = recorder.spans[0]
+    assert completion_span.name == "llm.completion"
+    assert completion_span.attributes["chunks"] == 3
+    assert 0 <= completion_span.attributes["time_to_first_token_seconds"] <= completion_span.duration
+
+def test_spans_opened_while_reading_a_stream_are_not_its_children(mocker, recorder):
+    chat_ai = ChatOpenAI(model="gpt-4")
+    chat_ai.client = mocker.Mock()
+    chat_ai.client.chat.completions.create.return_value = iter([
+        mocker.MagicMock(choices=[mocker.MagicMock(delta=mocker.MagicMock(content=token))]) for token in ["a", "b"]
+    ])
+
+    with span("consumer"):
+        generator = chat_ai.get_completion([{"role": "user", "content": "Test"}], max_tokens=50, stream=True)
+        next(generator)
+        # Span ouvert par le consommateur pendant que le stream est ouvert (ex. embeddings pendant le découpage)
+        with span("embeddings.embed_batch"):
+            pass
+        list(generator)
+
+    spans = {s.name: s for s in recorder.spans}
+    assert spans["embeddings.embed_batch"].parent == "consumer"
+    assert spans["llm.completion"].parent == "consumer"
+
+def test_retrieval_chain_spans(mocker, recorder):
+    llm = mocker.MagicMock()
+    llm._prompt_syntax = "openai"
+    llm.get_completion.return_value = "Réponse"
+    vector_db = mocker.MagicMock()
+    vector_db.similarity_search.return_value = ["connaissance"]
+    chain = RetrievalChain(llm=llm, vector_db=vector_db)
+
+    assert chain.run(user_input="Question ?") == "Réponse"
+
+    spans = {s.name: s for s in recorder.spans}
+    assert set(spans) == {"retrieval_chain.retrieve", "prompt.format", "chain.run", "retrieval_chain.run"}
+    assert spans["retrieval_chain.retrieve"].parent == "retrieval_chain.run"
+    assert spans["prompt.format"].parent == "chain.run"
+    assert spans["chain.run"].attributes["chain"] == "RetrievalChain"
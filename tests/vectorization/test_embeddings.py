@@ -1,6 +1,9 @@
 import pytest
 import openai
-from cadenai.vectorization.embeddings import OpenAIEmbeddings
+import threading
+import time
+from types import SimpleNamespace
+from cadenai.vectorization.embeddings import OpenAIEmbeddings, CacheBackedEmbeddings
 from cadenai.document.file_handler import DocumentHandler
 
 @pytest.fixture
@@ -8,6 +11,14 @@ def mock_document():
     mock = DocumentHandler(page_content="Sample content for testing")
     return mock
 
+@pytest.fixture(autouse=True)
+def mock_encoder(mocker):
+    # Un token par caractère, pour ne pas dépendre des fichiers de tiktoken
+    encoder = mocker.Mock()
+    encoder.count_tokens_batch.side_effect = lambda texts : [len(text) for text in texts]
+    mocker.patch("cadenai.encoder.OpenAIEncoder", return_value=encoder)
+    return encoder
+
 @pytest.fixture
 def mock_openai_client(mocker):
     mock_client = mocker.Mock()
@@ -79,9 +90,155 @@ def test_embed_documents(mocker, mock_openai_client, mock_document):
     embedder.client = mock_openai_client
 
     fake_embedding = [0.7, 0.8, 0.9]
-    mock_openai_client.embeddings.create.return_value = mocker.MagicMock(data=[mocker.MagicMock(embedding=fake_embedding)])
+    mock_openai_client.embeddings.create.return_value = mocker.MagicMock(data=[mocker.MagicMock(embedding=fake_embedding, index=0), mocker.MagicMock(embedding=fake_embedding, index=1)])
 
     docs = [mock_document, mock_document]
     results = embedder.embed_documents(docs)
 
-    assert results == [[0.7, 0.8, 0.9], [0.7, 0.8, 0.9]]
\ No newline at end of file
+    assert results == [[0.7, 0.8, 0.9], [0.7, 0.8, 0.9]]
+    mock_openai_client.embeddings.create.assert_called_once_with(input=[mock_document.page_content, mock_document.page_content], model="text-embedding-ada-002")
+
+def fake_batch_response(mocker, input, model):
+    # Renvoie les embeddings dans le désordre pour vérifier qu'ils sont bien remis dans l'ordre
+    data = [mocker.MagicMock(embedding=[float(len(text))], index=i) for i, text in enumerate(input)]
+    return mocker.MagicMock(data=list(reversed(data)))
+
+def test_embed_documents_batches_by_count(mocker, mock_openai_client):
+
+    embedder = OpenAIEmbeddings(batch_size=2)
+    embedder.client = mock_openai_client
+    mock_openai_client.embeddings.create.side_effect = lambda input, model : fake_batch_response(mocker, input, model)
+
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+    results = embedder.embed_documents(texts, loading_bar=False)
+
+    assert results == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert mock_openai_client.embeddings.create.call_count == 3
+    assert [call.kwargs["input"] for call in mock_openai_client.embeddings.create.call_args_list] == [["a", "bb"], ["ccc", "dddd"], ["eeeee"]]
+
+def test_embed_documents_batches_by_tokens(mocker, mock_openai_client):
+
+    embedder = OpenAIEmbeddings(max_tokens_per_batch=5)
+    embedder.client = mock_openai_client
+    mock_openai_client.embeddings.create.side_effect = lambda input, model : fake_batch_response(mocker, input, model)
+
+    texts = ["aa", "bbb", "c", "dddddd"]
+    results = embedder.embed_documents(texts, loading_bar=False)
+
+    assert results == [[2.0], [3.0], [1.0], [6.0]]
+    # Un texte trop long pour la limite est envoyé seul
+    assert [call.kwargs["input"] for call in mock_openai_client.embeddings.create.call_args_list] == [["aa", "bbb"], ["c"], ["dddddd"]]
+
+def test_embed_batch_with_retry_retries_only_the_failed_batch(mocker, mock_openai_client):
+
+    embedder = OpenAIEmbeddings(batch_size=1)
+    embedder.client = mock_openai_client
+    mocker.patch("time.sleep")
+
+    responses = [fake_batch_response(mocker, ["a"], None), Exception("Rate limit"), fake_batch_response(mocker, ["bb"], None)]
+    mock_openai_client.embeddings.create.side_effect = responses
+
+    results = embedder.embed_documents(["a", "bb"], loading_bar=False)
+
+    assert results == [[1.0], [2.0]]
+    assert mock_openai_client.embeddings.create.call_count == 3
+    assert [call.kwargs["input"] for call in mock_openai_client.embeddings.create.call_args_list] == [["a"], ["bb"], ["bb"]]
+
+class SleepingEmbeddingsClient():
+    # Faux client qui met du temps à répondre et qui compte les requêtes en parallèle
+    def __init__(self, delay):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.embeddings = self
+
+    def create(self, input, model):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        data = [SimpleNamespace(embedding=[float(len(text))], index=i) for i, text in enumerate(input)]
+        return SimpleNamespace(data=data)
+
+def test_embed_documents_concurrent_keeps_order_and_bounds_in_flight_requests():
+
+    embedder = OpenAIEmbeddings(batch_size=1, max_concurrent_requests=3)
+    embedder.client = SleepingEmbeddingsClient(delay=0.05)
+
+    texts = ["a" * i for i in range(1, 13)]
+    start = time.perf_counter()
+    results = embedder.embed_documents(texts, loading_bar=True)
+    elapsed = time.perf_counter() - start
+
+    assert results == [[float(i)] for i in range(1, 13)]
+    assert embedder.client.max_in_flight == 3
+    # 12 requêtes de 50ms avec 3 en parallèle : bien moins que 600ms en séquentiel
+    assert elapsed < 0.45
+
+
+@pytest.fixture
+def mock_inner_embedder(mocker):
+    embedder = mocker.Mock(spec=OpenAIEmbeddings)
+    embedder.model = "text-embedding-ada-002"
+    embedder.dimension = 1536
+    embedder.embed_query.side_effect = lambda text : [float(len(text)), 0.5]
+    embedder.embed_documents.side_effect = lambda documents, loading_bar : [[float(len(text)), 0.5] for text in documents]
+    return embedder
+
+def test_cache_backed_embeddings_embed_query(tmp_path, mock_inner_embedder):
+
+    embedder = CacheBackedEmbeddings(mock_inner_embedder, path=str(tmp_path / "cache.sqlite"))
+
+    assert embedder.embed_query("hello") == [5.0, 0.5]
+    assert embedder.embed_query(DocumentHandler(page_content="hello")) == [5.0, 0.5]
+
+    mock_inner_embedder.embed_query.assert_called_once_with("hello")
+    assert embedder.hits == 1
+    assert embedder.misses == 1
+    assert embedder.dimension == 1536
+
+def test_cache_backed_embeddings_embed_documents_only_sends_misses(tmp_path, mock_inner_embedder):
+
+    embedder = CacheBackedEmbeddings(mock_inner_embedder, path=str(tmp_path / "cache.sqlite"))
+    embedder.embed_documents(["a", "bb"], loading_bar=False)
+
+    results = embedder.embed_documents(["bb", "ccc", "a", "ccc"], loading_bar=False)
+
+    assert results == [[2.0, 0.5], [3.0, 0.5], [1.0, 0.5], [3.0, 0.5]]
+    # Les textes déjà connus ne sont pas renvoyés et les doublons ne sont envoyés qu'une fois
+    assert mock_inner_embedder.embed_documents.call_args_list[-1].args == (["ccc"],)
+    assert embedder.cache_info() == {"hits": 2, "misses": 4, "hit_rate": 2 / 6, "size": 3}
+
+def test_cache_backed_embeddings_key_depends_on_model(tmp_path, mock_inner_embedder):
+
+    path = str(tmp_path / "cache.sqlite")
+    CacheBackedEmbeddings(mock_inner_embedder, path=path).embed_query("hello")
+
+    mock_inner_embedder.model = "text-embedding-3-small"
+    CacheBackedEmbeddings(mock_inner_embedder, path=path).embed_query("hello")
+
+    assert mock_inner_embedder.embed_query.call_count == 2
+
+def test_cache_backed_embeddings_eviction(tmp_path, mock_inner_embedder):
+
+    embedder = CacheBackedEmbeddings(mock_inner_embedder, path=str(tmp_path / "cache.sqlite"), max_entries=2)
+    embedder.embed_documents(["a", "bb", "ccc"], loading_bar=False)
+
+    assert len(embedder.store) == 2
+
+def test_embed_documents_waits_for_rate_limiter(mocker, mock_openai_client):
+
+    rate_limiter = mocker.Mock()
+    embedder = OpenAIEmbeddings(batch_size=2, rate_limiter=rate_limiter)
+    embedder.client = mock_openai_client
+    mock_openai_client.embeddings.create.side_effect = lambda input, model : fake_batch_response(mocker, input, model)
+
+    embedder.embed_documents(["a", "bb", "ccc"], loading_bar=False)
+
+    # Les tokens comptés pour former les batches sont réutilisés, pas recomptés par le rate limiter
+    assert rate_limiter.acquire.call_args_list == [mocker.call(3), mocker.call(3)]
+    rate_limiter.acquire_for_texts.assert_not_called()
+    assert embedder.encoder.count_tokens_batch.call_count == 1
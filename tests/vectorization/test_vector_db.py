@@ -1,7 +1,17 @@
 import pytest
+from unittest.mock import call
+import json
+import uuid
+import numpy as np
+import threading
+import time
 from cadenai.document.file_handler import DocumentHandler
-from cadenai.vectorization.vector_db import Qdrant, QdrantManager
+from cadenai.document.text_splitter import SizeSplitter
+from cadenai.vectorization.vector_db import Qdrant, QdrantManager, NumpyVectorDB, point_id, build_filter, match_filter
 from cadenai.vectorization.embeddings import OpenAIEmbeddings
+from cadenai.storage import SQLiteStore
+from cadenai.tracing import MetricsAggregator, add_tracer, remove_tracer
+from qdrant_client import models
 from qdrant_client.http.models import ScoredPoint
 
 @pytest.fixture
@@ -122,20 +132,66 @@ def test_similarity_search(mocker, qdrant_instance, mock_client, mock_embedder):
     # Test sans métadonnées
     results_without_metadata = qdrant_instance.similarity_search(query=query, limit=limit)
     mock_embedder.embed_query.assert_called_once_with(query)
+    # Seul le texte est demandé à Qdrant, jamais les vecteurs
     mock_client.search.assert_called_once_with(
         collection_name=qdrant_instance.collection_name,
         query_vector=[0.1, 0.2, 0.3],
-        limit=limit
+        limit=limit,
+        with_payload=["text"],
+        with_vectors=False
     )
     assert results_without_metadata == ["result 1", "result 2"]
 
     # Test avec métadonnées
     results_with_metadata = qdrant_instance.similarity_search(query=query, limit=limit, show_metadata=True)
+    assert mock_client.search.call_args.kwargs["with_payload"] is True
     assert results_with_metadata == [
         {"text": "result 1", "other_data": "data 1"}, 
         {"text": "result 2", "other_data": "data 2"}
     ]
 
+
+def test_similarity_search_emits_span(mocker, qdrant_instance, mock_client):
+    mocker.patch.object(qdrant_instance, 'client', mock_client)
+    aggregator = MetricsAggregator()
+    add_tracer(aggregator)
+    try :
+        qdrant_instance.similarity_search(query="test query", limit=10)
+    finally :
+        remove_tracer(aggregator)
+
+    stats = aggregator.summary()["vector_db.search"]
+    assert stats["count"] == 1
+    assert stats["results"] == 2
+    assert "limit" not in stats # Paramètre de la recherche, pas un compteur
+
+def test_similarity_search_batch(mocker, mock_client, mock_embedder, qdrant_instance):
+    qdrant_instance.client = mock_client
+    queries = ["query 1", "query 2", "query 3"]
+    mock_embedder.embed_documents.return_value = [[0.1], [0.2], [0.3]]
+    mock_client.search_batch.side_effect = lambda collection_name, requests : [
+        [ScoredPoint(id=0, version=0, payload={"text": f"result {request.vector[0]}"}, score=request.vector[0])] for request in requests
+    ]
+
+    results = qdrant_instance.similarity_search_batch(queries, limit=5, batch_size=2)
+
+    # Un seul appel d'embedding, et les requêtes sont envoyées par lots de 2
+    mock_embedder.embed_documents.assert_called_once_with(queries, loading_bar=False)
+    mock_embedder.embed_query.assert_not_called()
+    mock_client.search.assert_not_called()
+    assert mock_client.search_batch.call_count == 2
+    first_requests = mock_client.search_batch.call_args_list[0].kwargs["requests"]
+    assert [request.limit for request in first_requests] == [5, 5]
+    assert results == [["result 0.1"], ["result 0.2"], ["result 0.3"]]
+
+    scored = qdrant_instance.similarity_search_batch_with_scores(queries, limit=5)
+    assert scored == [[["result 0.1", 0.1]], [["result 0.2", 0.2]], [["result 0.3", 0.3]]]
+
+def test_similarity_search_batch_empty(mock_client, qdrant_instance):
+    qdrant_instance.client = mock_client
+    assert qdrant_instance.similarity_search_batch([], limit=5) == []
+    mock_client.search_batch.assert_not_called()
+
 def test_similarity_search_with_scores(mock_client, mock_embedder, qdrant_instance):
     mock_query = "test query"
     mock_embedder.embed_query.return_value = [0.1, 0.2, 0.3]
@@ -148,4 +204,599 @@ def test_similarity_search_with_scores(mock_client, mock_embedder, qdrant_instan
     # Verify results and if embedder and client methods were called
     assert results == [["test content", 1.0]]
     mock_embedder.embed_query.assert_called_once_with(mock_query)
-    mock_client.search.assert_called_once()
\ No newline at end of file
+    mock_client.search.assert_called_once()
+def test_add_documents_consumes_iterables_in_batches(mocker, mock_client, mock_embedder, qdrant_instance):
+    pulled = []
+
+    def documents():
+        for i in range(5):
+            pulled.append(i)
+            yield DocumentHandler(page_content=f"content {i}")
+
+    def fake_embed_documents(documents, loading_bar):
+        # Au moment d'embedder un lot, seul ce lot a été lu dans le flux
+        assert len(pulled) == min(5, (len(embedded_batches) + 1) * 2)
+        embedded_batches.append(len(documents))
+        return [[0.1, 0.2, 0.3]] * len(documents)
+
+    embedded_batches = []
+    mock_embedder.embed_documents.side_effect = fake_embed_documents
+    qdrant_instance.client = mock_client
+    mocker.patch('cadenai.vectorization.vector_db.Qdrant.__len__', return_value=0)
+
+    qdrant_instance.add_documents(documents(), batch_size=2)
+
+    assert embedded_batches == [2, 2, 1]
+    assert mock_client.upload_records.call_count == 3
+
+def test_prepare_vector_list_uses_deterministic_ids_without_count(mocker, mock_client, qdrant_instance):
+    qdrant_instance.client = mock_client
+    payloads = [{"text": "chunk 1", "source": "a.pdf"}, {"text": "chunk 2", "source": "a.pdf"}]
+
+    first = qdrant_instance._prepare_vector_list([[0.1], [0.2]], payloads)
+    second = qdrant_instance._prepare_vector_list([[0.1], [0.2]], [dict(reversed(payload.items())) for payload in payloads])
+
+    # Mêmes chunks, mêmes identifiants, quel que soit l'ordre des clés
+    assert [record.id for record in first] == [record.id for record in second]
+    assert first[0].id != first[1].id
+    assert str(uuid.UUID(first[0].id)) == first[0].id
+    mock_client.count.assert_not_called()
+
+def test_point_id_depends_on_source_metadata():
+    assert point_id({"text": "same chunk", "source": "a.pdf"}) != point_id({"text": "same chunk", "source": "b.pdf"})
+    assert point_id({"text": "same chunk", "source": "a.pdf"}) == point_id({"source": "a.pdf", "text": "same chunk"})
+
+@pytest.fixture
+def sync_instance(mocker, mock_client, mock_embedder, qdrant_instance):
+    collection = mocker.MagicMock()
+    collection.name = "test_collection"
+    mock_client.get_collections.return_value = mocker.MagicMock(collections=[collection])
+    mock_embedder.embed_documents.side_effect = lambda documents, loading_bar : [[0.1, 0.2, 0.3]] * len(documents)
+    qdrant_instance.client = mock_client
+    return qdrant_instance
+
+def uploaded_texts(mock_client):
+    return [record.payload["text"] for call in mock_client.upload_records.call_args_list for record in call.kwargs["records"]]
+
+def test_sync_documents_only_upserts_changed_documents(tmp_path, mock_client, sync_instance):
+    manifest_path = str(tmp_path / "manifest.json")
+    splitter = SizeSplitter(chunk_size=2, chunk_overlap=0, chunk_type="words")
+
+    first_run = [
+        DocumentHandler(page_content="one two three four", metadata={"source": "a.pdf"}),
+        DocumentHandler(page_content="five six", metadata={"source": "b.pdf"}),
+        DocumentHandler(page_content="seven eight", metadata={"source": "c.pdf"}),
+    ]
+    stats = sync_instance.sync_documents(first_run, manifest_path=manifest_path, text_splitter=splitter)
+
+    assert stats["added"] == 3
+    assert uploaded_texts(mock_client) == ["one two", "three four", "five six", "seven eight"]
+    mock_client.recreate_collection.assert_not_called()
+
+    mock_client.upload_records.reset_mock()
+    second_run = [
+        DocumentHandler(page_content="one two three changed", metadata={"source": "a.pdf"}),
+        DocumentHandler(page_content="five six", metadata={"source": "b.pdf"}),
+    ]
+    stats = sync_instance.sync_documents(second_run, manifest_path=manifest_path, text_splitter=splitter)
+
+    assert stats == {"added": 0, "updated": 1, "unchanged": 1, "removed": 1, "upserted_chunks": 2, "deleted_chunks": 2}
+    # Seul le document modifié est ré-embeddé
+    assert uploaded_texts(mock_client) == ["one two", "three changed"]
+
+    deleted_ids = mock_client.delete.call_args.kwargs["points_selector"].points
+    assert sorted(deleted_ids) == sorted([
+        point_id({"text": "three four", "source": "a.pdf"}),
+        point_id({"text": "seven eight", "source": "c.pdf"}),
+    ])
+
+def test_sync_documents_resplits_when_the_splitter_changes(tmp_path, mock_client, sync_instance):
+    manifest_path = str(tmp_path / "manifest.json")
+    documents = [DocumentHandler(page_content="one two three four", metadata={"source": "a.pdf"})]
+    sync_instance.sync_documents(documents, manifest_path=manifest_path, text_splitter=SizeSplitter(chunk_size=2, chunk_overlap=0, chunk_type="words"))
+
+    # Même splitter avec d'autres réglages d'exécution : rien n'est redécoupé
+    same_splitter = SizeSplitter(chunk_size=2, chunk_overlap=0, chunk_type="words", num_threads=1)
+    assert sync_instance.sync_documents(documents, manifest_path=manifest_path, text_splitter=same_splitter)["unchanged"] == 1
+
+    # Document inchangé mais chunk_size différent : il est redécoupé et les anciens chunks supprimés
+    mock_client.upload_records.reset_mock()
+    stats = sync_instance.sync_documents(documents, manifest_path=manifest_path, text_splitter=SizeSplitter(chunk_size=4, chunk_overlap=0, chunk_type="words"))
+
+    assert (stats["updated"], stats["unchanged"], stats["deleted_chunks"]) == (1, 0, 2)
+    assert uploaded_texts(mock_client) == ["one two three four"]
+
+def test_sync_documents_with_several_pages_per_source(tmp_path, mock_client, sync_instance):
+    manifest_path = str(tmp_path / "manifest.json")
+    pages = [
+        DocumentHandler(page_content="page one", metadata={"source": "a.pdf"}),
+        DocumentHandler(page_content="page two", metadata={"source": "a.pdf"}),
+    ]
+
+    assert sync_instance.sync_documents(pages, manifest_path=manifest_path)["added"] == 2
+
+    # Les pages inchangées ne sont ni ré-envoyées ni supprimées, même après plusieurs runs
+    for _ in range(2):
+        stats = sync_instance.sync_documents(pages, manifest_path=manifest_path)
+        assert stats["unchanged"] == 2
+        assert stats["deleted_chunks"] == 0
+    mock_client.delete.assert_not_called()
+
+    stats = sync_instance.sync_documents([pages[0], DocumentHandler(page_content="page two changed", metadata={"source": "a.pdf"})], manifest_path=manifest_path)
+    assert (stats["unchanged"], stats["updated"]) == (1, 1)
+    assert mock_client.delete.call_args.kwargs["points_selector"].points == [point_id({"text": "page two", "source": "a.pdf"})]
+
+def test_sync_documents_does_not_delete_chunks_moved_to_another_document(tmp_path, mock_client, sync_instance):
+    manifest_path = str(tmp_path / "manifest.json")
+    sync_instance.sync_documents([DocumentHandler(page_content="text")], manifest_path=manifest_path)
+
+    # Le même chunk passe de la position 0 à la position 1 : même ID, il ne doit pas être supprimé
+    stats = sync_instance.sync_documents([DocumentHandler(page_content="new"), DocumentHandler(page_content="text")], manifest_path=manifest_path)
+
+    assert stats["deleted_chunks"] == 0
+    mock_client.delete.assert_not_called()
+
+def test_sync_documents_creates_missing_collection(tmp_path, mocker, mock_client, sync_instance):
+    mock_client.get_collections.return_value = mocker.MagicMock(collections=[])
+
+    sync_instance.sync_documents([DocumentHandler(page_content="text")], manifest_path=str(tmp_path / "manifest.json"))
+
+    mock_client.recreate_collection.assert_called_once()
+    mock_client.upload_records.assert_called_once()
+
+def test_sync_documents_rejects_manifest_of_another_collection(tmp_path, sync_instance):
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps({"collection_name": "other", "sources": {}}))
+
+    with pytest.raises(ValueError):
+        sync_instance.sync_documents([], manifest_path=str(manifest_path))
+
+def test_add_documents_uploads_parallel_sub_batches(mocker, mock_client, mock_embedder, qdrant_instance):
+    mock_embedder.embed_documents.side_effect = lambda documents, loading_bar : [[0.1, 0.2, 0.3]] * len(documents)
+    threads = set()
+    lock = threading.Lock()
+
+    def upload(collection_name, wait, records, batch_size):
+        with lock:
+            threads.add(threading.get_ident())
+        time.sleep(0.02)
+
+    mock_client.upload_records.side_effect = upload
+    qdrant_instance.client = mock_client
+
+    documents = [DocumentHandler(page_content=f"content {i}") for i in range(10)]
+    qdrant_instance.add_documents(documents, batch_size=8, parallel=4)
+
+    # Chaque batch est découpé en sous-batches de ceil(8/4) = 2 envoyés en parallèle, un seul appel qdrant-client par sous-batch
+    sizes = [len(c.kwargs["records"]) for c in mock_client.upload_records.call_args_list]
+    assert sizes == [2, 2, 2, 2, 1, 1]
+    assert all(c.kwargs["batch_size"] == len(c.kwargs["records"]) for c in mock_client.upload_records.call_args_list)
+    assert all("parallel" not in c.kwargs for c in mock_client.upload_records.call_args_list)
+    assert len(threads) > 1
+    assert qdrant_instance.last_ingest_stats["documents"] == 10
+    assert qdrant_instance.last_ingest_stats["batches"] == 2
+
+def test_add_documents_uploads_a_batch_in_one_request(mocker, mock_client, mock_embedder, qdrant_instance):
+    mock_embedder.embed_documents.side_effect = lambda documents, loading_bar : [[0.1, 0.2, 0.3]] * len(documents)
+    qdrant_instance.client = mock_client
+
+    qdrant_instance.add_documents([DocumentHandler(page_content=f"content {i}") for i in range(5)], batch_size=2)
+
+    assert mock_client.upload_records.call_count == 3
+    assert mock_client.upload_records.call_args.kwargs["batch_size"] == 1
+
+def test_add_documents_keeps_embedding_requests_concurrent(mocker, mock_client):
+    encoder = mocker.Mock()
+    encoder.count_tokens_batch.side_effect = lambda texts : [1] * len(texts)
+    mocker.patch("cadenai.encoder.OpenAIEncoder", return_value=encoder)
+    embedder = OpenAIEmbeddings(batch_size=4, max_concurrent_requests=4)
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def create(input, model):
+        with lock:
+            in_flight.append(1)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.pop()
+        return mocker.MagicMock(data=[mocker.MagicMock(embedding=[0.1, 0.2, 0.3], index=i) for i in range(len(input))])
+
+    embedder.client = mocker.Mock()
+    embedder.client.embeddings.create.side_effect = create
+    qdrant = Qdrant(location="localhost", port=1234, collection_name="test_collection", embedder=embedder)
+    qdrant.client = mock_client
+
+    qdrant.add_documents([DocumentHandler(page_content=f"content {i}") for i in range(32)])
+
+    # Batch d'ingestion par défaut = batch_size * max_concurrent_requests : 4 requêtes pleines en parallèle
+    assert qdrant.last_ingest_stats["batches"] == 2
+    assert [len(c.kwargs["input"]) for c in embedder.client.embeddings.create.call_args_list] == [4] * 8
+    assert max(max_in_flight) > 1
+
+def test_add_documents_pipeline_overlaps_embedding_and_upload(mocker, mock_client, mock_embedder, qdrant_instance):
+    events = []
+    lock = threading.Lock()
+
+    def slow_embed(documents, loading_bar):
+        with lock:
+            events.append(("embed start", documents[0].page_content))
+        time.sleep(0.05)
+        with lock:
+            events.append(("embed end", documents[0].page_content))
+        return [[0.1, 0.2, 0.3]] * len(documents)
+
+    def slow_upload(collection_name, wait, records, batch_size):
+        with lock:
+            events.append(("upload start", records[0].payload["text"]))
+        time.sleep(0.05)
+        with lock:
+            events.append(("upload end", records[0].payload["text"]))
+
+    mock_embedder.embed_documents.side_effect = slow_embed
+    mock_client.upload_records.side_effect = slow_upload
+    qdrant_instance.client = mock_client
+
+    documents = [DocumentHandler(page_content=f"content {i}") for i in range(3)]
+    qdrant_instance.add_documents(documents, batch_size=1, pipeline=True)
+
+    # L'upload du lot 0 commence avant la fin de l'embedding du lot 1
+    assert events.index(("upload start", "content 0")) < events.index(("embed end", "content 1"))
+    assert [event for event in events if event[0] == "upload end"] == [("upload end", f"content {i}") for i in range(3)]
+    stats = qdrant_instance.last_ingest_stats
+    assert stats["documents"] == 3
+    assert stats["embedding_docs_per_second"] > 0
+    assert stats["upload_docs_per_second"] > 0
+
+VECTORS = {
+    "cats are cute": [1.0, 0.0, 0.0],
+    "dogs are loyal": [0.0, 1.0, 0.0],
+    "cats and dogs": [0.7, 0.7, 0.0],
+    "the stock market": [0.0, 0.0, 1.0],
+}
+
+@pytest.fixture
+def numpy_embedder(mocker):
+    embedder = mocker.Mock(spec=OpenAIEmbeddings)
+    embedder.dimension = 3
+    embedder.embed_query.side_effect = lambda text : VECTORS[text]
+    embedder.embed_documents.side_effect = lambda documents, loading_bar : [VECTORS[getattr(document, "page_content", document)] for document in documents]
+    return embedder
+
+@pytest.fixture
+def numpy_documents():
+    return [DocumentHandler(page_content=text, metadata={"index": i}) for i, text in enumerate(VECTORS)]
+
+@pytest.fixture
+def numpy_vector_db(numpy_embedder, numpy_documents):
+    vector_db = NumpyVectorDB(embedder=numpy_embedder)
+    vector_db.create_from_documents(numpy_documents, loading_bar=False)
+    return vector_db
+
+def test_numpy_vector_db_len(numpy_vector_db):
+    assert len(numpy_vector_db) == 4
+
+def test_numpy_vector_db_similarity_search(numpy_vector_db):
+    assert numpy_vector_db.similarity_search("cats are cute", limit=2) == ["cats are cute", "cats and dogs"]
+    assert numpy_vector_db.similarity_search("cats are cute", limit=1, show_metadata=True) == [{"index": 0, "text": "cats are cute"}]
+
+def test_numpy_vector_db_returns_payload_copies(numpy_vector_db):
+    # Modifier les métadonnées retournées ne modifie pas la collection
+    numpy_vector_db.similarity_search("cats are cute", limit=1, show_metadata=True)[0]["text"] = "modifié"
+    numpy_vector_db.similarity_search_batch(["cats are cute"], limit=1, show_metadata=True)[0][0]["index"] = 99
+
+    assert numpy_vector_db.similarity_search("cats are cute", limit=1, show_metadata=True) == [{"index": 0, "text": "cats are cute"}]
+
+def test_numpy_vector_db_similarity_search_with_scores(numpy_vector_db):
+    results = numpy_vector_db.similarity_search_with_scores("dogs are loyal", limit=10)
+
+    assert [text for text, _ in results] == ["dogs are loyal", "cats and dogs", "cats are cute", "the stock market"]
+    # Similarité cosinus, comme une collection Qdrant en Distance.COSINE
+    assert results[0][1] == pytest.approx(1.0)
+    assert results[1][1] == pytest.approx(np.sqrt(0.5))
+    assert results[2][1] == pytest.approx(0.0)
+
+def test_numpy_vector_db_upserts_identical_chunks(numpy_vector_db, numpy_documents):
+    numpy_vector_db.add_documents(numpy_documents[:2])
+
+    assert len(numpy_vector_db) == 4
+
+def test_numpy_vector_db_grows_beyond_initial_capacity(mocker):
+    embedder = mocker.Mock(spec=OpenAIEmbeddings)
+    embedder.dimension = 2
+    embedder.embed_documents.side_effect = lambda documents, loading_bar : [[1.0, float(i)] for i in range(len(documents))]
+    vector_db = NumpyVectorDB(embedder=embedder)
+
+    for batch in range(3):
+        vector_db.add_documents([DocumentHandler(page_content=f"{batch}-{i}") for i in range(1000)])
+
+    assert len(vector_db) == 3000
+    assert vector_db.vectors.shape == (3000, 2)
+
+def test_numpy_vector_db_persists_and_memory_maps(tmp_path, numpy_embedder, numpy_documents):
+    path = str(tmp_path / "collection")
+    NumpyVectorDB(embedder=numpy_embedder, path=path).create_from_documents(numpy_documents, loading_bar=False)
+
+    reloaded = NumpyVectorDB(embedder=numpy_embedder, path=path)
+
+    assert isinstance(reloaded.vectors, np.memmap)
+    assert len(reloaded) == 4
+    assert reloaded.similarity_search("the stock market", limit=1) == ["the stock market"]
+
+    # Ajouter après un chargement copie la matrice en mémoire et ré-écrit les fichiers
+    reloaded.add_documents([DocumentHandler(page_content="cats and dogs", metadata={"index": 42})])
+    assert len(NumpyVectorDB(embedder=numpy_embedder, path=path)) == 5
+
+def test_numpy_vector_db_delete_collection(tmp_path, numpy_embedder, numpy_documents):
+    path = str(tmp_path / "collection")
+    vector_db = NumpyVectorDB(embedder=numpy_embedder, path=path)
+    vector_db.create_from_documents(numpy_documents, loading_bar=False)
+
+    vector_db.delete_collection()
+
+    assert len(vector_db) == 0
+    assert vector_db.similarity_search("cats are cute", limit=2) == []
+    assert len(NumpyVectorDB(embedder=numpy_embedder, path=path)) == 0
+
+@pytest.fixture
+def random_vectors():
+    rng = np.random.default_rng(42)
+    # Des vecteurs regroupés autour de quelques centres, comme de vrais embeddings
+    centers = rng.normal(size=(20, 64))
+    return (centers[rng.integers(0, 20, size=3000)] + 0.5 * rng.normal(size=(3000, 64))).astype(np.float32)
+
+def numpy_vector_db_from_vectors(mocker, vectors, **kwargs):
+    embedder = mocker.Mock(spec=OpenAIEmbeddings)
+    embedder.dimension = vectors.shape[1]
+    embedder.embed_documents.side_effect = lambda documents, loading_bar : [vectors[int(getattr(document, "page_content", document))] for document in documents]
+    embedder.embed_query.side_effect = lambda text : vectors[int(text)]
+    vector_db = NumpyVectorDB(embedder=embedder, **kwargs)
+    vector_db.add_documents([DocumentHandler(page_content=str(i)) for i in range(len(vectors))], batch_size=1000)
+    return vector_db
+
+@pytest.mark.parametrize("index, index_kwargs, min_recall", [
+    ("int8", {}, 0.95),
+    ("binary", {"oversampling": 20}, 0.8),
+    ("ivf", {"nprobe": 8}, 0.8),
+])
+def test_numpy_vector_db_index_modes_recall(mocker, random_vectors, index, index_kwargs, min_recall):
+    exact = numpy_vector_db_from_vectors(mocker, random_vectors)
+    approximate = numpy_vector_db_from_vectors(mocker, random_vectors, index=index, **index_kwargs)
+
+    recalls = []
+    for query in range(0, 3000, 150):
+        expected = exact.similarity_search_with_scores(str(query), limit=10)
+        results = approximate.similarity_search_with_scores(str(query), limit=10)
+        recalls.append(len({text for text, _ in expected} & {text for text, _ in results}) / 10)
+        # Le vecteur lui-même est toujours retrouvé, avec son score exact après rescoring
+        assert results[0][0] == str(query)
+        assert results[0][1] == pytest.approx(1.0, abs=1e-5)
+
+    assert np.mean(recalls) >= min_recall
+
+@pytest.mark.parametrize("index, max_ratio", [("int8", 0.3), ("binary", 0.05), ("ivf", 0.2)])
+def test_numpy_vector_db_index_memory_footprint(mocker, random_vectors, index, max_ratio):
+    vector_db = numpy_vector_db_from_vectors(mocker, random_vectors, index=index)
+
+    stats = vector_db.index_stats()
+
+    assert stats["index"] == index
+    assert stats["size"] == 3000
+    assert 0 < stats["index_bytes"] <= max_ratio * stats["vectors_bytes"]
+
+def test_numpy_vector_db_index_is_rebuilt_after_adding_documents(mocker, random_vectors):
+    vector_db = numpy_vector_db_from_vectors(mocker, random_vectors[:2000], index="int8")
+    vector_db.similarity_search("0", limit=5)
+
+    vector_db.embedder.embed_documents.side_effect = lambda documents, loading_bar : [random_vectors[int(document.page_content)] for document in documents]
+    vector_db.embedder.embed_query.side_effect = lambda text : random_vectors[int(text)]
+    vector_db.add_documents([DocumentHandler(page_content=str(i)) for i in range(2000, 3000)])
+
+    assert vector_db.similarity_search("2500", limit=1) == ["2500"]
+
+@pytest.mark.parametrize("index", ["int8", "binary", "ivf"])
+def test_numpy_vector_db_index_is_saved_and_memory_mapped(mocker, tmp_path, random_vectors, index):
+    path = str(tmp_path / "collection")
+    vector_db = numpy_vector_db_from_vectors(mocker, random_vectors, index=index, path=path)
+    expected = vector_db.similarity_search("42", limit=5)
+
+    build = mocker.spy(type(vector_db.index), "build")
+    reopened = NumpyVectorDB(embedder=vector_db.embedder, path=path, index=index)
+
+    # Démarrage à froid : l'index sauvegardé est mappé en mémoire, pas reconstruit
+    assert reopened.similarity_search("42", limit=5) == expected
+    build.assert_not_called()
+    assert all(isinstance(array, np.memmap) for array in reopened.index.state().values())
+
+def test_numpy_vector_db_saved_index_is_invalidated_by_writes(mocker, tmp_path, random_vectors):
+    path = str(tmp_path / "collection")
+    vector_db = numpy_vector_db_from_vectors(mocker, random_vectors[:2000], index="int8", path=path)
+    vector_db.similarity_search("0", limit=5)
+    vector_db.embedder.embed_documents.side_effect = lambda documents, loading_bar : [random_vectors[int(document.page_content)] for document in documents]
+    vector_db.embedder.embed_query.side_effect = lambda text : random_vectors[int(text)]
+    vector_db.add_documents([DocumentHandler(page_content=str(i)) for i in range(2000, 3000)])
+
+    build = mocker.spy(type(vector_db.index), "build")
+    reopened = NumpyVectorDB(embedder=vector_db.embedder, path=path, index="int8")
+    assert reopened.similarity_search("2500", limit=1) == ["2500"]
+    build.assert_called_once()
+
+    # Paramètres différents : l'index sauvegardé n'est pas réutilisé
+    assert not NumpyVectorDB(embedder=vector_db.embedder, path=path, index="ivf", nlist=4)._load_index()
+
+def test_qdrant_rejects_text_store_with_eviction(tmp_path, mock_embedder):
+    with pytest.raises(ValueError):
+        Qdrant(location="localhost", port=1234, collection_name="test_collection", embedder=mock_embedder,
+               text_store=SQLiteStore(path=str(tmp_path / "texts.sqlite"), max_entries=10))
+
+def test_numpy_vector_db_invalid_index(numpy_embedder):
+    with pytest.raises(ValueError):
+        NumpyVectorDB(embedder=numpy_embedder, index="hnsw")
+
+def test_numpy_vector_db_similarity_search_batch(numpy_vector_db, numpy_embedder):
+    queries = ["cats are cute", "dogs are loyal", "the stock market"]
+
+    results = numpy_vector_db.similarity_search_batch(queries, limit=2)
+
+    # Mêmes résultats qu'une recherche par requête, avec un seul appel d'embedding
+    assert results == [numpy_vector_db.similarity_search(query, limit=2) for query in queries]
+    assert numpy_vector_db.similarity_search_batch(queries[:1], limit=1, show_metadata=True) == [[{"index": 0, "text": "cats are cute"}]]
+    scored = numpy_vector_db.similarity_search_batch_with_scores(queries, limit=10)
+    expected = [numpy_vector_db.similarity_search_with_scores(query, limit=10) for query in queries]
+    assert [sorted(text for text, _ in result) for result in scored] == [sorted(text for text, _ in result) for result in expected]
+    assert [score for result in scored for _, score in result] == pytest.approx([score for result in expected for _, score in result])
+    assert numpy_vector_db.similarity_search_batch([], limit=2) == []
+
+def test_numpy_vector_db_similarity_search_batch_blocks(mocker, random_vectors):
+    # Petits blocs de requêtes pour couvrir le découpage de la matrice de scores
+    mocker.patch("cadenai.vectorization.vector_db.BLOCK_SIZE", 100)
+    queries = [str(query) for query in range(0, 3000, 150)]
+
+    for index in ["exact", "ivf"] :
+        vector_db = numpy_vector_db_from_vectors(mocker, random_vectors, index=index)
+
+        assert vector_db.similarity_search_batch(queries, limit=5) == [vector_db.similarity_search(query, limit=5) for query in queries]
+
+def test_numpy_vector_db_similarity_search_with_query_vector(numpy_vector_db, numpy_embedder):
+    numpy_embedder.embed_query.reset_mock()
+
+    assert numpy_vector_db.similarity_search("ignored", limit=1, query_vector=[0.0, 0.0, 1.0]) == ["the stock market"]
+    numpy_embedder.embed_query.assert_not_called()
+
+def test_build_filter():
+    query_filter = build_filter({"tenant": "acme", "type": ["pdf", "html"], "year": {"gte": 2020, "lt": 2024}})
+
+    assert query_filter == models.Filter(must=[
+        models.FieldCondition(key="tenant", match=models.MatchValue(value="acme")),
+        models.FieldCondition(key="type", match=models.MatchAny(any=["pdf", "html"])),
+        models.FieldCondition(key="year", range=models.Range(gte=2020, lt=2024)),
+    ])
+    assert build_filter(None) is None
+    assert build_filter(query_filter) is query_filter
+    with pytest.raises(ValueError):
+        build_filter({"year": {"after": 2020}})
+
+def test_match_filter():
+    payload = {"text": "t", "tenant": "acme", "tags": ["a", "b"], "year": 2021, "author": {"name": "Zola"}}
+
+    assert match_filter(payload, {"tenant": "acme", "year": {"gte": 2020, "lt": 2024}})
+    assert match_filter(payload, {"tags": "b", "author.name": ["Hugo", "Zola"]})
+    assert not match_filter(payload, {"tenant": "other"})
+    assert not match_filter(payload, {"year": {"gt": 2021}})
+    assert not match_filter(payload, {"missing": "value"})
+
+def test_similarity_search_with_filter_and_search_params(mock_client, mock_embedder, qdrant_instance):
+    qdrant_instance.client = mock_client
+
+    qdrant_instance.similarity_search("test query", limit=3, metadata_filter={"tenant": "acme"}, score_threshold=0.5, hnsw_ef=128)
+    mock_client.search.assert_called_once_with(
+        collection_name="test_collection",
+        query_vector=[0.1, 0.2, 0.3],
+        limit=3,
+        with_payload=["text"],
+        with_vectors=False,
+        query_filter=build_filter({"tenant": "acme"}),
+        score_threshold=0.5,
+        search_params=models.SearchParams(hnsw_ef=128, exact=False)
+    )
+
+    mock_client.search.reset_mock()
+    mock_client.search.return_value = []
+    qdrant_instance.similarity_search_with_scores("test query", limit=3, exact=True)
+    mock_client.search.assert_called_once_with(
+        collection_name="test_collection",
+        query_vector=[0.1, 0.2, 0.3],
+        limit=3,
+        with_payload=["text"],
+        with_vectors=False,
+        search_params=models.SearchParams(hnsw_ef=None, exact=True)
+    )
+
+def test_similarity_search_batch_with_filter(mock_client, mock_embedder, qdrant_instance):
+    qdrant_instance.client = mock_client
+    mock_embedder.embed_documents.return_value = [[0.1], [0.2]]
+    mock_client.search_batch.return_value = [[], []]
+
+    qdrant_instance.similarity_search_batch(["query 1", "query 2"], limit=5, metadata_filter={"tenant": "acme"}, score_threshold=0.3)
+
+    requests = mock_client.search_batch.call_args.kwargs["requests"]
+    assert all(request.filter == build_filter({"tenant": "acme"}) for request in requests)
+    assert all(request.score_threshold == 0.3 and request.params is None for request in requests)
+    assert all(request.with_payload == ["text"] and request.with_vector is False for request in requests)
+
+def test_create_collection_creates_payload_indexes(mock_client, mock_embedder):
+    qdrant = Qdrant(location="localhost", port=1234, collection_name="test_collection", embedder=mock_embedder,
+                    payload_indexes={"tenant": "keyword", "year": "integer"})
+    qdrant.client = mock_client
+
+    qdrant.create_collection()
+
+    mock_client.recreate_collection.assert_called_once()
+    assert mock_client.create_payload_index.call_args_list == [
+        call(collection_name="test_collection", field_name="tenant", field_schema=models.PayloadSchemaType.KEYWORD),
+        call(collection_name="test_collection", field_name="year", field_schema=models.PayloadSchemaType.INTEGER),
+    ]
+
+def test_numpy_vector_db_accepts_qdrant_search_arguments(numpy_vector_db, numpy_embedder):
+    # hnsw_ef est ignoré, comme avec exact=True sur une collection sans index
+    assert numpy_vector_db.similarity_search("cats are cute", limit=1, hnsw_ef=128) == ["cats are cute"]
+    assert numpy_vector_db.similarity_search_with_scores("cats are cute", limit=1, hnsw_ef=128)[0][0] == "cats are cute"
+    assert numpy_vector_db.similarity_search_batch(["cats are cute"], limit=1, hnsw_ef=128) == [["cats are cute"]]
+
+    # Un models.Filter n'est pas évalué localement : erreur explicite, avant tout appel d'embedding
+    numpy_embedder.embed_query.reset_mock()
+    numpy_embedder.embed_documents.reset_mock()
+    qdrant_filter = build_filter({"index": 0})
+    with pytest.raises(TypeError, match="models.Filter"):
+        numpy_vector_db.similarity_search("cats are cute", limit=1, metadata_filter=qdrant_filter)
+    with pytest.raises(TypeError, match="models.Filter"):
+        numpy_vector_db.similarity_search_batch_with_scores(["cats are cute"], limit=1, metadata_filter=qdrant_filter)
+    numpy_embedder.embed_query.assert_not_called()
+    numpy_embedder.embed_documents.assert_not_called()
+
+def test_numpy_vector_db_filter_and_score_threshold(numpy_vector_db):
+    # Seuls les documents d'index >= 1 sont candidats
+    assert numpy_vector_db.similarity_search("cats are cute", limit=2, metadata_filter={"index": {"gte": 1}}) == ["cats and dogs", "dogs are loyal"]
+    assert numpy_vector_db.similarity_search("cats are cute", limit=10, metadata_filter={"index": [3]}) == ["the stock market"]
+    assert numpy_vector_db.similarity_search("cats are cute", limit=10, metadata_filter={"index": 42}) == []
+    assert numpy_vector_db.similarity_search("cats are cute", limit=10, score_threshold=0.5) == ["cats are cute", "cats and dogs"]
+
+    queries = ["cats are cute", "dogs are loyal"]
+    search_kwargs = {"metadata_filter": {"index": {"lte": 2}}, "score_threshold": 0.1}
+    assert numpy_vector_db.similarity_search_batch(queries, limit=3, **search_kwargs) == [numpy_vector_db.similarity_search(query, limit=3, **search_kwargs) for query in queries]
+
+def test_numpy_vector_db_filter_with_index(mocker, random_vectors):
+    vector_db = numpy_vector_db_from_vectors(mocker, random_vectors, index="ivf")
+    for row, payload in enumerate(vector_db._payloads):
+        payload["tenant"] = "even" if row % 2 == 0 else "odd"
+
+    results = vector_db.similarity_search("0", limit=10, show_metadata=True, metadata_filter={"tenant": "odd"})
+
+    assert len(results) == 10
+    assert all(int(payload["text"]) % 2 == 1 for payload in results)
+    assert vector_db.similarity_search("1", limit=1, metadata_filter={"tenant": "odd"}, exact=True) == ["1"]
+
+def test_text_store_keeps_texts_out_of_qdrant(tmp_path, mock_client, mock_embedder):
+    text_store = SQLiteStore(str(tmp_path / "texts.sqlite"), table="texts")
+    qdrant = Qdrant(location="localhost", port=1234, collection_name="test_collection", embedder=mock_embedder, text_store=text_store)
+    qdrant.client = mock_client
+    mock_embedder.embed_documents.side_effect = lambda documents, loading_bar : [[0.1, 0.2, 0.3]] * len(documents)
+    documents = [DocumentHandler(page_content="a long chunk", metadata={"source": "a.pdf"})]
+
+    qdrant.add_documents(documents)
+
+    record = mock_client.upload_records.call_args.kwargs["records"][0]
+    # Le point garde le même ID, mais son texte est dans le store local
+    assert record.id == point_id({"source": "a.pdf", "text": "a long chunk"})
+    assert record.payload == {"source": "a.pdf"}
+    assert text_store.get(record.id) == "a long chunk"
+
+    mock_client.search.return_value = [ScoredPoint(id=record.id, version=0, payload={"source": "a.pdf"}, score=0.9)]
+    assert qdrant.similarity_search("query", limit=1) == ["a long chunk"]
+    assert mock_client.search.call_args.kwargs["with_payload"] is False
+    assert qdrant.similarity_search("query", limit=1, show_metadata=True) == [{"source": "a.pdf", "text": "a long chunk"}]
+    assert qdrant.similarity_search_with_scores("query", limit=1) == [["a long chunk", 0.9]]
+
+    qdrant.delete_collection()
+    assert len(text_store) == 0